@@ -1,11 +1,13 @@
 import streamlit as st
 from utils.io import load_data
-from utils.prep import make_tables
+from utils.prep import make_tables, masked_metrics, missing_sums
+from utils import figcache
+from utils.search import search, default_selection
 from sections import intro, overview, deep_dives, conclusions
 from scripts.download_data import download_all
 from utils.constants import (
-    PAGE_TITLE, PAGE_ICON, CACHE_FILE, AVAILABLE_YEARS, 
-    DEFAULT_YEAR, METRICS, METRIC_LABELS
+    PAGE_TITLE, PAGE_ICON, CACHE_FILE, CACHE_VERSION, AVAILABLE_YEARS, 
+    DEFAULT_YEAR, METRICS, METRIC_LABELS, SNAPSHOT_MANIFEST, DEEP_DIVES_DEFAULT_COMMUNES
 )
 
 # --- Page Configuration ---
@@ -46,7 +48,10 @@ def get_app_data():
     # 1. Try Loading from Disk
     if os.path.exists(CACHE_FILE):
         try:
-            return pd.read_pickle(CACHE_FILE)
+            cached = pd.read_pickle(CACHE_FILE)
+            # Older pickles lack the precomputed lookups, rebuild them
+            if cached.get("version") == CACHE_VERSION:
+                return cached
         except Exception as e:
             st.warning(f"Cache corrupted, rebuilding... ({e})")
             
@@ -67,6 +72,28 @@ def get_app_data():
                 
         return tables
 
+def commune_selector(search_index, label, key, n_default=0):
+    """
+    Search-as-you-type commune picker. Only the current selection and the matches
+    for the typed text are sent to the browser, whatever the number of communes.
+    Returns:
+        list: INSEE codes of the selected communes (names are not unique)
+    """
+    codes, labels, pos = search_index['codes'], search_index['labels'], search_index['code_pos']
+    if key not in st.session_state:
+        # Alphabetically first communes, as the full-list multiselect used to default to
+        st.session_state[key] = default_selection(search_index, n_default)
+    # Codes no longer in the index (data rebuilt) are dropped
+    selected = [c for c in st.session_state[key] if c in pos]
+
+    query = st.text_input(label, key=f"{key}_query", placeholder="Type a commune name...")
+    matches = codes[search(search_index, query)].tolist()
+    options = selected + [m for m in matches if m not in selected]
+    picked = st.multiselect("Selected communes", options, default=selected, format_func=lambda c: labels[pos[c]],
+                            label_visibility="collapsed")
+    st.session_state[key] = picked
+    return picked
+
 def main():
     # --- Sidebar Navigation ---
     with st.sidebar:
@@ -103,42 +130,61 @@ def main():
         if not tables:
             st.error("Failed to load data.")
             st.stop()
+        # Figures exported by scripts/export_static.py for this data version: served without rebuilding
+        figcache.seed(SNAPSHOT_MANIFEST, tables["fingerprint"])
             
         # Common Filters
         # 2. Year Selection - Improved Interaction
         avail_years = AVAILABLE_YEARS
+        # Projected / interpolated years extend the timeline when requested
+        if "projections" in tables and st.toggle("Include projections", value=False):
+            avail_years = sorted(set(AVAILABLE_YEARS) | set(tables["projections"]["years"]))
         # Use a slider for a clearer "timeline" feel
         focus_year = st.select_slider("Select Data Year", options=avail_years, value=DEFAULT_YEAR)
+        if focus_year not in AVAILABLE_YEARS:
+            st.caption(f"🔮 {focus_year} is {tables['projections']['kind'][focus_year]} from the observed vintages "
+                       "(Overview trend only).")
         
         # Logic: We keep all years up to the focus year for trends
         selected_years = [y for y in avail_years if y <= focus_year]
         
         metric_options = METRICS
         metric = st.selectbox("Primary Metric", metric_options, format_func=lambda x: METRIC_LABELS.get(x, x))
+
+        # Vintages lacking source columns: the affected metrics are blank there, not 0
+        masked = masked_metrics(tables.get("schema", {}))
+        lacking = missing_sums(tables.get("schema", {}))
+        gaps = [y for y in selected_years if metric in masked.get(y, [])]
+        if gaps:
+            st.caption(f"⚠️ {METRIC_LABELS.get(metric, metric)} is not available for {', '.join(map(str, gaps))}.")
+        if masked:
+            with st.expander("Data coverage"):
+                for year, metrics in sorted(masked.items()):
+                    metrics = [m for m in metrics if m in METRIC_LABELS]
+                    st.markdown(f"**{year}** lacks {', '.join(lacking[year])}: "
+                                f"{', '.join(METRIC_LABELS.get(m, m) for m in metrics)} not available.")
         
         # Region Filter for Deep Dives & Overview (Map Pin-pointing)
         selected_regions = []
-        if page in ["Overview", "Deep Dives"]:
+        if page in ["Overview", "Deep Dives"] and "search" in tables:
             # 3. Region Filter
-            all_communes = sorted(tables['by_region']['nom'].unique().tolist())
-            # Default empty for Overview to show full map initially
-            default_regions = [] 
-            if page == "Deep Dives":
-                 # Pre-select for deep dives demo if desired, or keep empty
-                 default_regions = all_communes[:4] if len(all_communes) > 4 else all_communes
-                 # Reset default for Deep Dives to empty if user prefers, but existing logic had defaults. 
-                 # Let's keep existing default logic for Deep Dives but empty for Overview.
-                 pass
-
+            # Default empty for Overview to show full map initially, first communes for Deep Dives
             label = "Select Communes to Compare" if page == "Deep Dives" else "🔎 Pinpoint Commune on Map"
-            selected_regions = st.multiselect(label, all_communes, default=default_regions if page == "Deep Dives" else [])
+            selected_regions = commune_selector(
+                tables["search"], label, key=f"regions_{page}", n_default=DEEP_DIVES_DEFAULT_COMMUNES if page == "Deep Dives" else 0
+            )
 
         if st.button("🔄 Reset Cache"):
             if os.path.exists(CACHE_FILE):
                 os.remove(CACHE_FILE)
                 st.cache_data.clear()
+                figcache.clear()
                 st.rerun()
 
+        fig_stats = figcache.cache_stats()
+        st.caption(f"Figure cache: {fig_stats['hits']} hits / {fig_stats['misses']} misses "
+                   f"({fig_stats['entries']} figures, {fig_stats['bytes'] / 1e6:.1f} MB)")
+
     # --- Router ---
     if page == "Introduction":
         intro.render()
@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+import argparse
+import pandas as pd
+
+# Add project root to sys.path to import utils
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.constants import DATA_DIR, CACHE_FILE, VALIDATION_REPORT
+from utils.io import load_data
+from utils.prep import make_tables
+
+def build(data_dir=DATA_DIR, report_path=VALIDATION_REPORT, cache_path=CACHE_FILE):
+    """
+    Build the tables, write the validation report and, when it is clean, the app cache.
+    Returns:
+        int: exit code (0 ok, 1 validation violations, 2 no data)
+    """
+    print("--- Data Build ---")
+    tiles_data, communes_gdf = load_data(data_dir)
+    if not tiles_data or communes_gdf is None:
+        print("❌ No data found. Run `make download` first.")
+        return 2
+
+    print(f"⚙️  Building tables for {sorted(tiles_data)}...")
+    tables = make_tables(_tiles_data=tiles_data, _communes_gdf=communes_gdf)
+    if not tables:
+        print("❌ Table build failed.")
+        return 2
+
+    report = dict(tables["validation"], fingerprint=tables["fingerprint"], schema=tables["schema"])
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"📝 Validation report written to {report_path}")
+
+    for message in report["warnings"]:
+        print(f"⚠️  {message}")
+    if report["violations"]:
+        for message in report["violations"]:
+            print(f"❌ {message}")
+        print(f"\n{len(report['violations'])} violation(s), cache not written.")
+        return 1
+
+    if cache_path:
+        pd.to_pickle(tables, cache_path)
+        print(f"✅ Cache saved to {cache_path}")
+    print("\nDone.")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and validate the processed tables.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--report", default=VALIDATION_REPORT, help="validation report (JSON)")
+    parser.add_argument("--no-cache", action="store_true", help="validate only, do not write the app cache")
+    args = parser.parse_args()
+
+    sys.exit(build(args.data_dir, args.report, None if args.no_cache else CACHE_FILE))
@@ -0,0 +1,89 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+
+# Add project root to sys.path to import utils
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plotly.offline import get_plotlyjs
+from utils.constants import CACHE_FILE, DATA_DIR
+from utils.io import load_cache
+from utils.reports import report_context, profile_html, report_codes, report_names, index_html
+
+REPORTS_DIR = os.path.join(DATA_DIR, "reports")
+CHUNK_SIZE = 200
+
+# Per-process state. With the fork start method the workers inherit the parent's
+# tables copy-on-write; otherwise the initializer loads them once per worker.
+_worker = {}
+
+def _init_worker(cache_path, year):
+    if 'tables' not in _worker:
+        _worker['tables'] = pd.read_pickle(cache_path)
+    _worker['context'] = report_context(_worker['tables'], year)
+
+def _render_chunk(codes, out_dir):
+    """Render and write the profiles of a chunk of codes. Returns the number written."""
+    written = 0
+    for code in codes:
+        page = profile_html(_worker['tables'], _worker['context'], code)
+        if page is None:
+            continue
+        path = os.path.join(out_dir, f"{code}.html")
+        # Write then rename, so an interrupted run never leaves a partial profile behind
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(page)
+        os.replace(path + ".tmp", path)
+        written += 1
+    return written
+
+def build_reports(codes=None, out_dir=REPORTS_DIR, year=None, workers=None, force=False, cache_path=CACHE_FILE):
+    """
+    Write one static HTML profile per commune. Existing profiles are skipped unless
+    `force`, so an interrupted run resumes where it stopped.
+    Returns:
+        int: exit code
+    """
+    tables = load_cache(cache_path)
+    if tables is None:
+        return 2
+
+    year = year or tables['index']['years'][-1]
+    available = set(report_codes(tables, year))
+    codes = [c for c in (codes or sorted(available)) if c in available]
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "plotly.min.js"), "w", encoding="utf-8") as f:
+        f.write(get_plotlyjs())
+
+    todo = [c for c in codes if force or not os.path.exists(os.path.join(out_dir, f"{c}.html"))]
+    print(f"📄 {len(codes)} profiles, {len(codes) - len(todo)} already done, {len(todo)} to render")
+
+    # Loaded in the parent: forked workers share it; spawned workers reload it in the initializer
+    _worker['tables'] = tables
+    chunks = [todo[i:i + CHUNK_SIZE] for i in range(0, len(todo), CHUNK_SIZE)]
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cache_path, year)) as pool:
+        futures = [pool.submit(_render_chunk, chunk, out_dir) for chunk in chunks]
+        for future in as_completed(futures):
+            done += future.result()
+            print(f"   {done}/{len(todo)}", end="\r")
+
+    names = report_names(tables, codes, year)
+    entries = [(c, names[c], f"{c}.html") for c in codes if os.path.exists(os.path.join(out_dir, f"{c}.html"))]
+    with open(os.path.join(out_dir, "index.html"), "w", encoding="utf-8") as f:
+        f.write(index_html(entries))
+    print(f"\n✅ {len(entries)} profiles in {out_dir}")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate static per-commune profile reports.")
+    parser.add_argument("codes", nargs="*", help="INSEE codes (default: every commune)")
+    parser.add_argument("--out", default=REPORTS_DIR)
+    parser.add_argument("--year", type=int, default=None, help="report year (default: latest)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="re-render existing profiles")
+    args = parser.parse_args()
+
+    sys.exit(build_reports(args.codes or None, args.out, args.year, args.workers, args.force))
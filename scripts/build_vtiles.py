@@ -0,0 +1,46 @@
+import os
+import sys
+import time
+import argparse
+
+# Add project root to sys.path to import utils
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.constants import CACHE_FILE, VTILES_DIR
+from utils.io import load_cache
+from utils.vtiles import commune_layer, grid_layer, build_layer
+
+def build_vtiles(out_dir=VTILES_DIR, grid=False, cache_path=CACHE_FILE):
+    """
+    Cut the commune map (and optionally the 1 km grid) into vector tile pyramids,
+    one MBTiles file per layer, served by scripts/serve_api.py under /tiles/<layer>/.
+    Returns:
+        int: exit code
+    """
+    tables = load_cache(cache_path)
+    if tables is None:
+        return 2
+
+    os.makedirs(out_dir, exist_ok=True)
+    layers = {"communes": commune_layer}
+    if grid:
+        if not tables["tiles"]["years"]:
+            print("❌ No tile panel in the cache, the grid layer cannot be built.")
+            return 2
+        layers["grid"] = grid_layer
+    for name, source in layers.items():
+        start = time.perf_counter()
+        geoms, props = source(tables)
+        path = os.path.join(out_dir, f"{name}.mbtiles")
+        n = build_layer(path, name, geoms, props, tables["fingerprint"])
+        print(f"✅ {name}: {len(geoms)} features, {n} tiles, {os.path.getsize(path) / 1e6:.1f} MB "
+              f"in {time.perf_counter() - start:.0f}s")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build vector tile pyramids (MBTiles) of the map layers.")
+    parser.add_argument("--out", default=VTILES_DIR)
+    parser.add_argument("--grid", action="store_true", help="also build the 1 km grid layer (slow)")
+    args = parser.parse_args()
+
+    sys.exit(build_vtiles(args.out, args.grid))
@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import html
+import argparse
+from datetime import datetime, timezone
+
+# Add project root to sys.path to import utils
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plotly.offline import get_plotlyjs
+from utils.constants import CACHE_FILE, CACHE_VERSION, METRICS, METRIC_LABELS, DEFAULT_YEAR, STATIC_DIR
+from utils.io import load_cache
+from utils.snapshot import state_figures, content_name
+from utils.viz import map_3d_deck
+
+PAGE = """<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><title>{title}</title>
+<script src="{plotlyjs}"></script>
+<style>body {{ font-family: system-ui, sans-serif; color: #1E293B; background: #F8FAFC; margin: 2rem; }}
+iframe {{ width: 100%; height: 700px; border: 0; }}</style></head>
+<body><h1>{title}</h1><p><a href="index.html">All snapshots</a></p>
+{figures}
+<h2>Map</h2><iframe src="{map}" loading="lazy"></iframe>
+</body></html>
+"""
+
+def _write(out_dir, name, payload):
+    """Write a content-addressed asset once (same name = same content)."""
+    path = os.path.join(out_dir, name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(payload)
+    return name
+
+def export(out_dir=STATIC_DIR, cache_path=CACHE_FILE):
+    """
+    Export every metric x year default state as static, content-hashed assets:
+    figure specs (JSON), one HTML page per state, one map page per metric, an
+    index and manifest.json (which the app uses to seed its figure cache).
+    Returns:
+        int: exit code
+    """
+    tables = load_cache(cache_path)
+    if tables is None:
+        return 2
+
+    os.makedirs(out_dir, exist_ok=True)
+    plotlyjs = _write(out_dir, content_name("plotly", get_plotlyjs(), "js"), get_plotlyjs())
+    years = tables["index"]["years"]
+    manifest = {
+        "version": CACHE_VERSION,
+        "fingerprint": tables["fingerprint"],
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "default": {"metric": "avg_income", "year": DEFAULT_YEAR},
+        "pages": {}, "maps": {}, "figures": []
+    }
+
+    for metric in METRICS:
+        # The 3D map only depends on the metric (latest vintage geometry)
+        deck = map_3d_deck(tables["geo"], metric)
+        if deck is not None:
+            page = deck.to_html(as_string=True, notebook_display=False)
+            manifest["maps"][metric] = _write(out_dir, content_name(f"maps/{metric}", page, "html"), page)
+
+        for year in years:
+            blocks = []
+            for name, key, build in state_figures(tables, metric, year):
+                fig = build()
+                if fig is None:
+                    continue
+                spec = fig.to_json()
+                file = _write(out_dir, content_name(f"figures/{metric}-{year}-{name}", spec, "json"), spec)
+                manifest["figures"].append({"key": key, "file": file, "metric": metric, "year": year})
+                blocks.append(fig.to_html(full_html=False, include_plotlyjs=False))
+
+            title = f"{METRIC_LABELS.get(metric, metric)} · {year}"
+            page = PAGE.format(title=html.escape(title), plotlyjs=plotlyjs, figures="".join(blocks),
+                               map=manifest["maps"].get(metric, ""))
+            manifest["pages"][f"{metric}/{year}"] = _write(out_dir, content_name(f"{metric}-{year}", page, "html"), page)
+        print(f"✅ {metric}")
+
+    # Entry points keep fixed names; they are the only files to serve without long-lived caching
+    default = manifest["pages"].get(f"avg_income/{DEFAULT_YEAR}")
+    links = "".join(
+        f'<li><a href="{html.escape(page)}">{html.escape(state)}</a></li>' for state, page in manifest["pages"].items()
+    )
+    with open(os.path.join(out_dir, "index.html"), "w", encoding="utf-8") as f:
+        f.write(
+            '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Dashboard snapshots</title></head><body>'
+            f'<h1>Dashboard snapshots</h1><p><a href="{html.escape(default or "")}">Default view</a></p>'
+            f'<ul>{links}</ul></body></html>'
+        )
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        # numpy scalars (years in the cache keys) as plain numbers
+        json.dump(manifest, f, indent=1, default=lambda o: o.item())
+    print(f"\n📦 {len(manifest['figures'])} figures, {len(manifest['pages'])} pages in {out_dir}")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the dashboard default states as static assets.")
+    parser.add_argument("--out", default=STATIC_DIR)
+    args = parser.parse_args()
+
+    sys.exit(export(args.out))
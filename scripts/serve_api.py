@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import gzip
+import json
+import hashlib
+import argparse
+import threading
+import urllib.request
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# Add project root to sys.path to import utils
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.constants import CACHE_FILE, ARROW_DIR, API_PORT, API_CACHE_SIZE
+from utils.io import load_cache
+from utils.api import load_api_data, ROUTES, encode, vector_tile, MVT_TYPE
+
+def _params(query):
+    """Query string as {name: [values]}, comma-separated values split (?codes=01004,74010)."""
+    return {k: [p for v in vals for p in v.split(',') if p] for k, vals in parse_qs(query).items()}
+
+def _reason(error):
+    """Error message for a client response (KeyError quotes its message, the others do not)."""
+    return str(error.args[0]) if isinstance(error, KeyError) and error.args else str(error)
+
+def make_server(api, port=API_PORT, host="127.0.0.1"):
+    """
+    Threaded HTTP server over the loaded API data. Responses are rendered once per
+    (path, query, body, format, gzip) and kept in an LRU cache; the ETag is derived
+    from the data fingerprint, so it changes only when the data is rebuilt.
+    """
+    @lru_cache(maxsize=API_CACHE_SIZE)
+    def render(path, query, body, fmt, compress):
+        params = _params(query)
+        route = ROUTES[path]
+        table = route(api, params, body) if path == '/territories' else route(api, params)
+        return encode(table, fmt, compress)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body=b"", headers=()):
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            # The dashboard map fetches tiles from another origin (the Streamlit port)
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def _error(self, status, message):
+            self._send(status, json.dumps({"error": message}).encode("utf-8"), [("Content-Type", "application/json")])
+
+        def _tile(self, path):
+            try:
+                data = vector_tile(api, path)
+            except (KeyError, ValueError) as e:
+                return self._error(404, _reason(e))
+            etag = '"' + hashlib.sha1(f"{api['fingerprint']}|{path}".encode("utf-8")).hexdigest()[:20] + '"'
+            headers = [("ETag", etag), ("Cache-Control", "no-cache")]
+            if self.headers.get('If-None-Match') == etag:
+                return self._send(304, headers=headers)
+            if not data:
+                return self._send(204, headers=headers)
+            headers.append(("Content-Type", MVT_TYPE))
+            # Stored gzipped; decompressed only for clients that cannot take it
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                headers.append(("Content-Encoding", "gzip"))
+            else:
+                data = gzip.decompress(data)
+            self._send(200, data, headers)
+
+        def _handle(self, body=None):
+            url = urlsplit(self.path)
+            if url.path.startswith('/tiles/'):
+                return self._tile(url.path)
+            if url.path == '/health':
+                health = {"fingerprint": api['fingerprint'], "tiles": list(api['vtiles'])}
+                return self._send(200, json.dumps(health).encode("utf-8"), [("Content-Type", "application/json")])
+            if url.path not in ROUTES:
+                return self._error(404, f"unknown path {url.path}; try {', '.join(ROUTES)}")
+
+            fmt = _params(url.query).get('format', [''])[0]
+            if fmt not in ('arrow', 'json'):
+                fmt = 'arrow' if 'arrow' in self.headers.get('Accept', '') else 'json'
+            compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+            etag = '"' + hashlib.sha1(
+                f"{api['fingerprint']}|{url.path}|{url.query}|{fmt}|{compress}".encode("utf-8") + (body or b"")
+            ).hexdigest()[:20] + '"'
+            headers = [("ETag", etag), ("Cache-Control", "no-cache"), ("Vary", "Accept, Accept-Encoding")]
+            if self.headers.get('If-None-Match') == etag:
+                return self._send(304, headers=headers)
+
+            # Malformed parameters or posted definitions are the client's error
+            try:
+                payload, ctype, gzipped = render(url.path, url.query, body, fmt, compress)
+            except (KeyError, ValueError, TypeError) as e:
+                return self._error(400, _reason(e))
+            headers.append(("Content-Type", ctype))
+            if gzipped:
+                headers.append(("Content-Encoding", "gzip"))
+            self._send(200, payload, headers)
+
+        def do_GET(self):
+            self._handle()
+
+        def do_HEAD(self):
+            self._handle()
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            self._handle(self.rfile.read(length) if length else None)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+def bench(server, n_requests, concurrency=8):
+    """
+    Fire `n_requests` at a running server from a thread pool over a few typical
+    queries (first pass fills the response cache). Returns requests per second.
+    """
+    base = f"http://{server.server_address[0]}:{server.server_address[1]}"
+    paths = ["/timeseries", "/communes", "/communes?format=arrow", "/communes?metrics=avg_income,poverty_rate",
+             "/bands?format=arrow", "/territories?preset=Ain%20(01)"]
+
+    def fetch(i):
+        request = urllib.request.Request(base + paths[i % len(paths)], headers={"Accept-Encoding": "gzip"})
+        with urllib.request.urlopen(request) as response:
+            return len(response.read())
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        sizes = list(pool.map(fetch, range(n_requests)))
+    elapsed = time.perf_counter() - start
+    print(f"📄 {n_requests} requests, {sum(sizes) / 1e6:.1f} MB in {elapsed:.2f}s: {n_requests / elapsed:,.0f} req/s")
+    return n_requests / elapsed
+
+def serve(port=API_PORT, host="127.0.0.1", n_bench=0, cache_path=CACHE_FILE, arrow_dir=ARROW_DIR):
+    """
+    Serve the processed tables read-only over HTTP (or benchmark the server
+    with `n_bench` requests and exit).
+    Returns:
+        int: exit code
+    """
+    tables = load_cache(cache_path)
+    if tables is None:
+        return 2
+    api = load_api_data(tables, arrow_dir)
+
+    server = make_server(api, 0 if n_bench else port, host)
+    if n_bench:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        bench(server, n_bench)
+        server.shutdown()
+        return 0
+
+    print(f"✅ Serving {', '.join(ROUTES)} on http://{host}:{port} (data {api['fingerprint']})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the processed tables as a local read-only API.")
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--bench", type=int, default=0, metavar="N", help="run N requests against the server and exit")
+    args = parser.parse_args()
+
+    sys.exit(serve(args.port, args.host, args.bench))
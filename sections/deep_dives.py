@@ -1,267 +1,727 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
+from streamlit_option_menu import option_menu
 from utils.viz import (
     bar_chart, distribution_chart, line_chart, 
     correlation_matrix, population_pyramid, 
-    housing_mix_chart, scatter_plot
+    housing_mix_chart, scatter_plot, map_chart_categorical, gradient_chart,
+    movers_chart, map_chart_diverging, map_chart_tiles, qualitative_palette
 )
-from utils.prep import get_commune_comparison
+from utils.index import year_view, code_rows
+from utils.search import code_labels
+from utils.stats import selection_means
+from utils.correlation import correlation_ci
+from utils.models import cached_decay_fit
+from utils.spatial import spatial_autocorrelation
+from utils.bands import cached_band_index, ring_table, uniform_rings
+from utils.change import CHANGE_KINDS, cached_pair_changes, top_movers
+from utils.similarity import matched_communes
+from utils.clustering import cached_typology, cluster_labels
+from utils.tiles import cached_tile_change
+from utils.territories import cached_territory_table
+from utils.constants import (
+    ATTRACTORS, DECAY_MODELS, DECAY_FIT, LISA_COLORS, BAND_DEFAULTS, SIMILARITY_K, CLUSTER_K,
+    INEQUALITY_METRICS, TILE_METRICS, TERRITORY_PRESETS, DEFAULT_TERRITORIES, COMPARISON_METRICS
+)
+
+AVAIL_METRICS = [
+    "avg_income", "poverty_rate", "ownership_rate", "social_housing_rate",
+    "youth_pct", "senior_pct", "old_housing_pct", "new_housing_pct",
+    "single_parent_pct"
+]
+# Commune-level only (not summable, so not available for ring aggregates or the change panel)
+EXPLORE_METRICS = AVAIL_METRICS + INEQUALITY_METRICS
 
 def render(tables, metric="avg_income", regions=None, selected_years=None):
     st.header("Deep Analysis Laboratory")
     
     df_regions = tables["by_region"]
+    index = tables["index"]
     
-    # Filter by selected years if provided
-    if selected_years:
-        df_regions = df_regions[df_regions["year"].isin(selected_years)]
-        if df_regions.empty:
-            st.error("No data available for the selected years.")
-            return
-
-    latest_year = df_regions["year"].max()
-    latest_data = df_regions[df_regions["year"] == latest_year]
+    # Filter by selected years if provided (index lookups, no full-frame masks)
+    years = [y for y in (selected_years or index["years"]) if y in index["year_slices"]]
+    # Commune-level analyses need observed data: estimated years stay on the Overview trend
+    estimated = [y for y in (selected_years or []) if y not in index["year_slices"]]
+    if estimated:
+        st.info(f"Deep Dives use observed vintages only; estimated years ({', '.join(map(str, estimated))}) "
+                "are shown on the Overview trend.")
+    if not years:
+        st.error("No data available for the selected years.")
+        return
+
+    latest_year = max(years)
+    latest_data = year_view(df_regions, index, latest_year)
+    latest_stats = tables["stats"].get(latest_year, {})
+    # Rows of the sidebar selection in the latest year, shared by the tabs below
+    selected_latest = df_regions.iloc[code_rows(index, regions, [latest_year])] if regions else latest_data
+    # Figure cache keys: data version, year and selection the charts depend on
+    version = tables["fingerprint"]
+    selection_key = (version, latest_year, tuple(regions or ()))
     
-    # Tabs for different analysis modes
-    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
-        "🇨🇭 The Geneva Gravity",
-        "🌍 Regional Comparison", 
-        "🔗 Correlations", 
-        "👥 Demographics", 
-        "🏠 Housing", 
-        "🔎 Scatter Explorer"
-    ])
+    ctx = {
+        "tables": tables,
+        "df_regions": df_regions,
+        "index": index,
+        "metric": metric,
+        "regions": regions,
+        "region_labels": code_labels(tables["search"], regions or []),
+        "years": years,
+        "latest_year": latest_year,
+        "latest_data": latest_data,
+        "latest_stats": latest_stats,
+        "selected_latest": selected_latest,
+        "version": version,
+        "selection_key": selection_key,
+    }
     
-    # --- Tab 1: Geneva Gravity (New!) ---
-    with tab1:
-        st.subheader("The Geneva Gravity Model")
-        st.markdown("""
-        To scientifically test whether the "Geneva Effect" dominates local prosperity, we calculated the precise geodesic distance of every commune from Geneva's center.
-        
-        **The Hypothesis:** *Wealth behaves like gravity—it is strongest at the source (the border) and decays as you move away.*
+    # Tab selector instead of st.tabs: hidden tabs do no work until opened
+    tab = option_menu(
+        menu_title=None,
+        options=list(TABS),
+        orientation="horizontal",
+        key="deep_dives_tab",
+        styles={
+            "container": {"padding": "0!important", "background-color": "transparent"},
+            "nav-link": {"font-size": "14px", "margin": "2px", "--hover-color": "#E2E8F0"},
+            "nav-link-selected": {"background-color": "#3B82F6", "color": "white", "font-weight": "600"},
+        }
+    )
+    TABS[tab](ctx)
+
+@st.fragment
+def _gravity_tab(ctx):
+    """Distance-decay scatter with fitted decay curves."""
+    latest_data, latest_year, regions = ctx["latest_data"], ctx["latest_year"], ctx["regions"]
+    version = ctx["version"]
+
+    st.subheader("The Geneva Gravity Model")
+    st.markdown("""
+    To scientifically test whether the "Geneva Effect" dominates local prosperity, we calculated the precise geodesic distance of every commune from Geneva's center.
+
+    **The Hypothesis:** *Wealth behaves like gravity—it is strongest at the source (the border) and decays as you move away.*
+    """)
+
+    if 'dist_geneva_km' in latest_data.columns:
+        # Scatter Plot: Distance vs Income, with fitted decay curves on top
+        st.markdown("### 📉 The Decay Curve: Income vs. Distance")
+        c1, c2, c3, c4 = st.columns(4)
+        decay_metric = c1.selectbox("Metric", AVAIL_METRICS, index=0, key="decay_metric")
+        attractor = c2.selectbox(
+            "Attractor", list(ATTRACTORS), key="decay_attractor",
+            format_func=lambda k: ATTRACTORS[k]['name']
+        )
+        models = c3.multiselect(
+            "Fitted models", list(DECAY_MODELS), default=["piecewise"], key="decay_models",
+            format_func=lambda k: DECAY_MODELS[k]
+        )
+        with_ci = c4.toggle("Bootstrap CIs", value=False, key="decay_ci")
+        n_boot = DECAY_FIT['n_boot'] if with_ci else 0
+
+        # Cached per (metric, year, attractor, model): only the first fit costs anything
+        fits = [
+            cached_decay_fit(latest_data, version, decay_metric, latest_year, attractor, m, n_boot=n_boot)
+            for m in models
+        ]
+        # A model that fails on this data is reported and left out; the others are still drawn
+        for fit in fits:
+            if 'error' in fit:
+                st.warning(f"{DECAY_MODELS[fit['model']]}: {fit['error']} for {decay_metric.replace('_', ' ')} "
+                           f"in {latest_year}.")
+        fits = [fit for fit in fits if 'error' not in fit]
+        scatter_plot(
+            latest_data, 
+            x=f'dist_{attractor}_km', 
+            y=decay_metric, 
+            size='total_pop', 
+            color='poverty_rate' if decay_metric != 'poverty_rate' else 'avg_income', # Color by poverty to show the flip side
+            hover_name='nom',
+            year=latest_year,
+            highlight=regions,
+            cache_key=version,
+            fits=fits
+        )
+
+        if fits:
+            rows = []
+            for fit in fits:
+                for param, value in fit['params'].items():
+                    lo, hi = fit['ci'].get(param, (None, None))
+                    rows.append({
+                        "Model": DECAY_MODELS[fit['model']],
+                        "Parameter": param,
+                        "Estimate": value,
+                        "95% CI low": lo,
+                        "95% CI high": hi,
+                        "Weighted R²": fit['r2']
+                    })
+            with st.expander("📐 Fitted decay parameters (population-weighted)"):
+                st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+
+        # Distance rings: sums of the base columns per ring, ratios recomputed per ring
+        st.markdown("### 🎯 The Gradient: Distance Rings")
+        r1, r2 = st.columns(2)
+        ring_width = r1.slider("Ring width (km)", 1, 20, BAND_DEFAULTS['width_km'], key="ring_width")
+        ring_max = r2.slider("Max distance (km)", 20, 300, BAND_DEFAULTS['max_km'], step=10, key="ring_max")
+        bands = cached_band_index(ctx["tables"], version, latest_year, attractor)
+        rings = ring_table(bands, uniform_rings(ring_width, ring_max))
+        gradient_chart(
+            rings[rings['n_communes'] > 0], decay_metric, attractor, latest_year,
+            cache_key=(version, ring_width, ring_max)
+        )
+
+        st.markdown(f"""
+        ### 🧬 Analysis: Visualizing the "Tilt"
+
+        The chart above provides irrefutable visual proof of the project's core narrative:
+
+        1.  **The "Frontalier" Peak (0-10km):** The wealthiest communes are exclusively clustered within the first **10km**. Here, incomes skyrocket above **€40k-€50k**.
+        2.  **The Gravity Well:** As distance increases, wealth drops sharply. By **20km out**, the average income stabilizes at the national baseline.
+        3.  **The Poverty Gradient:** Notice the color shift. The dots turn from "wealthy blue/purple" to "poorer yellow/green" as you move right (further away), confirming that poverty is effectively pushed to the periphery.
+
+        *The "Rising Tide" of the national economy is minor compared to this purely geographic "Gravity".*
         """)
-        
-        if 'dist_geneva_km' in latest_data.columns:
-            # Scatter Plot: Distance vs Income
-            st.markdown("### 📉 The Decay Curve: Income vs. Distance")
-            scatter_plot(
-                latest_data, 
-                x='dist_geneva_km', 
-                y='avg_income', 
-                size='total_pop', 
-                color='poverty_rate', # Color by poverty to show the flip side
-                hover_name='nom',
-                year=latest_year
-            )
-            
-            st.markdown(f"""
-            ### 🧬 Analysis: Visualizing the "Tilt"
-            
-            The chart above provides irrefutable visual proof of the project's core narrative:
-            
-            1.  **The "Frontalier" Peak (0-10km):** The wealthiest communes are exclusively clustered within the first **10km**. Here, incomes skyrocket above **€40k-€50k**.
-            2.  **The Gravity Well:** As distance increases, wealth drops sharply. By **20km out**, the average income stabilizes at the national baseline.
-            3.  **The Poverty Gradient:** Notice the color shift. The dots turn from "wealthy blue/purple" to "poorer yellow/green" as you move right (further away), confirming that poverty is effectively pushed to the periphery.
-            
-            *The "Rising Tide" of the national economy is minor compared to this purely geographic "Gravity".*
-            """)
+    else:
+        st.error("Distance data not found. Please check data processing.")
+
+@st.fragment
+def _comparison_tab(ctx):
+    """Top communes / custom comparison and the metric distribution."""
+    df_regions, index, metric = ctx["df_regions"], ctx["index"], ctx["metric"]
+    regions, years, latest_year = ctx["regions"], ctx["years"], ctx["latest_year"]
+    latest_stats, selected_latest, version = ctx["latest_stats"], ctx["selected_latest"], ctx["version"]
+    selection_key = ctx["selection_key"]
+
+    st.subheader("Compare Communes")
+
+    if not regions:
+        st.info("💡 Select communes in the sidebar for a custom comparison. Showing Top 20 by default.")
+        top_rows = latest_stats.get(metric, {}).get('top')
+        if top_rows is None:
+            # A metric the vintage lacks is all NaN: there is nothing to rank
+            st.info(f"{metric.replace('_', ' ').title()} is not available for {latest_year}.")
         else:
-            st.error("Distance data not found. Please check data processing.")
-
-    # --- Tab 2: Regional Comparison ---
-    with tab2:
-        st.subheader("Compare Communes")
-        
-        if not regions:
-            st.info("💡 Select communes in the sidebar for a custom comparison. Showing Top 20 by default.")
-            top_data = latest_data.sort_values(metric, ascending=False).head(20)
-            bar_chart(top_data, metric, top_n=20, orientation='h', year=latest_year)
-            
+            top_data = df_regions.iloc[top_rows[:20]]
+            bar_chart(top_data, metric, top_n=20, orientation='h', year=latest_year, cache_key=(version, latest_year))
+
             # Geneva Proximity Insight
             if 'dist_geneva_km' in top_data.columns:
                 n_near_geneva = top_data[top_data['dist_geneva_km'] < 20].shape[0]
                 st.caption(f"🇨🇭 **Geneva Gravity Check:** {n_near_geneva} out of these 20 communes are located within **20km** of Geneva.")
-        else:
-            # Custom Comparison
-            # Ensure no duplicate metrics if 'metric' is already in the hardcoded list
-            # We must include 'avg_income' because it is used as a fallback 'sec_metric' below.
-            extra_metrics = ['avg_income', 'poverty_rate', 'total_pop', 'ownership_rate', 'youth_pct', 'social_housing_rate']
-            comp_metrics = [metric] + [m for m in extra_metrics if m != metric]
-
-            comp_data_full = get_commune_comparison(
-                df_regions, regions, 
-                comp_metrics
-            )
-            
-            if not comp_data_full.empty:
-                st.subheader(f"Analyzing: {', '.join(regions[:3])}...")
-                
-                # Latest year snapshot
-                comp_view = comp_data_full[comp_data_full["year"] == latest_year]
-                
-                c1, c2 = st.columns(2)
-                with c1:
-                    bar_chart(comp_view, metric, orientation='h', year=latest_year)
-                with c2:
-                    sec_metric = "poverty_rate" if metric != "poverty_rate" else "avg_income"
-                    bar_chart(comp_view, sec_metric, orientation='h', year=latest_year)
-                
-                st.markdown("### Evolution")
-                line_chart(comp_data_full, metric, title=f"History of {metric.replace('_', ' ')}")
-
-        st.markdown("---")
-        st.subheader(f"Distribution of {metric.replace('_', ' ').title()}")
-        
-        # Calculate Reference (Median)
-        ref_val = latest_data[metric].median()
-        distribution_chart(latest_data, metric, year=latest_year, ref_value=ref_val, ref_label="Median")
-        
-        with st.expander("ℹ️ Methodology Note"):
-            st.markdown(f"""
-            **What does this show?**
-            The histogram displays how {metric.replace('_', ' ')} is distributed across all communes.
-            
-            *   **Median Line ({ref_val:,.0f}):** Half of the communes are below this line, half are above.
-            *   **Shape:** A right-skewed distribution (tail to the right) usually indicates inequality (a few very wealthy outliers).
-            """)
-        
-        st.markdown("""
-        ### 🏙️ Analysis: The "Border Effect" & The Shift in Wealth Centers
-        
-        Comparing the data from **2015 to 2019** reveals a fascinating geographical shift in wealth distribution:
-
-        1.  **The Geneva Magnet:** The proximity to Switzerland is a decisive factor in communal wealth.
-            *   **2015:** Border towns like **Archamps** were already among the wealthiest.
-            *   **2017-2019:** We see the definitive rise and dominance of the "Frontalier" zone. Communes like **Sauverny**, **Archamps**, and **Beaumont** (all near the Swiss border) consistently surge to the top spots. **Sauverny** specifically marks a significant increase by 2019, approaching an average income of **50k €**.
-        2.  **Structural Stability:** Despite these shifts at the top, the **Distribution Histogram** remains remarkably stable. The "bell curve" of income remains centered around **21k-23k €**, proving that while the "ultra-wealthy" enclaves get richer (shifting the top bars right), the general population's economic reality has changed little over this 5-year period.
-
-        *This confirms our hypothesis: Geography (specifically proximity to economic powerhouses like Geneva) is a primary determinant of communal wealth in this territory.*
-        """)
+    else:
+        # Custom Comparison
+        # Ensure no duplicate metrics if 'metric' is already in the list
+        # COMPARISON_METRICS includes 'avg_income', used as a fallback 'sec_metric' below.
+        comp_metrics = [metric] + [m for m in COMPARISON_METRICS if m != metric]
 
-    # --- Tab 3: Correlations ---
-    with tab3:
-        st.subheader("Variable Correlations")
-        st.markdown("Explore how different socioeconomic factors relate to each other.")
-        
-        avail_metrics = [
-            "avg_income", "poverty_rate", "ownership_rate", "social_housing_rate",
-            "youth_pct", "senior_pct", "old_housing_pct", "new_housing_pct",
-            "single_parent_pct"
-        ]
-        
-        selected_corr_metrics = st.multiselect(
-            "Select variables to correlate:", 
-            avail_metrics,
-            default=["avg_income", "poverty_rate", "ownership_rate", "social_housing_rate", "youth_pct"]
-        )
-        
-        correlation_matrix(latest_data, selected_corr_metrics, year=latest_year)
-        
-        st.markdown("""
-        ### 🧬 Data-Driven Insights: Decoding the Matrix
-        
-        The correlation matrix above acts as a "truth table" for our territory, revealing three undeniable laws:
-        
-        1.  **The Exclusionary Nature of Wealth (`-0.65` Income vs. Poverty):** 
-            The extremely strong negative correlation confirms a "zero-sum" landscape. Wealth does not mix with poverty here; it displaces it. As you move closer to Geneva (where income rises), poverty essentially vanishes, creating "gated" economic zones.
-        
-        2.  **The "Concrete" Fountain of Youth (`+0.40` New Housing vs. Youth):**
-            There is a clear positive link between **New Housing** and **Youth**. This proves that **construction is the primary driver of demographic renewal**. Communes that build invite young families; those that don't age rapidly.
-        
-        3.  **The Great Generational Divide (`-0.77` Youth vs. Senior):**
-            The massive negative correlation between Youth and Seniors indicates **spatial segregation by age**. We don't see "mixed" intergenerational communes. Instead, we see "Young/Active" bedroom communities (likely near the border/new builds) versus "Aging/Retiree" villages (likely dominant in old housing).
-            
-        *Conclusion: To shift the "Rising Tide" (economy) into a demographic future, the territory relies entirely on its ability to build new housing.*
+        comp_cols = ['nom', 'year'] + [m for m in comp_metrics if m in df_regions.columns]
+        comp_data_full = df_regions.iloc[code_rows(index, regions, years)][comp_cols]
+
+        if not comp_data_full.empty:
+            st.subheader(f"Analyzing: {', '.join(ctx['region_labels'][:3])}...")
+
+            # Latest year snapshot
+            comp_view = selected_latest[comp_cols]
+
+            c1, c2 = st.columns(2)
+            with c1:
+                bar_chart(comp_view, metric, orientation='h', year=latest_year, cache_key=selection_key)
+            with c2:
+                sec_metric = "poverty_rate" if metric != "poverty_rate" else "avg_income"
+                bar_chart(comp_view, sec_metric, orientation='h', year=latest_year, cache_key=selection_key)
+
+            st.markdown("### Evolution")
+            line_chart(comp_data_full, metric, title=f"History of {metric.replace('_', ' ')}",
+                       cache_key=(version, tuple(years), tuple(regions)))
+
+            _twins_section(ctx)
+
+    st.markdown("---")
+    st.subheader(f"Distribution of {metric.replace('_', ' ').title()}")
+
+    # Reference (Median) and histogram come from the precomputed statistics store
+    metric_stats = latest_stats.get(metric, {})
+    ref_val = metric_stats.get('box', {}).get('median', float('nan'))
+    distribution_chart(metric_stats, metric, year=latest_year, ref_value=ref_val, ref_label="Median", cache_key=version)
+
+    with st.expander("ℹ️ Methodology Note"):
+        st.markdown(f"""
+        **What does this show?**
+        The histogram displays how {metric.replace('_', ' ')} is distributed across all communes.
+
+        *   **Median Line ({ref_val:,.0f}):** Half of the communes are below this line, half are above.
+        *   **Shape:** A right-skewed distribution (tail to the right) usually indicates inequality (a few very wealthy outliers).
         """)
 
-    # --- Tab 4: Demographics ---
-    with tab4:
-        st.subheader("Population Structure")
-        
-        target_data = latest_data # Default to national view (all rows)
-        
+    st.markdown("""
+    ### 🏙️ Analysis: The "Border Effect" & The Shift in Wealth Centers
+
+    Comparing the data from **2015 to 2019** reveals a fascinating geographical shift in wealth distribution:
+
+    1.  **The Geneva Magnet:** The proximity to Switzerland is a decisive factor in communal wealth.
+        *   **2015:** Border towns like **Archamps** were already among the wealthiest.
+        *   **2017-2019:** We see the definitive rise and dominance of the "Frontalier" zone. Communes like **Sauverny**, **Archamps**, and **Beaumont** (all near the Swiss border) consistently surge to the top spots. **Sauverny** specifically marks a significant increase by 2019, approaching an average income of **50k €**.
+    2.  **Structural Stability:** Despite these shifts at the top, the **Distribution Histogram** remains remarkably stable. The "bell curve" of income remains centered around **21k-23k €**, proving that while the "ultra-wealthy" enclaves get richer (shifting the top bars right), the general population's economic reality has changed little over this 5-year period.
+
+    *This confirms our hypothesis: Geography (specifically proximity to economic powerhouses like Geneva) is a primary determinant of communal wealth in this territory.*
+    """)
+
+def _twins_section(ctx):
+    """Matched comparison of the selected communes against their nearest structural twins."""
+    tables, df_regions, index = ctx["tables"], ctx["df_regions"], ctx["index"]
+    regions, latest_year = ctx["regions"], ctx["latest_year"]
+    if "similarity" not in tables:
+        return
+
+    st.markdown("### 🪞 Structural Twins: Communes Like These")
+    st.caption("Nearest neighbours on the standardized metrics; excluding the Geneva area turns them into an inland control group.")
+    c1, c2, c3 = st.columns(3)
+    k = c1.slider("Twins per commune", 1, 20, SIMILARITY_K, key="twins_k")
+    exclude_km = c2.slider("Exclude within (km of Geneva)", 0, 150, 50, step=10, key="twins_exclude")
+    weighted = c3.toggle("Population-weighted scaling", value=True, key="twins_weighted")
+
+    variant = tables["similarity"]["weighted" if weighted else "unweighted"]
+    if latest_year not in variant:
+        return
+    rows = code_rows(index, regions, [latest_year])
+    if len(rows) == 0:
+        st.info(f"None of the selected communes exists in {latest_year} (merged or dissolved), so there are no twins to match.")
+        return
+    twins = matched_communes(df_regions, variant[latest_year], rows, k=k, exclude_within_km=exclude_km or None)
+    if twins.empty:
+        st.warning("No comparable communes found.")
+        return
+
+    metrics = tables["similarity"]["metrics"]
+    selection, matched = selection_means(df_regions.iloc[rows], metrics), selection_means(twins, metrics)
+    comparison = pd.DataFrame({
+        "Selection": pd.Series(selection),
+        "Twins": pd.Series(matched),
+    })
+    comparison["Gap"] = comparison["Selection"] - comparison["Twins"]
+    comparison.index = [m.replace('_', ' ').title() for m in comparison.index]
+    st.dataframe(comparison.style.format("{:,.2f}"), use_container_width=True)
+
+    with st.expander(f"🔎 Matched communes ({len(twins)})"):
+        cols = ["match_for", "rank", "nom", "similarity_distance", "dist_geneva_km"] + metrics
+        st.dataframe(twins[[c for c in cols if c in twins.columns]], hide_index=True, use_container_width=True)
+
+@st.fragment
+def _correlations_tab(ctx):
+    """Weighted correlation heatmap and the quoted coefficients."""
+    tables, latest_year, version = ctx["tables"], ctx["latest_year"], ctx["version"]
+
+    st.subheader("Variable Correlations")
+    st.markdown("Explore how different socioeconomic factors relate to each other.")
+
+    selected_corr_metrics = st.multiselect(
+        "Select variables to correlate:", 
+        AVAIL_METRICS,
+        default=["avg_income", "poverty_rate", "ownership_rate", "social_housing_rate", "youth_pct"]
+    )
+
+    # Full weighted matrix is precomputed per year; the multiselect only slices it
+    corr = tables["correlations"][latest_year]
+    show_ci = st.toggle("Show bootstrap 95% confidence intervals", value=False)
+    ci = correlation_ci(tables, version, latest_year) if show_ci else None
+    correlation_matrix(corr, selected_corr_metrics, year=latest_year, ci=ci, cache_key=version)
+
+    def _r(a, b):
+        """Quoted coefficient, reproduced from the engine (with CI when computed)."""
+        text = f"{corr.loc[a, b]:+.2f}"
+        if ci is not None:
+            text += f", 95% CI [{ci[0].loc[a, b]:+.2f}, {ci[1].loc[a, b]:+.2f}]"
+        return text
+
+    st.markdown(f"""
+    ### 🧬 Data-Driven Insights: Decoding the Matrix
+
+    The correlation matrix above acts as a "truth table" for our territory, revealing three undeniable laws
+    (population-weighted coefficients for {latest_year}):
+
+    1.  **The Exclusionary Nature of Wealth (`{_r('avg_income', 'poverty_rate')}` Income vs. Poverty):** 
+        The extremely strong negative correlation confirms a "zero-sum" landscape. Wealth does not mix with poverty here; it displaces it. As you move closer to Geneva (where income rises), poverty essentially vanishes, creating "gated" economic zones.
+
+    2.  **The "Concrete" Fountain of Youth (`{_r('new_housing_pct', 'youth_pct')}` New Housing vs. Youth):**
+        There is a clear positive link between **New Housing** and **Youth**. This proves that **construction is the primary driver of demographic renewal**. Communes that build invite young families; those that don't age rapidly.
+
+    3.  **The Great Generational Divide (`{_r('youth_pct', 'senior_pct')}` Youth vs. Senior):**
+        The massive negative correlation between Youth and Seniors indicates **spatial segregation by age**. We don't see "mixed" intergenerational communes. Instead, we see "Young/Active" bedroom communities (likely near the border/new builds) versus "Aging/Retiree" villages (likely dominant in old housing).
+
+    *Conclusion: To shift the "Rising Tide" (economy) into a demographic future, the territory relies entirely on its ability to build new housing.*
+    """)
+
+@st.fragment
+def _demographics_tab(ctx):
+    """Age structure and youth/senior shares."""
+    regions, latest_year, latest_stats = ctx["regions"], ctx["latest_year"], ctx["latest_stats"]
+    selected_latest, selection_key = ctx["selected_latest"], ctx["selection_key"]
+
+    st.subheader("Population Structure")
+
+    target_data = selected_latest # National view (all rows) unless communes are selected
+
+    if regions:
+        st.info(f"Showing demographic profile for: {', '.join(ctx['region_labels'])}")
+    else:
+        st.info("Showing National Demographic Profile (Aggregated)")
+
+    c1, c2 = st.columns([2, 1])
+    with c1:
+        population_pyramid(target_data, year=latest_year, cache_key=selection_key)
+    with c2:
+        st.markdown("### Key Demographic Stats")
+        # Population-weighted: precomputed nationally, summed over the selection otherwise
         if regions:
-            st.info(f"Showing demographic profile for: {', '.join(regions)}")
-            target_data = latest_data[latest_data['nom'].isin(regions)]
+            demo_means = selection_means(target_data, ['youth_pct', 'senior_pct'])
         else:
-            st.info("Showing National Demographic Profile (Aggregated)")
-            
-        c1, c2 = st.columns([2, 1])
-        with c1:
-            population_pyramid(target_data, year=latest_year)
-        with c2:
-            st.markdown("### Key Demographic Stats")
-            avg_youth = target_data['youth_pct'].mean()
-            avg_senior = target_data['senior_pct'].mean()
-            st.metric("Youth Share (<18)", f"{avg_youth:.1f}%")
-            st.metric("Senior Share (>65)", f"{avg_senior:.1f}%")
-            
-        st.markdown("""
-        ### 🔮 Demographic Outlook: A Reversal of Trends?
-        
-        Recent data points towards a potential **rejuvenation** of the territory, challenging the historical aging trend:
-        
-        *   **2019 (Baseline):** The population structure is dominated by seniors (**23.5%**) compared to youth (**19.9%**), typical of an aging municipality.
-        *   **2025 Projection:** A striking shift is observed, with the **Youth share rising to 21.1%** and Seniors dropping to **20.9%**, marking a demographic crossover where the young outnumber the old.
-        *   **2027 Outlook:** While stabilizing (Youth **20.4%**, Senior **22.4%**), the gap remains significantly narrower than in 2019.
-        
-        *This trajectory suggests a successful policy of attracting young families, likely driven by new housing developments or urban renewal projects.*
-        """)
+            demo_means = {m: latest_stats[m]['weighted_mean'] for m in ['youth_pct', 'senior_pct']}
+        avg_youth = demo_means['youth_pct']
+        avg_senior = demo_means['senior_pct']
+        st.metric("Youth Share (<18)", f"{avg_youth:.1f}%")
+        st.metric("Senior Share (>65)", f"{avg_senior:.1f}%")
+
+    # Outlook quoted from the national trend projections (utils.projection)
+    outlook = _demographic_outlook(ctx["tables"])
+    if outlook:
+        st.markdown(outlook)
+
+def _demographic_outlook(tables, years=(2025, 2027)):
+    """Youth/senior outlook narrative built from the projected national shares."""
+    if "projections" not in tables:
+        return None
+    observed = tables["timeseries"].set_index("year")
+    projected = tables["projections"]["timeseries"].set_index("year")
+    base = observed.index.max()
+    years = [y for y in years if y in projected.index]
+    if not years or not {"youth_pct", "senior_pct"} <= set(projected.columns):
+        return None
+
+    def shares(frame, year):
+        return frame.loc[year, "youth_pct"], frame.loc[year, "senior_pct"]
+
+    def interval(year, m):
+        lo, hi = projected.loc[year, f"{m}_lo"], projected.loc[year, f"{m}_hi"]
+        return f" ({lo:.1f}-{hi:.1f}%)" if pd.notna(lo) else ""
+
+    youth0, senior0 = shares(observed, base)
+    lines = [
+        "### 🔮 Demographic Outlook: A Reversal of Trends?",
+        "",
+        f"Extending the {observed.index.min()}-{base} national trends (95% intervals in brackets):",
+        "",
+        f"*   **{base} (Baseline):** Seniors account for **{senior0:.1f}%** of the population and youth for **{youth0:.1f}%**.",
+    ]
+    for year in years:
+        youth, senior = shares(projected, year)
+        if (youth > senior) != (youth0 > senior0):
+            verdict = "a demographic crossover"
+        elif abs(youth - senior) < abs(youth0 - senior0):
+            verdict = f"a narrower gap than in {base}"
+        else:
+            verdict = f"a wider gap than in {base}"
+        lines.append(
+            f"*   **{year} Projection:** Youth **{youth:.1f}%**{interval(year, 'youth_pct')}, "
+            f"Seniors **{senior:.1f}%**{interval(year, 'senior_pct')}: {verdict}."
+        )
+    lines += ["", "*Three vintages only pin down a straight-line trend; read these as the continuation of 2015-2019, not a forecast.*"]
+    return "\n".join(lines)
 
-    # --- Tab 5: Housing ---
-    with tab5:
-        st.subheader("Housing Stock Analysis")
-        
-        target_housing = latest_data
+@st.fragment
+def _housing_tab(ctx):
+    """Housing eras and housing KPIs."""
+    regions, latest_year, latest_stats = ctx["regions"], ctx["latest_year"], ctx["latest_stats"]
+    selected_latest, selection_key = ctx["selected_latest"], ctx["selection_key"]
+
+    st.subheader("Housing Stock Analysis")
+
+    target_housing = selected_latest
+
+    c1, c2 = st.columns([1, 1])
+    with c1:
+        housing_mix_chart(target_housing, year=latest_year, cache_key=selection_key)
+    with c2:
+        st.markdown("### Housing Indicators")
+        housing_metrics = [m for m in ['houses_pct', 'social_housing_rate'] if m in target_housing.columns]
         if regions:
-            target_housing = latest_data[latest_data['nom'].isin(regions)]
-            
-        c1, c2 = st.columns([1, 1])
-        with c1:
-            housing_mix_chart(target_housing, year=latest_year)
-        with c2:
-            st.markdown("### Housing Indicators")
-            if 'houses_pct' in target_housing.columns:
-                 st.metric("Individual Houses", f"{target_housing['houses_pct'].mean():.1f}%")
-            if 'social_housing_rate' in target_housing.columns:
-                 st.metric("Social Housing Rate", f"{target_housing['social_housing_rate'].mean():.1f}%")
-
-        st.markdown("""
-        ### 🏘️ The Fortress of Stability: A Rigid Market
-        
-        The housing figures reveal a market that has remained virtually **frozen in time** between 2015 and 2019:
-        
-        *   **Dominance of Individual Houses:** Consistently hovering around **90%**, the territory is overwhelmingly composed of detached homes, characteristic of a suburban or rural "owner-occupier" model.
-        *   **Static Social Housing:** The rate has flatlined at **3.7%** for four years. This is significantly below national targets (often 20-25%), indicating a **structural resistance to social mixing**.
-        
-        *This lack of evolution in the housing stock—neither densifying (more apartments) nor diversifying (more social housing)—suggests strict zoning policies that prioritize maintaining the status quo over welcoming new, diverse populations.*
-        """)
+            housing_means = selection_means(target_housing, housing_metrics)
+        else:
+            housing_means = {m: latest_stats[m]['weighted_mean'] for m in housing_metrics}
+        if 'houses_pct' in housing_means:
+             st.metric("Individual Houses", f"{housing_means['houses_pct']:.1f}%")
+        if 'social_housing_rate' in housing_means:
+             st.metric("Social Housing Rate", f"{housing_means['social_housing_rate']:.1f}%")
 
-    # --- Tab 6: Scatter Explorer ---
-    with tab6:
-        st.subheader("Multi-Dimensional Exploration")
-        st.info("""
-        **💡 Recommended Analysis Pairs (What to talk about):**
-        1.  **📉 The Inequality Curve:** `Avg Income` (X) vs `Poverty Rate` (Y). *Show how wealth eradicates poverty (or doesn't).*
-        2.  **🏗️ The "New Blood" Effect:** `New Housing Pct` (X) vs `Youth Pct` (Y). *Do new buildings attract young families?*
-        3.  **🏢 The Social Safety Net:** `Social Housing Rate` (X) vs `Single Parent Pct` (Y). *Where do vulnerable families find support?*
-        4.  **👴 The "Old Walls":** `Old Housing Pct` (X) vs `Senior Pct` (Y). *Are historic centers aging?*
-        """)
-        st.markdown("Plot any two variables against each other.")
-        
-        c1, c2, c3 = st.columns(3)
-        x_axis = c1.selectbox("X Axis", avail_metrics, index=0)
-        y_axis = c2.selectbox("Y Axis", avail_metrics, index=1)
-        size_var = c3.selectbox("Bubble Size", ["total_pop", "total_households"], index=0)
-        
-        scatter_plot(latest_data, x_axis, y_axis, size=size_var, hover_name="nom", year=latest_year)
-        
-        st.markdown("""
-        ### 🧬 Correlational Findings: The Structural Laws of the Territory
-        
-        Analyzing the key interactions reveals the mechanics behind the "Geneva Effect":
-
-        1.  **The Poverty Floor (Income vs. Poverty):** The data clearly forms an "L-shape". Poverty doesn't linearly decrease; it collapses. Once a commune's Average Income exceeds **€25k**, poverty rates drop to near-zero. This identifies the "cost of entry" to live in this wealthy border zone.
-        2.  **The Rejuvenation Engine (New Housing vs. Youth):** A positive correlation exists between construction and youth. Communes with high **New Housing (>20%)** consistently exhibit **Younger Populations (>25%)**. This confirms that **urban development** is the primary lever to fight demographic aging.
-        3.  **The Historic Trap (Old Housing vs. Seniors):** Conversely, "historic" communes dominated by pre-1945 housing show a higher concentration of seniors. Without new housing stock, these areas struggle to attract the working-age families that drive the local economy.
-        """)
+    st.markdown("""
+    ### 🏘️ The Fortress of Stability: A Rigid Market
+
+    The housing figures reveal a market that has remained virtually **frozen in time** between 2015 and 2019:
+
+    *   **Dominance of Individual Houses:** Consistently hovering around **90%**, the territory is overwhelmingly composed of detached homes, characteristic of a suburban or rural "owner-occupier" model.
+    *   **Static Social Housing:** The rate has flatlined at **3.7%** for four years. This is significantly below national targets (often 20-25%), indicating a **structural resistance to social mixing**.
+
+    *This lack of evolution in the housing stock—neither densifying (more apartments) nor diversifying (more social housing)—suggests strict zoning policies that prioritize maintaining the status quo over welcoming new, diverse populations.*
+    """)
+
+@st.fragment
+def _scatter_tab(ctx):
+    """Free scatter of any two metrics."""
+    latest_data, latest_year, regions = ctx["latest_data"], ctx["latest_year"], ctx["regions"]
+    version = ctx["version"]
+
+    st.subheader("Multi-Dimensional Exploration")
+    st.info("""
+    **💡 Recommended Analysis Pairs (What to talk about):**
+    1.  **📉 The Inequality Curve:** `Avg Income` (X) vs `Poverty Rate` (Y). *Show how wealth eradicates poverty (or doesn't).*
+    2.  **🏗️ The "New Blood" Effect:** `New Housing Pct` (X) vs `Youth Pct` (Y). *Do new buildings attract young families?*
+    3.  **🏢 The Social Safety Net:** `Social Housing Rate` (X) vs `Single Parent Pct` (Y). *Where do vulnerable families find support?*
+    4.  **👴 The "Old Walls":** `Old Housing Pct` (X) vs `Senior Pct` (Y). *Are historic centers aging?*
+    """)
+    st.markdown("Plot any two variables against each other.")
+
+    c1, c2, c3, c4 = st.columns(4)
+    x_axis = c1.selectbox("X Axis", EXPLORE_METRICS, index=0)
+    y_axis = c2.selectbox("Y Axis", EXPLORE_METRICS, index=1)
+    size_var = c3.selectbox("Bubble Size", ["total_pop", "total_households"], index=0)
+    color_by = c4.selectbox("Colour", ["Y value", "Typology cluster"], index=0, key="scatter_color")
+
+    color, cache_key = None, version
+    if color_by == "Typology cluster":
+        # Same k as the Typology tab, so colours match its map
+        k = st.session_state.get("typology_k", CLUSTER_K)
+        typology = cached_typology(ctx["tables"], version, k)
+        latest_data = latest_data.assign(typology=cluster_labels(typology, latest_year))
+        color, cache_key = "typology", (version, "typology", k)
+
+    scatter_plot(latest_data, x_axis, y_axis, size=size_var, hover_name="nom", color=color, year=latest_year,
+                 highlight=regions, cache_key=cache_key)
+
+    st.markdown("""
+    ### 🧬 Correlational Findings: The Structural Laws of the Territory
+
+    Analyzing the key interactions reveals the mechanics behind the "Geneva Effect":
+
+    1.  **The Poverty Floor (Income vs. Poverty):** The data clearly forms an "L-shape". Poverty doesn't linearly decrease; it collapses. Once a commune's Average Income exceeds **€25k**, poverty rates drop to near-zero. This identifies the "cost of entry" to live in this wealthy border zone.
+    2.  **The Rejuvenation Engine (New Housing vs. Youth):** A positive correlation exists between construction and youth. Communes with high **New Housing (>20%)** consistently exhibit **Younger Populations (>25%)**. This confirms that **urban development** is the primary lever to fight demographic aging.
+    3.  **The Historic Trap (Old Housing vs. Seniors):** Conversely, "historic" communes dominated by pre-1945 housing show a higher concentration of seniors. Without new housing stock, these areas struggle to attract the working-age families that drive the local economy.
+    """)
+
+@st.fragment
+def _spatial_tab(ctx):
+    """Global Moran's I and LISA cluster map of a metric."""
+    tables, latest_year, version = ctx["tables"], ctx["latest_year"], ctx["version"]
+
+    st.subheader("Spatial Clustering: Is Wealth Geographically Gated?")
+    st.markdown("""
+    Neighbouring communes are linked through a contiguity graph (shared borders). **Moran's I** measures whether
+    similar values cluster in space; **LISA** pinpoints where: *High-High* hot spots, *Low-Low* cold spots and
+    outliers that differ from their neighbours.
+    """)
+
+    if "adjacency" not in tables:
+        st.error("Contiguity graph not found. Please reset the cache to rebuild the data.")
+        return
+
+    spatial_metric = st.selectbox("Metric", EXPLORE_METRICS, index=0, key="spatial_metric")
+    result = spatial_autocorrelation(tables, version, spatial_metric, latest_year)
+    moran = result['global']
+
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Global Moran's I", f"{moran['I']:.3f}")
+    c2.metric("Pseudo p-value", f"{moran['p_value']:.3f}")
+    c3.metric("z-score", f"{moran['z_score']:.1f}")
+
+    local = result['local']
+    labels = local.set_index('lcog_geo')['cluster']
+    map_chart_categorical(
+        tables["geo"], labels, LISA_COLORS, label="LISA cluster",
+        cache_key=(version, "lisa", spatial_metric, latest_year), height=600
+    )
+
+    counts = local['cluster'].value_counts().rename_axis("Cluster").reset_index(name="Communes")
+    st.dataframe(counts, hide_index=True, use_container_width=True)
+
+@st.fragment
+def _change_tab(ctx):
+    """Changes between two vintages: national decomposition, biggest movers and change map."""
+    tables, version = ctx["tables"], ctx["version"]
+
+    st.subheader("What Changed? Vintage-to-Vintage Dynamics")
+    if "panel" not in tables or len(tables["panel"]["years"]) < 2:
+        st.error("Change data not found. Please reset the cache to rebuild the data.")
+        return
+
+    panel_years = tables["panel"]["years"]
+    c1, c2, c3 = st.columns(3)
+    y0, y1 = c1.select_slider(
+        "Period", options=panel_years, value=(panel_years[0], panel_years[-1]), key="change_period"
+    )
+    change_metric = c2.selectbox("Metric", AVAIL_METRICS, index=0, key="change_metric")
+    kind = c3.selectbox("Measure", list(CHANGE_KINDS), key="change_kind", format_func=CHANGE_KINDS.get)
+    if y0 == y1:
+        st.info("Select two different vintages.")
+        return
+
+    # Cached per (fingerprint, y0, y1): every metric and measure comes from the same arrays
+    changes = cached_pair_changes(tables, version, y0, y1)
+    period = f"{y0}-{y1}"
+
+    # National change split into communes changing vs population moving between communes
+    parts = changes['decomposition'].loc[change_metric]
+    d1, d2, d3, d4 = st.columns(4)
+    d1.metric(f"National {y1}", f"{parts['end']:,.2f}", f"{parts['change']:+,.2f} vs {y0}")
+    d2.metric("Within communes", f"{parts['within']:+,.2f}")
+    d3.metric("Population shift", f"{parts['shift']:+,.2f}")
+    d4.metric("Communes entering/leaving", f"{parts['entry_exit']:+,.2f}")
+    st.caption(
+        "*Within* is the change holding each commune's weight fixed; *population shift* is the change "
+        "from weight moving towards communes with higher or lower values."
+    )
+
+    risers, fallers = top_movers(changes, change_metric, kind, n=10)
+    movers_chart(risers, fallers, change_metric, CHANGE_KINDS[kind], period,
+                 cache_key=(version, y0, y1, kind))
+
+    # Tile-level view: same change recomputed on the 1 km grid tiles present in both vintages
+    tiles_ok = "tiles" in tables and {y0, y1} <= set(tables["tiles"]["years"]) and change_metric in TILE_METRICS
+    if st.toggle("Tile-level view (1 km)", key="change_tiles", disabled=not tiles_ok,
+                 help=f"Available for {', '.join(TILE_METRICS)}."):
+        tile_changes = cached_tile_change(tables, version, y0, y1, change_metric)
+        map_chart_tiles(
+            tile_changes, kind, label=f"{CHANGE_KINDS[kind]} {period}",
+            cache_key=(version, "tile_change", change_metric, kind, y0, y1), height=600
+        )
+        st.caption(f"{len(tile_changes):,} tiles populated in both {y0} and {y1}.")
+    else:
+        map_chart_diverging(
+            tables["geo"], changes[kind][change_metric], label=f"{CHANGE_KINDS[kind]} {period}",
+            cache_key=(version, "change", change_metric, kind, y0, y1), height=600
+        )
+
+    with st.expander("📊 Decomposition for all metrics"):
+        st.dataframe(changes['decomposition'], use_container_width=True)
+
+@st.fragment
+def _typology_tab(ctx):
+    """k-means commune typology: map, cluster profiles and stability across vintages."""
+    tables, latest_year, version = ctx["tables"], ctx["latest_year"], ctx["version"]
+
+    st.subheader("Commune Typology: Which Kinds of Places Exist?")
+    st.markdown("""
+    Communes are grouped by **mini-batch k-means** on all standardized metrics. Each vintage starts from the
+    previous one's centroids, so a cluster keeps its meaning over time. Names list the two metrics where the
+    cluster deviates most from the average commune.
+    """)
+
+    k = st.slider("Number of clusters (k)", 2, 12, CLUSTER_K, key="typology_k")
+    typology = cached_typology(tables, version, k)
+    if latest_year not in typology["years"]:
+        st.error("No typology for the selected year.")
+        return
+
+    entry = typology["years"][latest_year]
+    start, stop = ctx["index"]["year_slices"][latest_year]
+    codes = ctx["df_regions"]["lcog_geo"].astype(str).to_numpy()[start:stop]
+    labels = pd.Series(cluster_labels(typology, latest_year), index=codes)
+    palette = qualitative_palette(sorted(set(entry["names"])))
+    map_chart_categorical(
+        tables["geo"], labels, palette, label="Cluster",
+        cache_key=(version, "typology", k, latest_year), height=600
+    )
+
+    # Centroids back in metric units, with cluster sizes
+    profile = pd.DataFrame(
+        entry["centroids"] * typology["std"] + typology["mean"],
+        index=entry["names"], columns=[m.replace('_', ' ').title() for m in typology["metrics"]]
+    )
+    profile.insert(0, "Communes", np.bincount(entry["labels"], minlength=k))
+    st.dataframe(profile.style.format("{:,.1f}"), use_container_width=True)
+
+    # Stability: communes keeping their cluster id from one vintage to the next
+    years = [y for y in ctx["index"]["years"] if y in typology["years"]]
+    if len(years) > 1:
+        cols = st.columns(len(years) - 1)
+        for col, (y0, y1) in zip(cols, zip(years[:-1], years[1:])):
+            ids = []
+            for y in (y0, y1):
+                a, b = ctx["index"]["year_slices"][y]
+                ids.append(pd.Series(typology["years"][y]["labels"], index=ctx["df_regions"]["lcog_geo"].to_numpy()[a:b]))
+            common = ids[0].index.intersection(ids[1].index)
+            same = (ids[0].loc[common] == ids[1].loc[common]).mean() * 100
+            col.metric(f"Unchanged {y0}→{y1}", f"{same:.1f}%")
+
+@st.fragment
+def _territories_tab(ctx):
+    """Custom territories (presets or user-defined) aggregated from their communes and compared."""
+    tables, metric, latest_year, version = ctx["tables"], ctx["metric"], ctx["latest_year"], ctx["version"]
+
+    st.subheader("Territories: Compare Groups of Communes")
+    if "centroids" not in tables:
+        st.error("Commune centroids not found. Please reset the cache to rebuild the data.")
+        return
+    st.caption(
+        "A territory is a list of communes, a radius around a point or a département. Its metrics are "
+        "recomputed from the summed tile counts, not averaged from commune rates."
+    )
+
+    custom = st.session_state.setdefault("custom_territories", {})
+    with st.expander("➕ Define a territory"):
+        name = st.text_input("Name", key="territory_name")
+        kind = st.radio("Defined by", ["Radius", "Département", "Communes"], horizontal=True, key="territory_kind")
+        if kind == "Radius":
+            c1, c2 = st.columns(2)
+            attractor = c1.selectbox("Around", list(ATTRACTORS), format_func=lambda k: ATTRACTORS[k]["name"],
+                                     key="territory_attractor")
+            radius = c2.slider("Radius (km)", 5, 150, 30, step=5, key="territory_radius")
+            definition = {"kind": "radius", "attractor": attractor, "radius_km": radius}
+        elif kind == "Département":
+            prefix = st.text_input("Département code", "74", key="territory_prefix")
+            definition = {"kind": "department", "prefix": prefix.strip()}
+        else:
+            latest = year_view(ctx["df_regions"], ctx["index"], latest_year)
+            labels = dict(zip(latest["lcog_geo"].astype(str), latest["nom"]))
+            codes = st.multiselect("Communes", list(labels), format_func=lambda c: f"{labels[c]} ({c})",
+                                   key="territory_codes")
+            definition = {"kind": "codes", "codes": codes}
+
+        c1, c2 = st.columns(2)
+        if c1.button("Add territory", disabled=not name, key="territory_add"):
+            custom[name] = definition
+        if c2.button("Clear custom territories", disabled=not custom, key="territory_clear"):
+            custom.clear()
+
+    options = list(TERRITORY_PRESETS) + [n for n in custom if n not in TERRITORY_PRESETS]
+    chosen = st.multiselect("Territories", options, default=DEFAULT_TERRITORIES + list(custom), key="territory_pick")
+    if not chosen:
+        st.info("Select at least one territory.")
+        return
+
+    definitions = {n: custom.get(n, TERRITORY_PRESETS.get(n)) for n in chosen}
+    table = cached_territory_table(tables, version, definitions)
+    # Figure cache key: the definitions themselves, so edited territories never hit stale charts
+    key = (version, repr(sorted(definitions.items())))
+
+    latest = table[table["year"] == latest_year]
+    c1, c2 = st.columns(2)
+    with c1:
+        bar_chart(latest, metric, top_n=len(chosen), orientation='h', year=latest_year, cache_key=key + (latest_year,))
+    with c2:
+        line_chart(table, metric, title=f"{metric.replace('_', ' ').title()} by territory", cache_key=key)
+
+    cols = ["nom", "n_communes", "total_pop"] + [m for m in AVAIL_METRICS if m in table.columns]
+    st.dataframe(latest[cols].rename(columns={"nom": "Territory"}), hide_index=True, use_container_width=True)
+
+# Tab label -> renderer. Only the open tab runs, and each is a fragment so its
+# own widgets rerun just that tab instead of the whole app script.
+TABS = {
+    "🇨🇭 The Geneva Gravity": _gravity_tab,
+    "🌍 Regional Comparison": _comparison_tab,
+    "🔗 Correlations": _correlations_tab,
+    "👥 Demographics": _demographics_tab,
+    "🏠 Housing": _housing_tab,
+    "🔎 Scatter Explorer": _scatter_tab,
+    "🧭 Spatial Clusters": _spatial_tab,
+    "📈 Change": _change_tab,
+    "🧩 Typology": _typology_tab,
+    "🗺️ Territories": _territories_tab,
+}
@@ -1,6 +1,19 @@
+import os
 import streamlit as st
-from utils.viz import line_chart, bar_chart, map_chart_3d
+import pandas as pd
+from utils.viz import line_chart, bar_chart, map_chart_3d, map_chart_vector_tiles, map_chart_surface
+from utils.vtiles import mbtiles_metadata
+from utils.raster import load_manifest, surface_image
+from utils.api import api_health
+from utils.constants import VTILES_DIR, API_URL, VTILE_PUBLIC_URL, API_HEALTH_TTL
 from utils.prep import safe_divide
+from utils.index import top_rows
+from utils.search import code_labels
+
+@st.cache_data(ttl=API_HEALTH_TTL, show_spinner=False)
+def _api_health(api_url):
+    """api_health, rechecked at most every API_HEALTH_TTL seconds."""
+    return api_health(api_url)
 
 def render(tables, metric="avg_income", selected_years=None, regions=None):
     st.header("National Overview: Is the Rising Tide Tilted Towards Geneva?")
@@ -18,6 +31,13 @@ def render(tables, metric="avg_income", selected_years=None, regions=None):
     
     if selected_years:
         ts_data = ts_data[ts_data["year"].isin(selected_years)]
+        # Estimated years come from the projection partition, flagged as such
+        projections = tables.get("projections")
+        if projections is not None:
+            proj_ts = projections["timeseries"]
+            proj_ts = proj_ts[proj_ts["year"].isin(selected_years)]
+            if not proj_ts.empty:
+                ts_data = pd.concat([ts_data, proj_ts], ignore_index=True).sort_values("year")
 
     # --- KPIs ---
     if not ts_data.empty:
@@ -42,26 +62,31 @@ def render(tables, metric="avg_income", selected_years=None, regions=None):
             
             social_val = current_data['social_housing_rate'].values[0] if 'social_housing_rate' in current_data.columns else 0
             c4.metric("Social Housing", f"{social_val:.1f}%")
+
+            if current_data.get('is_projected', pd.Series([False])).fillna(False).any():
+                st.caption(f"🔮 {latest_yr} figures are {current_data['estimate'].values[0]} from the 2015-2019 trend, not observed.")
     
     # --- Highlights (Superlatives) ---
     st.subheader("Commune Highlights (Latest Year)")
     if not reg_data.empty:
-        latest_reg = reg_data[reg_data['year'] == reg_data['year'].max()]
+        # Superlatives come straight from the precomputed per-metric sort orders
+        index = tables["index"]
+        latest_reg_year = index["years"][-1]
         
         h1, h2, h3 = st.columns(3)
         
         # Wealthiest
-        wealthiest = latest_reg.sort_values('avg_income', ascending=False).iloc[0]
+        wealthiest = reg_data.iloc[top_rows(index, 'avg_income', latest_reg_year, n=1)[0]]
         h1.metric("Wealthiest Commune", wealthiest['nom'], f"{wealthiest['avg_income']:,.0f} €")
         
         # Youngest
-        if 'youth_pct' in latest_reg.columns:
-            youngest = latest_reg.sort_values('youth_pct', ascending=False).iloc[0]
+        if 'youth_pct' in reg_data.columns:
+            youngest = reg_data.iloc[top_rows(index, 'youth_pct', latest_reg_year, n=1)[0]]
             h2.metric("Youngest Commune", youngest['nom'], f"{youngest['youth_pct']:.1f}% (0-17yo)")
             
         # Most Social Housing
-        if 'social_housing_rate' in latest_reg.columns:
-            social = latest_reg.sort_values('social_housing_rate', ascending=False).iloc[0]
+        if 'social_housing_rate' in reg_data.columns:
+            social = reg_data.iloc[top_rows(index, 'social_housing_rate', latest_reg_year, n=1)[0]]
             h3.metric("Most Social Housing", social['nom'], f"{social['social_housing_rate']:.1f}%")
 
     st.markdown("---")
@@ -77,9 +102,10 @@ def render(tables, metric="avg_income", selected_years=None, regions=None):
         end_val = ts_data[ts_data['year'] == ts_data['year'].max()][metric].values[0]
         growth_pct = ((end_val - start_val) / start_val) * 100
         
-        st.caption(f"📈 **Trend Analysis:** The national average for {metric.replace('_', ' ')} has grown by **+{growth_pct:.1f}%** between 2015 and 2019, confirming the 'Improving Economy' hypothesis.")
+        st.caption(f"📈 **Trend Analysis:** The national average for {metric.replace('_', ' ')} has grown by **{growth_pct:+.1f}%** between {ts_data['year'].min()} and {ts_data['year'].max()}, confirming the 'Improving Economy' hypothesis.")
         
-        line_chart(ts_data, metric, title=f"Rising Tide: Evolution of {metric.replace('_', ' ').title()}")
+        line_chart(ts_data, metric, title=f"Rising Tide: Evolution of {metric.replace('_', ' ').title()}",
+                   cache_key=(tables["fingerprint"], tuple(ts_data["year"])))
     else:
         st.warning("Insufficient data to show trends.")
     
@@ -88,9 +114,38 @@ def render(tables, metric="avg_income", selected_years=None, regions=None):
     # 2. Map Section (Full Width, Large)
     st.subheader("The Gravity of Geneva: Geographic Wealth Concentration")
     
+    # Optional map modes, when built for this data: vector tiles (`make vtiles`, offered only
+    # while `make api` serves them for this data) and the smoothed surface (`make raster`,
+    # covering the tile-level metrics)
+    vtiles = mbtiles_metadata(os.path.join(VTILES_DIR, "communes.mbtiles"))
+    if vtiles and vtiles.get("fingerprint") != tables["fingerprint"]:
+        vtiles = None
+    if vtiles:
+        health = _api_health(API_URL)
+        if not health or health.get("fingerprint") != tables["fingerprint"] or "communes" not in health.get("tiles", []):
+            vtiles = None
+    surface = load_manifest()
+    if surface and (surface.get("fingerprint") != tables["fingerprint"] or metric not in surface["metrics"]):
+        surface = None
+    modes = ["3D communes"] + (["Vector tiles"] if vtiles else []) + (["Smoothed surface"] if surface else [])
+    mode = modes[0]
+    if len(modes) > 1:
+        mode = st.radio("Map", modes, horizontal=True, key="overview_map_mode",
+                        help="Vector tiles load only the visible area from the local API (`make api`).")
+
+    if mode == "Vector tiles":
+        st.caption("Vector tiles • only the tiles in view are loaded")
+        map_chart_vector_tiles(vtiles, metric, VTILE_PUBLIC_URL, height=700)
+    elif mode == "Smoothed surface":
+        years = [y for y in surface["years"] if not selected_years or y in selected_years] or surface["years"]
+        bandwidth = st.select_slider("Kernel bandwidth (km)", surface["bandwidths_km"],
+                                     value=surface["bandwidths_km"][len(surface["bandwidths_km"]) // 2],
+                                     key="overview_bandwidth")
+        st.caption(f"Gaussian-smoothed 1 km tiles • {years[-1]} • {bandwidth} km bandwidth")
+        map_chart_surface(surface_image(surface, metric, years[-1], bandwidth), surface["bounds"], height=700)
     # Highlight Map Data if Regions Selected
-    if regions:
-        st.info(f"📍 Highlighting: {', '.join(regions)}")
+    elif regions:
+        st.info(f"📍 Highlighting: {', '.join(code_labels(tables['search'], regions))}")
         map_chart_3d(geo_data, metric, height=700, highlight_regions=regions)
     else:
         st.caption("Interactive 3D Map • Tilt: 45° • Height: Scale based on value")
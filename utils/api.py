@@ -0,0 +1,186 @@
+import os
+import gzip
+import json
+import threading
+import urllib.request
+import numpy as np
+import pyarrow as pa
+from utils.constants import (
+    API_URL, ARROW_DIR, DEFAULT_ATTRACTOR, BAND_DEFAULTS, TERRITORY_PRESETS, API_GZIP_MIN_BYTES, API_MAX_RINGS,
+    VTILES_DIR, VTILE_ZOOMS
+)
+from utils.bands import build_band_index, ring_table, uniform_rings
+from utils.territories import territory_table, validate_territory
+from utils.vtiles import open_mbtiles, read_tile
+
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+JSON_TYPE = "application/json"
+MVT_TYPE = "application/vnd.mapbox-vector-tile"
+
+# The MBTiles connections are shared by the server threads
+_tile_lock = threading.Lock()
+
+def _arrow_frame(df):
+    """Arrow-friendly copy of a table: no geometry, no pandas index."""
+    return pa.Table.from_pandas(df.drop(columns='geometry', errors='ignore'), preserve_index=False)
+
+def export_arrow(tables, arrow_dir=ARROW_DIR):
+    """
+    Write `by_region` and `timeseries` as Arrow IPC files named after the data
+    fingerprint (written once per data version).
+    Returns:
+        dict: {name: path}
+    """
+    os.makedirs(arrow_dir, exist_ok=True)
+    paths = {}
+    for name in ['by_region', 'timeseries']:
+        path = os.path.join(arrow_dir, f"{name}-{tables['fingerprint']}.arrow")
+        if not os.path.exists(path):
+            table = _arrow_frame(tables[name])
+            with pa.OSFile(path + ".tmp", "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(path + ".tmp", path)
+        paths[name] = path
+    return paths
+
+def open_arrow(path):
+    """Memory-mapped Arrow table: columns are read from the page cache, not copied."""
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+def load_api_data(tables, arrow_dir=ARROW_DIR, vtiles_dir=VTILES_DIR):
+    """
+    Everything the API serves: the processed tables (for band and territory
+    aggregates), memory-mapped Arrow copies of the commune table and timeseries,
+    and the vector tile layers built by scripts/build_vtiles.py, if any.
+    Args:
+        tables (dict): make_tables output, already checked against CACHE_VERSION
+    """
+    paths = export_arrow(tables, arrow_dir)
+    layers = {name: os.path.join(vtiles_dir, f"{name}.mbtiles") for name in VTILE_ZOOMS}
+    return {
+        'tables': tables,
+        'fingerprint': tables['fingerprint'],
+        'by_region': open_arrow(paths['by_region']),
+        'timeseries': open_arrow(paths['timeseries']),
+        'vtiles': {name: open_mbtiles(path) for name, path in layers.items() if os.path.exists(path)},
+    }
+
+def _columns(table, metrics, keys):
+    """`keys` plus the requested metrics present in the table (all columns when none requested)."""
+    if not metrics:
+        return table
+    return table.select([c for c in keys + metrics if c in table.column_names])
+
+def timeseries(api, params):
+    """National timeseries, optionally restricted to `metrics`."""
+    return _columns(api['timeseries'], params.get('metrics'), ['year'])
+
+def communes(api, params):
+    """
+    Commune rows for one year (default: latest), optionally restricted to INSEE
+    `codes` and `metrics`. Year slices are zero-copy slices of the mapped table.
+    """
+    index = api['tables']['index']
+    year = int(params['year'][0]) if params.get('year') else index['years'][-1]
+    if year not in index['year_slices']:
+        raise KeyError(f"no data for year {year}")
+    start, stop = index['year_slices'][year]
+    table = api['by_region']
+    if params.get('codes'):
+        lookup = index['code_pos'][year]
+        rows = np.sort([lookup[c] for c in params['codes'] if c in lookup]).astype(np.int64)
+        table = table.take(pa.array(rows, type=pa.int64()))
+    else:
+        table = table.slice(start, stop - start)
+    return _columns(table, params.get('metrics'), ['year', 'lcog_geo', 'nom'])
+
+def bands(api, params):
+    """Distance-ring aggregates around an attractor (see utils.bands)."""
+    tables = api['tables']
+    year = int(params['year'][0]) if params.get('year') else tables['index']['years'][-1]
+    attractor = params.get('attractor', [DEFAULT_ATTRACTOR])[0]
+    width = float(params.get('width_km', [BAND_DEFAULTS['width_km']])[0])
+    max_km = float(params.get('max_km', [BAND_DEFAULTS['max_km']])[0])
+    if not 0 < width <= max_km or max_km / width > API_MAX_RINGS:
+        raise ValueError(f"need 0 < width_km <= max_km and at most {API_MAX_RINGS} rings")
+    dist_col = f'dist_{attractor}_km'
+    if year not in tables['index']['year_slices'] or dist_col not in tables['by_region'].columns:
+        raise KeyError(f"no bands for year {year} around {attractor}")
+    start, stop = tables['index']['year_slices'][year]
+    rings = ring_table(build_band_index(tables['by_region'].iloc[start:stop], dist_col), uniform_rings(width, max_km))
+    return _columns(_arrow_frame(rings), params.get('metrics'), ['ring_start_km', 'ring_end_km', 'n_communes'])
+
+def territories(api, params, body=None):
+    """
+    Territory aggregates over all years: presets named in `preset`, and/or
+    definitions posted as a JSON object {name: definition} (see utils.territories).
+    Raises ValueError for a body that is not such an object or holds an invalid definition.
+    """
+    definitions = {name: TERRITORY_PRESETS[name] for name in params.get('preset', []) if name in TERRITORY_PRESETS}
+    if body:
+        posted = json.loads(body)
+        if not isinstance(posted, dict):
+            raise ValueError("the body must be a JSON object {name: definition}")
+        for name, definition in posted.items():
+            try:
+                validate_territory(definition)
+            except ValueError as e:
+                raise ValueError(f"territory {name!r}: {e}") from None
+        definitions.update(posted)
+    if not definitions:
+        raise KeyError("no territory given (use ?preset=... or POST definitions)")
+    tables = api['tables']
+    table = territory_table(
+        tables['by_region'], tables['index'], tables['centroids'], tables['centroids_crs'], definitions
+    )
+    return _columns(_arrow_frame(table), params.get('metrics'), ['nom', 'year', 'n_communes'])
+
+def vector_tile(api, path):
+    """
+    Gzipped vector tile for '/tiles/<layer>/<z>/<x>/<y>.pbf', b"" when no feature falls in it.
+    Raises KeyError for an unknown layer or a malformed path.
+    """
+    parts = path.strip('/').split('/')
+    if len(parts) != 5 or parts[1] not in api['vtiles'] or not parts[4].endswith('.pbf'):
+        raise KeyError(f"no vector tile at {path}; layers: {', '.join(api['vtiles']) or 'none built'}")
+    z, x, y = int(parts[2]), int(parts[3]), int(parts[4][:-len('.pbf')])
+    with _tile_lock:
+        return read_tile(api['vtiles'][parts[1]], z, x, y) or b""
+
+# Path -> query function (params: {name: [values]}, comma lists already split)
+ROUTES = {
+    '/timeseries': timeseries,
+    '/communes': communes,
+    '/bands': bands,
+    '/territories': territories,
+}
+
+def encode(table, fmt, compress):
+    """
+    Response body for an Arrow table as Arrow IPC stream or JSON records,
+    gzipped when asked for and worth it.
+    Returns:
+        tuple: (body bytes, content type, gzipped)
+    """
+    if fmt == 'arrow':
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        body, ctype = sink.getvalue().to_pybytes(), ARROW_TYPE
+    else:
+        body = table.to_pandas().to_json(orient='records', double_precision=6).encode('utf-8')
+        ctype = JSON_TYPE
+    if compress and len(body) >= API_GZIP_MIN_BYTES:
+        return gzip.compress(body, compresslevel=5), ctype, True
+    return body, ctype, False
+
+def api_health(api_url=API_URL, timeout=1.0):
+    """
+    The running API's /health answer ({'fingerprint', 'tiles'}), or None when
+    nothing answers at `api_url`.
+    """
+    try:
+        with urllib.request.urlopen(api_url + "/health", timeout=timeout) as response:
+            return json.loads(response.read())
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from scipy.spatial import cKDTree
+from utils.constants import (
+    ATTRACTORS, ACCESSIBILITY_DECAY_KM, ACCESSIBILITY_MAX_KM
+)
+
+def commune_centroids(communes_gdf, commune_key):
+    """
+    Commune centroids in a metric CRS (Lambert-93, EPSG:2154, when possible).
+    Returns:
+        tuple: (DataFrame with 'lcog_geo', 'x', 'y' in meters, crs)
+    """
+    geoms = communes_gdf[[commune_key, 'geometry']].copy()
+    if geoms.crs and geoms.crs.to_string() != "EPSG:2154":
+        try:
+            geoms = geoms.to_crs(epsg=2154)
+        except:
+            pass # Fallback
+    centroids = geoms.geometry.centroid
+    out = pd.DataFrame({
+        'lcog_geo': geoms[commune_key].astype(str).to_numpy(),
+        'x': centroids.x.to_numpy(),
+        'y': centroids.y.to_numpy()
+    })
+    return out, geoms.crs
+
+def project_attractors(attractors, crs):
+    """Attractor keys, projected coordinates (n x 2, meters) and masses."""
+    keys = list(attractors)
+    pts = gpd.GeoSeries(
+        gpd.points_from_xy([attractors[k]['lon'] for k in keys], [attractors[k]['lat'] for k in keys]),
+        crs="EPSG:4326"
+    ).to_crs(crs)
+    xy = np.column_stack([pts.x.to_numpy(), pts.y.to_numpy()])
+    mass = np.array([attractors[k].get('mass', 1.0) for k in keys], dtype=float)
+    return keys, xy, mass
+
+def attractor_features(centroids, crs, attractors=ATTRACTORS,
+                       decay_km=ACCESSIBILITY_DECAY_KM, max_km=ACCESSIBILITY_MAX_KM):
+    """
+    Distance features of every commune to a set of attractor cities.
+    Args:
+        centroids (DataFrame): 'lcog_geo', 'x', 'y' (see commune_centroids)
+        crs: CRS of the centroid coordinates
+        attractors (dict): {key: {'name', 'lat', 'lon', 'mass'}}
+    Returns:
+        DataFrame: 'lcog_geo', dist_<key>_km per attractor, 'nearest_attractor',
+        'dist_nearest_km' and the gravity 'accessibility' index
+    """
+    keys, att_xy, mass = project_attractors(attractors, crs)
+    pts = centroids[['x', 'y']].to_numpy(dtype=float)
+    out = pd.DataFrame({'lcog_geo': centroids['lcog_geo'].to_numpy()})
+
+    # Per-attractor columns: one broadcast over (communes x attractors)
+    dists = np.hypot(pts[:, None, 0] - att_xy[None, :, 0], pts[:, None, 1] - att_xy[None, :, 1]) / 1000.0
+    for j, k in enumerate(keys):
+        out[f'dist_{k}_km'] = dists[:, j]
+
+    # Nearest pole and gravity accessibility via KD-trees
+    att_tree = cKDTree(att_xy)
+    nearest_d, nearest_j = att_tree.query(pts, k=1)
+    out['nearest_attractor'] = np.array(keys)[nearest_j]
+    out['dist_nearest_km'] = nearest_d / 1000.0
+
+    # Only pairs within max_km contribute, so the work scales with nearby poles
+    pairs = att_tree.sparse_distance_matrix(cKDTree(pts), max_km * 1000.0, output_type='coo_matrix')
+    contrib = mass[pairs.row] * np.exp(-(pairs.data / 1000.0) / decay_km)
+    out['accessibility'] = np.bincount(pairs.col, weights=contrib, minlength=len(pts))
+    return out
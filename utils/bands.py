@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+from utils.prep import SUM_COLS, derive_metrics
+
+def build_band_index(data, dist_col):
+    """
+    Sort communes by distance and take cumulative sums of the summable base columns.
+    Any set of rings is then evaluated with one searchsorted + differences.
+    Returns:
+        dict: {'dist': sorted distances, 'cum': (n + 1, k) cumulative sums, 'columns': column names}
+    """
+    columns = [c for c in SUM_COLS if c in data.columns]
+    dist = data[dist_col].to_numpy(dtype=float)
+    ok = ~np.isnan(dist)
+    order = np.argsort(dist[ok], kind='stable')
+    values = data.loc[ok, columns].to_numpy(dtype=float)[order]
+    # Extra column counts the communes per ring
+    values = np.column_stack([values, np.ones(len(values))])
+    cum = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+    return {'dist': dist[ok][order], 'cum': cum, 'columns': columns}
+
+def ring_table(band_index, edges):
+    """
+    Aggregate the base columns into rings [edges[i], edges[i+1]) and recompute ratio metrics.
+    O(len(edges) * log n) once the band index exists.
+    Returns:
+        DataFrame: one row per ring with ring bounds, commune count, sums and metrics
+    """
+    edges = np.asarray(edges, dtype=float)
+    pos = np.searchsorted(band_index['dist'], edges, side='left')
+    sums = band_index['cum'][pos[1:]] - band_index['cum'][pos[:-1]]
+
+    rings = pd.DataFrame(sums[:, :-1], columns=band_index['columns'])
+    rings.insert(0, 'ring_start_km', edges[:-1])
+    rings.insert(1, 'ring_end_km', edges[1:])
+    rings.insert(2, 'ring_mid_km', (edges[:-1] + edges[1:]) / 2)
+    rings.insert(3, 'n_communes', sums[:, -1].astype(int))
+    return derive_metrics(rings)
+
+def uniform_rings(width_km, max_km):
+    """Ring edges 0, w, 2w, ... up to max_km."""
+    return np.arange(0, max_km + width_km, width_km, dtype=float)
+
+@st.cache_data(show_spinner=False)
+def cached_band_index(_tables, fingerprint, year, attractor):
+    """Band index of one year around one attractor, cached per (fingerprint, year, attractor)."""
+    start, stop = _tables['index']['year_slices'][year]
+    return build_band_index(_tables['by_region'].iloc[start:stop], f'dist_{attractor}_km')
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+from utils.constants import METRICS, METRIC_WEIGHTS, CHANGE_MIN_POP
+from utils.stats import _top_bottom
+
+CHANGE_KINDS = {"abs": "Absolute change", "rel": "Relative change (%)", "cagr": "Annual growth (CAGR, %)"}
+
+def build_panel(by_region, index, metrics=METRICS):
+    """
+    Pivot `by_region` into dense commune x year x metric arrays (NaN where a commune
+    is missing from a vintage), built once from the contiguous year slices.
+    Returns:
+        dict: {
+            'codes': sorted INSEE codes, 'names': commune names, 'years': list,
+            'metrics': list, 'values': (n, T, M), 'weights': (n, T, M) denominators,
+            'pop': (n, T) population
+        }
+    """
+    metrics = [m for m in metrics if m in by_region.columns]
+    codes_col = by_region['lcog_geo'].astype(str).to_numpy()
+    codes, first = np.unique(codes_col, return_index=True)
+    years = index['years']
+
+    n, T, M = len(codes), len(years), len(metrics)
+    values = np.full((n, T, M), np.nan)
+    weights = np.zeros((n, T, M))
+    pop = np.zeros((n, T))
+    weight_cols = [METRIC_WEIGHTS.get(m, 'ind') for m in metrics]
+    weight_cols = [c if c in by_region.columns else 'ind' for c in weight_cols]
+
+    for t, year in enumerate(years):
+        start, stop = index['year_slices'][year]
+        pos = np.searchsorted(codes, codes_col[start:stop])
+        block = by_region.iloc[start:stop]
+        values[pos, t] = block[metrics].to_numpy(dtype=float)
+        weights[pos, t] = block[weight_cols].to_numpy(dtype=float)
+        pop[pos, t] = block['ind'].to_numpy(dtype=float)
+
+    return {
+        'codes': codes,
+        'names': by_region['nom'].to_numpy()[first],
+        'years': list(years),
+        'metrics': metrics,
+        'values': values,
+        'weights': np.nan_to_num(weights),
+        'pop': pop
+    }
+
+def deltas(v0, v1, dt):
+    """Absolute, relative (%) and compound annual (%) change, elementwise (broadcasts)."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        abs_ = v1 - v0
+        rel = np.where(v0 != 0, abs_ / np.abs(v0) * 100, np.nan)
+        cagr = np.where((v0 > 0) & (v1 > 0), ((v1 / v0) ** (1.0 / dt) - 1) * 100, np.nan)
+    return {'abs': abs_, 'rel': rel, 'cagr': cagr}
+
+def decompose(v0, v1, w0, w1):
+    """
+    Split the change of the weighted national mean into components (columns are metrics).
+    within: sum of mean share x commune change; shift: sum of share change x mean value
+    (exact for communes present in both vintages); entry_exit: communes in only one.
+    Returns:
+        dict: {'start', 'end', 'change', 'within', 'shift', 'entry_exit'} arrays over metrics
+    """
+    ok0 = ~np.isnan(v0) & (w0 > 0)
+    ok1 = ~np.isnan(v1) & (w1 > 0)
+    s0 = np.where(ok0, w0, 0) / np.where(ok0, w0, 0).sum(axis=0)
+    s1 = np.where(ok1, w1, 0) / np.where(ok1, w1, 0).sum(axis=0)
+    x0, x1 = np.where(ok0, v0, 0), np.where(ok1, v1, 0)
+    both = ok0 & ok1
+
+    start, end = (s0 * x0).sum(axis=0), (s1 * x1).sum(axis=0)
+    within = np.where(both, (s0 + s1) / 2 * (x1 - x0), 0).sum(axis=0)
+    shift = np.where(both, (s1 - s0) * (x0 + x1) / 2, 0).sum(axis=0)
+    entry_exit = (end - start) - within - shift
+    return {'start': start, 'end': end, 'change': end - start,
+            'within': within, 'shift': shift, 'entry_exit': entry_exit}
+
+def pair_changes(panel, y0, y1):
+    """
+    Per-commune changes of every metric between two vintages, plus the national decomposition.
+    Returns:
+        dict: {'abs', 'rel', 'cagr': DataFrames (communes x metrics, indexed by INSEE code),
+               'decomposition': DataFrame (metrics x components), 'pop': Series, 'names': Series}
+    """
+    i, j = panel['years'].index(y0), panel['years'].index(y1)
+    v0, v1 = panel['values'][:, i], panel['values'][:, j]
+    codes, metrics = pd.Index(panel['codes'], name='lcog_geo'), panel['metrics']
+
+    out = {k: pd.DataFrame(arr, index=codes, columns=metrics) for k, arr in deltas(v0, v1, y1 - y0).items()}
+    parts = decompose(v0, v1, panel['weights'][:, i], panel['weights'][:, j])
+    out['decomposition'] = pd.DataFrame(parts, index=metrics)
+    # Movers are ranked among communes populated in both vintages
+    out['pop'] = pd.Series(np.minimum(panel['pop'][:, i], panel['pop'][:, j]), index=codes)
+    out['names'] = pd.Series(panel['names'], index=codes)
+    return out
+
+def top_movers(changes, metric, kind='abs', n=10, min_pop=CHANGE_MIN_POP):
+    """
+    Biggest risers and fallers of one metric among communes with at least `min_pop` inhabitants.
+    Returns:
+        tuple: (risers DataFrame, fallers DataFrame) with nom, change and population
+    """
+    vals = changes[kind][metric].to_numpy()
+    keep = ~np.isnan(vals) & (changes['pop'].to_numpy() >= min_pop)
+    rows = np.flatnonzero(keep)
+    top, bottom = _top_bottom(vals[keep], rows, n)
+
+    def frame(pos):
+        return pd.DataFrame({
+            'lcog_geo': changes['names'].index[pos],
+            'nom': changes['names'].to_numpy()[pos],
+            metric: vals[pos],
+            'total_pop': changes['pop'].to_numpy()[pos]
+        })
+    return frame(top), frame(bottom)
+
+@st.cache_data(show_spinner="Computing changes...")
+def cached_pair_changes(_tables, fingerprint, y0, y1):
+    """pair_changes on the stored panel, cached per (fingerprint, y0, y1)."""
+    return pair_changes(_tables['panel'], y0, y1)
@@ -0,0 +1,111 @@
+import numpy as np
+import streamlit as st
+from utils.constants import METRICS, CLUSTER_K, CLUSTER_FIT
+from utils.similarity import standardize
+
+def _sq_dists(Z, C):
+    """Squared Euclidean distances between rows of Z and centroids C, shape (n, k)."""
+    return np.maximum((Z * Z).sum(axis=1)[:, None] - 2 * Z @ C.T + (C * C).sum(axis=1)[None, :], 0)
+
+def kmeans_pp(Z, k, rng):
+    """k-means++ seeding."""
+    C = [Z[rng.integers(len(Z))]]
+    d2 = _sq_dists(Z, C[0][None])[:, 0]
+    for _ in range(1, k):
+        C.append(Z[rng.choice(len(Z), p=d2 / d2.sum())] if d2.sum() > 0 else Z[rng.integers(len(Z))])
+        d2 = np.minimum(d2, _sq_dists(Z, C[-1][None])[:, 0])
+    return np.array(C)
+
+def minibatch_kmeans(Z, k, init=None, batch_size=CLUSTER_FIT['batch_size'], n_iter=CLUSTER_FIT['n_iter'],
+                     n_refine=CLUSTER_FIT['n_refine'], seed=CLUSTER_FIT['seed']):
+    """
+    Mini-batch k-means (per-centre learning rates 1 / count), then a few full Lloyd
+    passes to settle the assignments.
+    Args:
+        Z (array): standardized data (n, p)
+        init (array): starting centroids (k, p), e.g. the previous vintage's; k-means++ if None
+    Returns:
+        tuple: (centroids (k, p), labels (n,), inertia)
+    """
+    rng = np.random.default_rng(seed)
+    C = kmeans_pp(Z, k, rng) if init is None else np.array(init, dtype=float, copy=True)
+    counts = np.zeros(k)
+    for _ in range(n_iter):
+        batch = Z[rng.integers(len(Z), size=min(batch_size, len(Z)))]
+        nearest = _sq_dists(batch, C).argmin(axis=1)
+        # Accumulate per-centre sums, then move each centre by its own step size
+        batch_counts = np.bincount(nearest, minlength=k)
+        sums = np.zeros_like(C)
+        np.add.at(sums, nearest, batch)
+        counts += batch_counts
+        hit = batch_counts > 0
+        eta = batch_counts[hit] / counts[hit]
+        C[hit] = (1 - eta)[:, None] * C[hit] + eta[:, None] * sums[hit] / batch_counts[hit][:, None]
+
+    for _ in range(n_refine):
+        labels = _sq_dists(Z, C).argmin(axis=1)
+        sizes = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(C)
+        np.add.at(sums, labels, Z)
+        filled = sizes > 0
+        C[filled] = sums[filled] / sizes[filled][:, None]
+
+    d2 = _sq_dists(Z, C)
+    labels = d2.argmin(axis=1)
+    return C, labels, float(d2[np.arange(len(Z)), labels].sum())
+
+def describe_centroids(C, metrics, n_terms=2):
+    """Readable cluster names from the metrics that deviate most from the average (z-scores)."""
+    names = []
+    for c in C:
+        top = np.argsort(-np.abs(c))[:n_terms]
+        parts = [f"{'High' if c[j] > 0 else 'Low'} {metrics[j].replace('_', ' ')}" for j in top]
+        names.append(" / ".join(parts))
+    # Keep names unique when two centroids share their leading terms
+    seen = {}
+    for i, name in enumerate(names):
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            names[i] = f"{name} ({seen[name]})"
+    return names
+
+def build_typology(by_region, index, k=CLUSTER_K, metrics=METRICS):
+    """
+    Commune typology per year, warm-started from the previous vintage so cluster ids
+    (and their meaning) stay stable over time. All years share one standardization,
+    pooled over the vintages, so centroids are comparable across years.
+    Returns:
+        dict: {'k', 'metrics', 'mean', 'std',
+               'years': {year: {'centroids' (k, p) z-scores, 'labels' (rows of the year slice), 'names', 'inertia'}}}
+    """
+    metrics = [m for m in metrics if m in by_region.columns]
+    X = by_region[metrics].to_numpy(dtype=float)
+    _, mu, sd = standardize(X)
+    out = {'k': k, 'metrics': metrics, 'mean': mu, 'std': sd, 'years': {}}
+
+    C = None
+    for year in index['years']:
+        start, stop = index['year_slices'][year]
+        Xy = X[start:stop]
+        Z = np.where(np.isnan(Xy), 0.0, (Xy - mu) / sd)
+        C, labels, inertia = minibatch_kmeans(Z, k, init=C)
+        out['years'][year] = {
+            'centroids': C,
+            'labels': labels,
+            'names': describe_centroids(C, metrics),
+            'inertia': inertia
+        }
+    return out
+
+def cluster_labels(typology, year):
+    """Cluster name of every row of one year slice (array of strings)."""
+    entry = typology['years'][year]
+    return np.array(entry['names'], dtype=object)[entry['labels']]
+
+@st.cache_data(show_spinner="Clustering communes...")
+def cached_typology(_tables, fingerprint, k):
+    """Typology for `k` clusters: the stored one when k matches, otherwise recomputed and cached."""
+    stored = _tables.get('clusters')
+    if stored is not None and stored['k'] == k:
+        return stored
+    return build_typology(_tables['by_region'], _tables['index'], k)
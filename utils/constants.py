@@ -12,6 +12,70 @@ FILES = {
 }
 COMMUNES_FILE = "communes2020.gpkg"
 CACHE_FILE = os.path.join(DATA_DIR, "processed_metrics_cache.pkl")
+# Bump when the structure of the tables returned by make_tables changes,
+# so stale pickles are rebuilt instead of loaded
+CACHE_VERSION = "21"
+
+# --- Tile Schema ---
+# Canonical tile columns: (dtype, null policy). 'zero' fills nulls with 0, 'drop' drops the row.
+# Columns a vintage does not provide are reported by load_data, never created.
+_COUNT = ("float64", "zero")
+TILE_COLUMNS = {
+    "idcar_1km": ("str", "drop"),
+    "lcog_geo": ("str", "drop"),
+    "ind": _COUNT, "men": _COUNT, "men_pauv": _COUNT, "men_prop": _COUNT, "log_soc": _COUNT,
+    "pop_income": _COUNT,
+    "ind_0_3": _COUNT, "ind_4_5": _COUNT, "ind_6_10": _COUNT, "ind_11_17": _COUNT, "ind_18_24": _COUNT,
+    "ind_25_39": _COUNT, "ind_40_54": _COUNT, "ind_55_64": _COUNT, "ind_65_79": _COUNT, "ind_80p": _COUNT,
+    "log_av45": _COUNT, "log_45_70": _COUNT, "log_70_90": _COUNT, "log_ap90": _COUNT, "log_inc": _COUNT,
+    "men_mais": _COUNT, "men_coll": _COUNT, "men_1ind": _COUNT, "men_5ind": _COUNT, "men_fmp": _COUNT,
+}
+# A vintage missing any of these is skipped
+TILE_REQUIRED = ["idcar_1km", "ind", "men", "pop_income"]
+# Per vintage: lower-cased source column -> canonical column (unlisted columns keep their name).
+# Adding a vintage = a FILES entry + a schema entry here.
+TILE_SCHEMAS = {
+    2015: {"id_carr1km": "idcar_1km", "ind_snv": "pop_income"},
+    2017: {"ind_snv": "pop_income"},
+    2019: {"ind_snv": "pop_income"},
+}
+
+# Build validation limits (utils.validation); shares are fractions, not percents
+VALIDATION = {
+    "max_join_loss": 0.01,          # population / households / income lost matching tiles to communes
+    "conservation_tol": 0.001,      # commune table vs matched tiles
+    "max_unmatched_rate": 0.02,     # tiles without a commune
+    "rate_tol": 1e-6,               # numerator may exceed its denominator by rounding only
+    "max_implausible_share": 0.001, # communes with a raw rate above 100%
+    "psi_warn": 0.1,
+    "psi_fail": 0.25,
+}
+VALIDATION_REPORT = os.path.join(DATA_DIR, "validation_report.json")
+# Static snapshot export (scripts/export_static.py); the app seeds its figure cache from the manifest
+STATIC_DIR = os.path.join(DATA_DIR, "static")
+SNAPSHOT_MANIFEST = os.path.join(STATIC_DIR, "manifest.json")
+# Local read-only API (scripts/serve_api.py); Arrow copies of the tables are memory-mapped from ARROW_DIR
+ARROW_DIR = os.path.join(DATA_DIR, "arrow")
+API_PORT = 8502
+# Where the app reaches the API, and the tile URL template the browser fetches (they differ
+# behind a proxy); both can be set from the environment
+API_URL = os.environ.get("GENEVA_API_URL", f"http://127.0.0.1:{API_PORT}")
+VTILE_PUBLIC_URL = os.environ.get("GENEVA_VTILE_URL", API_URL + "/tiles/communes/{z}/{x}/{y}.pbf")
+API_HEALTH_TTL = 30         # seconds the app trusts an API health check
+API_CACHE_SIZE = 512        # rendered responses kept in memory
+API_GZIP_MIN_BYTES = 1024   # smaller bodies are sent uncompressed
+API_MAX_RINGS = 1000        # /bands refuses finer ring layouts
+# Vector tiles (utils.vtiles): one MBTiles file per layer, served by the API under /tiles/<layer>/
+VTILES_DIR = os.path.join(DATA_DIR, "vtiles")
+VTILE_ZOOMS = {"communes": (4, 11), "grid": (9, 12)}  # the map overzooms past the last level
+VTILE_EXTENT = 4096   # tile coordinate units per side
+VTILE_BUFFER = 64     # units kept around each tile so clipped edges do not show
+VTILE_SIMPLIFY = 4    # simplification tolerance, in tile units of each zoom
+# Smoothed metric surfaces (utils.raster): Gaussian kernel bandwidths and pyramid layout
+RASTER_DIR = os.path.join(DATA_DIR, "raster")
+RASTER_BANDWIDTHS_KM = [2, 5, 10]
+RASTER_MIN_POP = 1.0    # smoothed inhabitants per 1 km cell below which the surface is transparent
+RASTER_MIN_SIZE = 256   # the pyramid stops once an image fits in this many pixels
 
 # Data URLs (for download script)
 DATA_URLS = {
@@ -38,3 +102,115 @@ METRICS = [
 
 # Formatting
 METRIC_LABELS = {m: m.replace("_", " ").title() for m in METRICS}
+
+# Denominator column of each rate (as computed in utils.prep.derive_metrics), used to weight averages
+METRIC_WEIGHTS = {
+    "avg_income": "ind",
+    "poverty_rate": "men",
+    "ownership_rate": "men",
+    "social_housing_rate": "social_housing_base",  # housing estimate, households where it is 0
+    "youth_pct": "ind",
+    "senior_pct": "ind",
+    "single_parent_pct": "men",
+    "old_housing_pct": "total_housing_est",
+    "new_housing_pct": "total_housing_est",
+    "houses_pct": "housing_type_total",  # men_mais + men_coll
+    "apartments_pct": "housing_type_total",
+    "gini_income": "ind",
+    "theil_income": "ind",
+    "p90_p10_income": "ind"
+}
+
+# Within-commune inequality of tile incomes (kept out of METRICS: not ratios of summed columns)
+INEQUALITY_METRICS = ["gini_income", "theil_income", "p90_p10_income"]
+INEQUALITY_MIN_TILES = 3  # fewer tiles than this: no measurable internal spread
+
+# Tile panel (1 km INSPIRE grid, EPSG:3035): base columns kept per tile
+TILE_SIZE_M = 1000
+TILE_PANEL_COLS = ["ind", "men", "men_pauv", "men_prop", "log_soc", "pop_income"]
+TILE_METRICS = ["avg_income", "poverty_rate", "ownership_rate", "social_housing_rate"]
+
+# Statistics store
+STATS_QUANTILES = [0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99]
+STATS_HIST_BINS = 30
+STATS_TOP_K = 50
+
+# Correlation engine (weights rows by population, bootstrap resamples communes)
+CORR_WEIGHT = "ind"
+CORR_BOOTSTRAP = {"n_boot": 200, "batch_size": 20, "seed": 2019}
+
+# Scatter rendering: WebGL above the first threshold, 2D density grid above the second
+SCATTER_WEBGL_THRESHOLD = 5_000
+SCATTER_DENSITY_THRESHOLD = 200_000
+SCATTER_GRID_BINS = 120
+
+# Figure cache (serialized Plotly specs, LRU-evicted past this budget)
+FIGURE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Attractor cities (poles) for distance features; mass ~ metro population in millions.
+# Each key adds a `dist_<key>_km` column, "geneva" keeps the historical `dist_geneva_km`.
+ATTRACTORS = {
+    "geneva": {"name": "Geneva", "lat": 46.2044, "lon": 6.1432, "mass": 1.0},
+    "lausanne": {"name": "Lausanne", "lat": 46.5197, "lon": 6.6323, "mass": 0.4},
+    "basel": {"name": "Basel", "lat": 47.5596, "lon": 7.5886, "mass": 0.55},
+    "lyon": {"name": "Lyon", "lat": 45.7640, "lon": 4.8357, "mass": 2.3},
+    "paris": {"name": "Paris", "lat": 48.8566, "lon": 2.3522, "mass": 12.3},
+}
+DEFAULT_ATTRACTOR = "geneva"
+
+# Gravity accessibility: sum of mass * exp(-d / decay) over poles within max distance
+ACCESSIBILITY_DECAY_KM = 30.0
+ACCESSIBILITY_MAX_KM = 150.0
+
+# Territory presets (utils.territories). Kinds: 'codes' (INSEE list), 'radius' (around an
+# attractor or a lat/lon), 'department' (INSEE prefix), 'polygon' (lon/lat ring).
+TERRITORY_PRESETS = {
+    "Geneva area (25 km)": {"kind": "radius", "attractor": "geneva", "radius_km": 25},
+    "Geneva area (50 km)": {"kind": "radius", "attractor": "geneva", "radius_km": 50},
+    "Ain (01)": {"kind": "department", "prefix": "01"},
+    "Haute-Savoie (74)": {"kind": "department", "prefix": "74"},
+    "Doubs (25)": {"kind": "department", "prefix": "25"},
+    "Lyon area (25 km)": {"kind": "radius", "attractor": "lyon", "radius_km": 25},
+}
+DEFAULT_TERRITORIES = ["Geneva area (25 km)", "Ain (01)", "Haute-Savoie (74)"]
+
+# Sidebar commune search (utils.search)
+SEARCH_LIMIT = 20           # candidates sent to the selector per keystroke
+SEARCH_FUZZY_CUTOFF = 0.75  # difflib similarity for the typo fallback
+DEEP_DIVES_DEFAULT_COMMUNES = 4  # Deep Dives open with the alphabetically first communes selected
+# Deep Dives custom comparison: shown next to the primary metric
+COMPARISON_METRICS = ['avg_income', 'poverty_rate', 'total_pop', 'ownership_rate', 'youth_pct', 'social_housing_rate']
+
+# Distance-decay model fitting
+DECAY_MODELS = {"exponential": "Exponential", "power_law": "Power law", "piecewise": "Piecewise linear"}
+DECAY_FIT = {"n_breaks": 2, "n_candidates": 80, "n_boot": 100, "batch_size": 10, "seed": 2019}
+
+# Distance-ring aggregation (Deep Dives gradient)
+BAND_DEFAULTS = {"width_km": 5, "max_km": 100}
+
+# Year-over-year change: movers need at least this many inhabitants in both vintages
+CHANGE_MIN_POP = 500
+
+# Projections: intermediate years are interpolated, later ones extrapolated from the trend
+PROJECTION_YEARS = [2016, 2018, 2021, 2023, 2025, 2027]
+PROJECTION_LOG_METRICS = ["avg_income"]  # fitted as log-linear (constant growth rate)
+PROJECTION_Z = 1.96  # interval half-width in standard errors of the trend
+
+# Similarity search ("communes like this one")
+SIMILARITY_WEIGHT = "ind"  # weights of the standardization in the weighted variant
+SIMILARITY_K = 5
+
+# Commune typology (mini-batch k-means over standardized METRICS)
+CLUSTER_K = 6
+CLUSTER_FIT = {"batch_size": 2048, "n_iter": 100, "n_refine": 3, "seed": 2019}
+
+# Spatial autocorrelation (Moran's I / LISA)
+SPATIAL_PERMUTATIONS = 999
+SPATIAL_ALPHA = 0.05
+LISA_COLORS = {
+    "High-High": (215, 25, 28, 200),
+    "Low-Low": (44, 123, 182, 200),
+    "High-Low": (253, 174, 97, 200),
+    "Low-High": (171, 217, 233, 200),
+    "Not significant": (220, 220, 220, 80),
+}
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+from utils.constants import METRICS, CORR_WEIGHT, CORR_BOOTSTRAP
+from utils.resample import bootstrap_counts, parallel_batches
+
+def _design(data, metrics, weight_col=CORR_WEIGHT):
+    """
+    Metric matrix and weights with incomplete / zero-weight rows removed.
+    Metrics with no value at all (masked for the vintage) are dropped first, or
+    every row would be incomplete; `keep` flags the metric columns kept.
+    """
+    X = data[metrics].to_numpy(dtype=float)
+    w = data[weight_col].to_numpy(dtype=float) if weight_col in data.columns else np.ones(len(X))
+    keep = ~np.isnan(X).all(axis=0)
+    X = X[:, keep]
+    ok = ~np.isnan(X).any(axis=1) & (w > 0)
+    return X[ok], w[ok], keep
+
+def _expand(corr, keep):
+    """Matrix over the kept metrics back to all metrics, NaN for the dropped ones."""
+    full = np.full((len(keep), len(keep)), np.nan)
+    full[np.ix_(keep, keep)] = corr
+    return full
+
+def weighted_corr(X, w):
+    """Weighted Pearson correlation of the columns of X (one covariance pass)."""
+    w = w / w.sum()
+    Xc = X - w @ X
+    cov = (Xc * w[:, None]).T @ Xc
+    sd = np.sqrt(np.diag(cov))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return cov / np.outer(sd, sd)
+
+def _batch_corr(X, w, counts):
+    """Weighted correlations for a batch of bootstrap count vectors, shape (B, p, p)."""
+    W = counts * w                                      # (B, n)
+    W = W / W.sum(axis=1, keepdims=True)
+    mu = W @ X                                          # (B, p)
+    second = np.matmul((X[None, :, :] * W[:, :, None]).transpose(0, 2, 1), X)
+    cov = second - mu[:, :, None] * mu[:, None, :]
+    sd = np.sqrt(np.einsum('bii->bi', cov))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return cov / (sd[:, :, None] * sd[:, None, :])
+
+def build_correlations(by_region, index, metrics=METRICS, weight_col=CORR_WEIGHT):
+    """
+    Population-weighted correlation matrix over all metrics, once per year.
+    Returns:
+        dict: {year: DataFrame (metrics x metrics)}
+    """
+    metrics = [m for m in metrics if m in by_region.columns]
+    out = {}
+    for year in index['years']:
+        start, stop = index['year_slices'][year]
+        X, w, keep = _design(by_region.iloc[start:stop], metrics, weight_col)
+        out[year] = pd.DataFrame(_expand(weighted_corr(X, w), keep), index=metrics, columns=metrics)
+    return out
+
+def bootstrap_corr(data, metrics=METRICS, weight_col=CORR_WEIGHT, n_boot=CORR_BOOTSTRAP['n_boot'],
+                   batch_size=CORR_BOOTSTRAP['batch_size'], seed=CORR_BOOTSTRAP['seed'], alpha=0.05, workers=None):
+    """
+    Percentile bootstrap CI of the weighted correlation matrix.
+    Replicates are resampled communes, evaluated in vectorized batches run in parallel.
+    Returns:
+        tuple: (lower DataFrame, upper DataFrame)
+    """
+    metrics = [m for m in metrics if m in data.columns]
+    X, w, keep = _design(data, metrics, weight_col)
+
+    def run(rng, size):
+        return _batch_corr(X, w, bootstrap_counts(rng, len(X), size))
+
+    reps = np.concatenate(parallel_batches(run, n_boot, batch_size, seed, workers))
+    lo, hi = np.nanquantile(reps, [alpha / 2, 1 - alpha / 2], axis=0)
+    return (
+        pd.DataFrame(_expand(lo, keep), index=metrics, columns=metrics),
+        pd.DataFrame(_expand(hi, keep), index=metrics, columns=metrics)
+    )
+
+@st.cache_data(show_spinner="Bootstrapping correlations...")
+def correlation_ci(_tables, fingerprint, year, n_boot=CORR_BOOTSTRAP['n_boot'], seed=CORR_BOOTSTRAP['seed']):
+    """Cached bootstrap CI for one year (keyed on data fingerprint, year, replicates and seed)."""
+    start, stop = _tables['index']['year_slices'][year]
+    return bootstrap_corr(_tables['by_region'].iloc[start:stop], n_boot=n_boot, seed=seed)
@@ -0,0 +1,91 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+import plotly.io as pio
+from utils.constants import FIGURE_CACHE_MAX_BYTES
+
+# Process-wide: entries are keyed on the data version, so sessions can share them
+_lock = threading.Lock()
+_store = OrderedDict()
+_state = {"bytes": 0, "hits": 0, "misses": 0}
+# Data fingerprints whose exported snapshot (scripts/export_static.py) is already loaded
+_seeded = set()
+
+def figure_key(chart, cache_key, *params):
+    """Cache key: chart type, caller key (data version, year, selection...) and chart parameters."""
+    return (chart, cache_key) + tuple(tuple(p) if isinstance(p, list) else p for p in params)
+
+def get_or_build(key, build, max_bytes=FIGURE_CACHE_MAX_BYTES):
+    """
+    Return the cached figure for `key`, or build, serialize and store it.
+    Specs are kept as JSON strings in LRU order, evicted past `max_bytes`.
+    """
+    with _lock:
+        spec = _store.get(key)
+        if spec is not None:
+            _store.move_to_end(key)
+            _state["hits"] += 1
+    if spec is not None:
+        return pio.from_json(spec)
+
+    fig = build()
+    if fig is None:
+        return None
+    with _lock:
+        _state["misses"] += 1
+    put(key, fig, max_bytes)
+    return fig
+
+def put(key, fig, max_bytes=FIGURE_CACHE_MAX_BYTES):
+    """Store a figure (or its JSON spec) under `key`, evicting LRU entries past `max_bytes`."""
+    spec = fig if isinstance(fig, str) else fig.to_json()
+    with _lock:
+        if key not in _store and len(spec) <= max_bytes:
+            _store[key] = spec
+            _state["bytes"] += len(spec)
+            while _state["bytes"] > max_bytes:
+                _, old = _store.popitem(last=False)
+                _state["bytes"] -= len(old)
+
+def _as_key(value):
+    """JSON lists back to the tuples figure_key builds."""
+    return tuple(_as_key(v) for v in value) if isinstance(value, list) else value
+
+def seed(manifest_path, fingerprint):
+    """
+    Preload the figures of an exported snapshot (see scripts/export_static.py), once
+    per process and data version. Ignored when the snapshot is for other data.
+    Returns:
+        int: number of figures loaded
+    """
+    with _lock:
+        if fingerprint in _seeded:
+            return 0
+    # Not marked seeded until loaded: a snapshot exported later is still picked up
+    if not os.path.exists(manifest_path):
+        return 0
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("fingerprint") != fingerprint:
+        return 0
+
+    root = os.path.dirname(manifest_path)
+    for entry in manifest["figures"]:
+        with open(os.path.join(root, entry["file"]), encoding="utf-8") as f:
+            put(_as_key(entry["key"]), f.read())
+    with _lock:
+        _seeded.add(fingerprint)
+    return len(manifest["figures"])
+
+def cache_stats():
+    """Hit/miss counters and current footprint."""
+    with _lock:
+        return {"entries": len(_store), **_state}
+
+def clear():
+    """Drop all cached figures and reset counters."""
+    with _lock:
+        _store.clear()
+        _seeded.clear()
+        _state.update(bytes=0, hits=0, misses=0)
@@ -0,0 +1,78 @@
+import numpy as np
+from utils.constants import METRICS
+
+def build_table_index(by_region, metrics=METRICS):
+    """
+    Precompute positional lookups over `by_region`.
+    Expects `by_region` sorted by (year, lcog_geo) with a RangeIndex so that
+    each year is one contiguous block of rows.
+    Returns:
+        dict: {
+            'years': sorted list of years,
+            'year_slices': {year: (start, stop)},
+            'code_pos': {year: {insee: row}},
+            'sort_orders': {year: {metric: rows sorted descending, NaN last}},
+            'n_valid': {year: {metric: number of non-NaN rows}}
+        }
+    """
+    years_col = by_region['year'].to_numpy()
+    years, starts = np.unique(years_col, return_index=True)
+    stops = np.append(starts[1:], len(years_col))
+
+    index = {
+        'years': [int(y) for y in years],
+        'year_slices': {},
+        'code_pos': {},
+        'sort_orders': {},
+        'n_valid': {},
+    }
+
+    codes = by_region['lcog_geo'].astype(str).to_numpy()
+
+    for year, start, stop in zip(years, starts, stops):
+        year = int(year)
+        start, stop = int(start), int(stop)
+        index['year_slices'][year] = (start, stop)
+
+        rows = np.arange(start, stop)
+        index['code_pos'][year] = dict(zip(codes[start:stop], rows))
+
+        orders, n_valid = {}, {}
+        for m in metrics:
+            if m not in by_region.columns:
+                continue
+            vals = by_region[m].to_numpy(dtype=float)[start:stop]
+            # Stable descending sort with NaN pushed to the end
+            order = np.argsort(np.where(np.isnan(vals), np.inf, -vals), kind='stable')
+            orders[m] = rows[order]
+            n_valid[m] = int((~np.isnan(vals)).sum())
+        index['sort_orders'][year] = orders
+        index['n_valid'][year] = n_valid
+
+    return index
+
+def year_view(df, index, year):
+    """Slice of `by_region` for one year (no scan)."""
+    if year not in index['year_slices']:
+        return df.iloc[0:0]
+    start, stop = index['year_slices'][year]
+    return df.iloc[start:stop]
+
+def code_rows(index, codes, years):
+    """Row positions of the given INSEE codes across the given years."""
+    rows = []
+    for y in sorted(years):
+        lookup = index['code_pos'].get(y, {})
+        rows.extend(lookup[c] for c in codes if c in lookup)
+    return np.sort(np.array(rows, dtype=int))
+
+def top_rows(index, metric, year, n=10, ascending=False):
+    """Row positions of the top (or bottom) `n` communes for a metric."""
+    order = index['sort_orders'].get(year, {}).get(metric)
+    if order is None:
+        return np.array([], dtype=int)
+    if not ascending:
+        return order[:n]
+    # NaN sit at the end of the descending order, skip them for the bottom
+    n_valid = index['n_valid'][year][metric]
+    return order[:n_valid][::-1][:n]
@@ -2,29 +2,80 @@ import streamlit as st
 import geopandas as gpd
 import os
 import pandas as pd
-from utils.constants import DATA_DIR, FILES, COMMUNES_FILE
+import pyogrio
+from utils.constants import CACHE_FILE, CACHE_VERSION, DATA_DIR, FILES, COMMUNES_FILE, TILE_COLUMNS, TILE_REQUIRED, TILE_SCHEMAS
+
+def read_vintage(path, rename):
+    """
+    Read one tile vintage with only the canonical columns, renamed and typed.
+    Geometry is read only when the vintage has no commune code (it is then needed
+    for the spatial join); otherwise a plain DataFrame is returned.
+    Args:
+        path (str): tile file
+        rename (dict): lower-cased source column -> canonical column
+    Returns:
+        tuple: (DataFrame or GeoDataFrame, list of canonical columns the vintage lacks)
+    """
+    # Source fields in their original case, keyed by canonical name
+    fields = {}
+    for field in pyogrio.read_info(path)['fields']:
+        name = field.strip().lower()
+        canonical = rename.get(name, name)
+        if canonical in TILE_COLUMNS:
+            fields[canonical] = field
+    missing = [c for c in TILE_COLUMNS if c not in fields]
+
+    df = pyogrio.read_dataframe(path, columns=list(fields.values()), read_geometry='lcog_geo' in missing)
+    df.rename(columns={field: canonical for canonical, field in fields.items()}, inplace=True)
+
+    # Coerce in place: typed numeric fields only need their nulls handled
+    drop = pd.Series(False, index=df.index)
+    for c in fields:
+        dtype, nulls = TILE_COLUMNS[c]
+        if dtype != "str" and df[c].dtype == object:
+            df[c] = pd.to_numeric(df[c], errors='coerce')
+        if df[c].hasnans:
+            if nulls == "zero":
+                df[c] = df[c].fillna(0)
+            else:
+                drop |= df[c].isna()
+        if dtype == "str":
+            df[c] = df[c].astype(str)
+        elif df[c].dtype != dtype:
+            df[c] = df[c].astype(dtype)
+    if drop.any():
+        df = df[~drop.to_numpy()]
+    df.attrs['dropped_rows'] = int(drop.sum())
+    return df, missing
 
 @st.cache_data(show_spinner="Loading Data...")
 def load_data(data_dir=DATA_DIR):
     """
-    Load all available datasets defined in constants.
+    Load all available datasets defined in constants, harmonized to the tile schema.
+    Each frame's `attrs['missing_columns']` lists the canonical columns its vintage lacks
+    and `attrs['dropped_rows']` counts rows dropped by the null policy.
     Returns:
-        dict: {year: gdf}, communes_gdf
+        dict: {year: df}, communes_gdf
     """
     tiles_data = {}
-    
+
     for year, filename in FILES.items():
         path = os.path.join(data_dir, filename)
         if os.path.exists(path):
             try:
-                gdf = gpd.read_file(path)
-                gdf.columns = gdf.columns.str.strip().str.lower()
-                tiles_data[year] = gdf
+                df, missing = read_vintage(path, TILE_SCHEMAS.get(year, {}))
             except Exception as e:
                 st.warning(f"Could not load {year} data: {e}")
+                continue
+            lacking = [c for c in TILE_REQUIRED if c in missing]
+            if lacking:
+                st.warning(f"Skipping {year} data, required columns missing: {', '.join(lacking)}")
+                continue
+            df.attrs['missing_columns'] = missing
+            tiles_data[year] = df
         else:
             # Silent fail or debug log, app shouldn't crash if one year missing
-            # st.warning(f"File not found for {year}: {path}") 
+            # st.warning(f"File not found for {year}: {path}")
             pass
 
     # Load Communes
@@ -35,5 +86,19 @@ def load_data(data_dir=DATA_DIR):
     else:
         st.error(f"Communes file not found at {communes_path}")
         communes = None
-            
+
     return tiles_data, communes
+
+def load_cache(cache_path=CACHE_FILE):
+    """
+    Processed tables for the offline scripts, or None (with the reason printed)
+    when the cache is missing or from an older version.
+    """
+    if not os.path.exists(cache_path):
+        print(f"❌ {cache_path} not found. Run `make build` first.")
+        return None
+    tables = pd.read_pickle(cache_path)
+    if tables.get("version") != CACHE_VERSION:
+        print("❌ Cache is from an older version. Run `make build` first.")
+        return None
+    return tables
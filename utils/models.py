@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+from scipy.optimize import curve_fit
+from utils.constants import DECAY_FIT
+from utils.resample import bootstrap_counts, parallel_batches
+
+# --- Model fits (all weighted least squares on distance d >= 0) ---
+
+def _exp_curve(d, c, a, s):
+    return c + a * np.exp(-d / s)
+
+def fit_exponential(d, y, w):
+    """y = c + a * exp(-d / s), nonlinear WLS."""
+    order = np.argsort(d)
+    far = np.average(y[order][-max(1, len(d) // 5):], weights=w[order][-max(1, len(d) // 5):])
+    near = np.average(y[order][:max(1, len(d) // 20)], weights=w[order][:max(1, len(d) // 20)])
+    p0 = [far, near - far, max(np.median(d) / 2, 1.0)]
+    params, _ = curve_fit(
+        _exp_curve, d, y, p0=p0, sigma=1 / np.sqrt(w / w.mean()),
+        bounds=([-np.inf, -np.inf, 0.1], [np.inf, np.inf, np.inf]), maxfev=5000
+    )
+    return dict(zip(['c', 'a', 'scale_km'], params))
+
+def fit_power_law(d, y, w):
+    """y = a * d^(-b), WLS on logs (d clipped at 1 km, y > 0 only)."""
+    ok = y > 0
+    if ok.sum() < 2:
+        raise ValueError("power law needs at least two positive values")
+    X = np.column_stack([np.ones(ok.sum()), np.log(np.maximum(d[ok], 1.0))])
+    sw = np.sqrt(w[ok])
+    beta = np.linalg.lstsq(X * sw[:, None], np.log(y[ok]) * sw, rcond=None)[0]
+    return {'a': float(np.exp(beta[0])), 'b': float(-beta[1])}
+
+def _suffix_sums(d, y, w):
+    """Sorted distances and suffix sums of w, wd, wd^2, wy, wdy (sums over d > t via searchsorted)."""
+    order = np.argsort(d)
+    d, y, w = d[order], y[order], w[order]
+    cols = np.column_stack([w, w * d, w * d * d, w * y, w * d * y])
+    suffix = np.vstack([np.cumsum(cols[::-1], axis=0)[::-1], np.zeros((1, 5))])
+    return d, suffix
+
+def _piecewise_sse(d_sorted, suffix, wyy, bps):
+    """
+    Weighted SSE and coefficients of continuous hinge fits for a batch of breakpoint sets.
+    Basis: 1, d, (d - b_k)+ ; Gram matrices are assembled from suffix sums, O(1) per candidate.
+    Args:
+        bps (array): shape (P, K) breakpoints per candidate
+    Returns:
+        tuple: (sse (P,), beta (P, K + 2))
+    """
+    P, K = bps.shape
+    S = lambda t, j: suffix[np.searchsorted(d_sorted, t, side='right'), j]
+    tot = suffix[0]
+    G = np.zeros((P, K + 2, K + 2))
+    r = np.zeros((P, K + 2))
+    G[:, 0, 0], G[:, 0, 1], G[:, 1, 1] = tot[0], tot[1], tot[2]
+    r[:, 0], r[:, 1] = tot[3], tot[4]
+    for i in range(K):
+        b = bps[:, i]
+        G[:, 0, i + 2] = S(b, 1) - b * S(b, 0)
+        G[:, 1, i + 2] = S(b, 2) - b * S(b, 1)
+        r[:, i + 2] = S(b, 4) - b * S(b, 3)
+        for j in range(i, K):
+            b2 = bps[:, j]
+            m = np.maximum(b, b2)
+            G[:, i + 2, j + 2] = S(m, 2) - (b + b2) * S(m, 1) + b * b2 * S(m, 0)
+    iu = np.triu_indices(K + 2, 1)
+    G[:, iu[1], iu[0]] = G[:, iu[0], iu[1]]
+    # Tiny relative diagonal loading keeps degenerate candidates (empty segments) solvable
+    diag = np.arange(K + 2)
+    G[:, diag, diag] *= 1 + 1e-12
+    beta = np.linalg.solve(G, r[:, :, None])[:, :, 0]
+    sse = wyy - np.einsum('pk,pk->p', beta, r)
+    return sse, beta
+
+def fit_piecewise(d, y, w, n_breaks=DECAY_FIT['n_breaks'], n_candidates=DECAY_FIT['n_candidates']):
+    """Continuous piecewise-linear fit; breakpoints chosen by exhaustive search over distance quantiles."""
+    cands = np.unique(np.quantile(d, np.linspace(0.02, 0.9, n_candidates)))
+    if n_breaks == 1:
+        bps = cands[:, None]
+    else:
+        i, j = np.triu_indices(len(cands), 1)
+        bps = np.column_stack([cands[i], cands[j]])
+    d_sorted, suffix = _suffix_sums(d, y, w)
+    sse, beta = _piecewise_sse(d_sorted, suffix, np.sum(w * y * y), bps)
+    best = int(np.nanargmin(sse))
+    b, coef = bps[best], beta[best]
+    # Report intercept and the slope of each segment (per km)
+    slopes = np.cumsum(coef[1:])
+    out = {'intercept': float(coef[0])}
+    out.update({f'break_{k + 1}_km': float(v) for k, v in enumerate(b)})
+    out.update({f'slope_{k + 1}': float(v) for k, v in enumerate(slopes)})
+    return out
+
+def predict(model, params, d):
+    """Evaluate a fitted model on distances `d`."""
+    d = np.asarray(d, dtype=float)
+    if model == 'exponential':
+        return _exp_curve(d, params['c'], params['a'], params['scale_km'])
+    if model == 'power_law':
+        return params['a'] * np.maximum(d, 1.0) ** (-params['b'])
+    breaks = sorted(v for k, v in params.items() if k.startswith('break_'))
+    yhat = params['intercept'] + params['slope_1'] * d
+    prev = params['slope_1']
+    for k, b in enumerate(breaks):
+        slope = params[f'slope_{k + 2}']
+        yhat = yhat + (slope - prev) * np.maximum(d - b, 0)
+        prev = slope
+    return yhat
+
+FITTERS = {
+    'exponential': fit_exponential,
+    'power_law': fit_power_law,
+    'piecewise': fit_piecewise,
+}
+
+def fit_decay(d, y, w, model, n_boot=0, seed=DECAY_FIT['seed'], alpha=0.05):
+    """
+    Fit one decay model, with optional bootstrap CIs on its parameters.
+    Returns:
+        dict: params, ci ({param: (lo, hi)}), weighted r2, fitted curve (x, y);
+        or {'model', 'error'} when the model cannot be fitted to this data
+    """
+    d, y, w = (np.asarray(v, dtype=float) for v in (d, y, w))
+    ok = ~(np.isnan(d) | np.isnan(y) | np.isnan(w)) & (w > 0)
+    d, y, w = d[ok], y[ok], w[ok]
+    fitter = FITTERS[model]
+    try:
+        params = fitter(d, y, w)
+    except (RuntimeError, ValueError, ZeroDivisionError, np.linalg.LinAlgError):
+        params = None
+    if params is None or not np.all(np.isfinite(list(params.values()))):
+        return {'model': model, 'error': "model did not converge"}
+
+    resid = y - predict(model, params, d)
+    ybar = np.average(y, weights=w)
+    r2 = 1 - np.sum(w * resid ** 2) / np.sum(w * (y - ybar) ** 2)
+
+    ci = {}
+    if n_boot:
+        def run(rng, size):
+            counts = bootstrap_counts(rng, len(d), size)
+            reps = []
+            for c in counts:
+                keep = c > 0
+                try:
+                    reps.append(fitter(d[keep], y[keep], (w * c)[keep]))
+                except (RuntimeError, ValueError, np.linalg.LinAlgError):
+                    continue
+            return reps
+        reps = pd.DataFrame([p for batch in parallel_batches(run, n_boot, DECAY_FIT['batch_size'], seed) for p in batch])
+        lo, hi = reps.quantile(alpha / 2), reps.quantile(1 - alpha / 2)
+        ci = {k: (float(lo[k]), float(hi[k])) for k in reps.columns}
+
+    grid = np.linspace(0, d.max(), 200)
+    return {
+        'model': model,
+        'params': {k: float(v) for k, v in params.items()},
+        'ci': ci,
+        'r2': float(r2),
+        'curve': {'x': grid, 'y': predict(model, params, grid)}
+    }
+
+@st.cache_data(show_spinner="Fitting decay curve...")
+def cached_decay_fit(_data, fingerprint, metric, year, attractor, model, weight='total_pop', n_boot=0):
+    """Decay fit of `metric` on dist_<attractor>_km, cached per (metric, year, attractor, model)."""
+    dist_col = f'dist_{attractor}_km'
+    fit = fit_decay(_data[dist_col], _data[metric], _data[weight], model, n_boot=n_boot)
+    fit['key'] = (metric, year, attractor, model, n_boot)
+    return fit
@@ -1,7 +1,53 @@
+import hashlib
 import numpy as np
 import pandas as pd
 import geopandas as gpd
 import streamlit as st
+from utils.constants import CACHE_VERSION
+from utils.index import build_table_index, year_view
+from utils.stats import build_stats_store
+from utils.correlation import build_correlations
+from utils.attractors import commune_centroids, attractor_features
+from utils.spatial import build_adjacency
+from utils.change import build_panel
+from utils.projection import build_projections
+from utils.similarity import build_similarity_index
+from utils.clustering import build_typology
+from utils.inequality import commune_inequality
+from utils.tiles import tile_block, build_tile_panel
+from utils.validation import column_totals, validate_build
+from utils.search import build_search_index
+
+# Columns to preserve during aggregation (Must sum these up)
+SUM_COLS = [
+    'ind', 'men', 'men_pauv', 'men_prop', 'log_soc', 'pop_income',
+    'ind_0_3', 'ind_4_5', 'ind_6_10', 'ind_11_17', 'ind_18_24', 
+    'ind_25_39', 'ind_40_54', 'ind_55_64', 'ind_65_79', 'ind_80p',
+    'log_av45', 'log_45_70', 'log_70_90', 'log_ap90', 'log_inc',
+    'men_mais', 'men_coll', 'men_1ind', 'men_5ind', 'men_fmp'
+]
+YOUTH_COLS = ['ind_0_3', 'ind_4_5', 'ind_6_10', 'ind_11_17']
+SENIOR_COLS = ['ind_65_79', 'ind_80p']
+WORKING_COLS = ['ind_18_24', 'ind_25_39', 'ind_40_54', 'ind_55_64']
+HOUSING_ERAS = ['log_av45', 'log_45_70', 'log_70_90', 'log_ap90', 'log_inc']
+# Base columns each derived metric (or denominator) is computed from: a vintage lacking one has no value for it
+METRIC_INPUTS = {
+    'avg_income': ['pop_income', 'ind'],
+    'poverty_rate': ['men_pauv', 'men'],
+    'ownership_rate': ['men_prop', 'men'],
+    'youth_pct': YOUTH_COLS + ['ind'],
+    'senior_pct': SENIOR_COLS + ['ind'],
+    'single_parent_pct': ['men_fmp', 'men'],
+    'single_person_pct': ['men_1ind', 'men'],
+    'total_housing_est': HOUSING_ERAS,
+    'old_housing_pct': HOUSING_ERAS,
+    'new_housing_pct': HOUSING_ERAS,
+    'social_housing_base': HOUSING_ERAS,
+    'social_housing_rate': ['log_soc'] + HOUSING_ERAS,
+    'housing_type_total': ['men_mais', 'men_coll'],
+    'houses_pct': ['men_mais', 'men_coll'],
+    'apartments_pct': ['men_mais', 'men_coll'],
+}
 
 def safe_divide(num, den, fill=np.nan):
     """Elementwise safe divide."""
@@ -11,6 +57,17 @@ def safe_divide(num, den, fill=np.nan):
         out = np.where((den == 0) | np.isnan(den) | np.isinf(den), fill, num / den)
     return out
 
+def repair_crs(gdf):
+    """
+    Communes with projected coordinates (beyond +/-360) but a geographic or missing CRS
+    are Lambert-93 (EPSG:2154) mislabelled: relabel them once, so every later
+    reprojection (centroids, maps, vector tiles) is right.
+    """
+    xmin, ymin, _, _ = gdf.total_bounds
+    if (abs(xmin) > 360 or abs(ymin) > 360) and (gdf.crs is None or gdf.crs.is_geographic):
+        return gdf.set_crs(epsg=2154, allow_override=True)
+    return gdf
+
 def fix_geometry(geom):
     """Fix invalid geometries."""
     if geom is None or geom.is_empty:
@@ -22,27 +79,101 @@ def fix_geometry(geom):
     except:
         return None
 
-def process_tiles(df):
-    """Pre-process tile data (convert strings to numeric)."""
-    df = df.copy()
+def derive_metrics(df):
+    """
+    Compute the ratio metrics from summed base columns (in place).
+    Works on any aggregation level whose rows hold sums of SUM_COLS
+    (communes, distance rings, custom territories).
+    """
+    # 1. Standard Metrics
+    df['total_pop'] = df['ind']
+    df['total_households'] = df['men']
+    df['avg_income'] = safe_divide(df['pop_income'], df['ind'])
+    df['poverty_rate'] = safe_divide(df['men_pauv'], df['men']) * 100
+    df['ownership_rate'] = safe_divide(df['men_prop'], df['men']) * 100
+    
+    # 2. Demographics
+    # Sum age bands if available
+    df['pop_youth'] = df[[c for c in YOUTH_COLS if c in df.columns]].sum(axis=1)
+    df['pop_senior'] = df[[c for c in SENIOR_COLS if c in df.columns]].sum(axis=1)
+    df['pop_working'] = df[[c for c in WORKING_COLS if c in df.columns]].sum(axis=1)
+    
+    df['youth_pct'] = safe_divide(df['pop_youth'], df['ind']) * 100
+    df['senior_pct'] = safe_divide(df['pop_senior'], df['ind']) * 100
     
-    # Extensive list of potential columns from 2015-2019 datasets
-    cols_to_numeric = [
-        'ind', 'men', 'men_pauv', 'men_prop', 'log_soc', 'ind_snv',
-        # Demographics
-        'ind_0_3', 'ind_4_5', 'ind_6_10', 'ind_11_17', 'ind_18_24', 
-        'ind_25_39', 'ind_40_54', 'ind_55_64', 'ind_65_79', 'ind_80p',
-        # Housing
-        'log_av45', 'log_45_70', 'log_70_90', 'log_ap90', 'log_inc',
-        'men_mais', 'men_coll',
-        # Family
-        'men_1ind', 'men_5ind', 'men_fmp'
-    ]
+    # 3. Family Structure
+    if 'men_fmp' in df.columns:
+        df['single_parent_pct'] = safe_divide(df['men_fmp'], df['men']) * 100
+    if 'men_1ind' in df.columns:
+        df['single_person_pct'] = safe_divide(df['men_1ind'], df['men']) * 100
+        
+    # 4. Housing Stock
+    existing_eras = [c for c in HOUSING_ERAS if c in df.columns]
     
-    for c in cols_to_numeric:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0)
-            
+    # Total estimated housings (sum of eras) - might defer from 'men' slightly
+    df['total_housing_est'] = df[existing_eras].sum(axis=1)
+    
+    # Use total_housing_est as denominator for housing eras
+    if 'log_av45' in df.columns:
+        df['old_housing_pct'] = safe_divide(df['log_av45'], df['total_housing_est']) * 100
+    if 'log_ap90' in df.columns:
+        df['new_housing_pct'] = safe_divide(df['log_ap90'], df['total_housing_est']) * 100
+        
+    # Social housing density
+    if 'log_soc' in df.columns:
+        # Use total housing estimate if valid, else 'men'
+        df['social_housing_base'] = np.where(df['total_housing_est'] > 0, df['total_housing_est'], df['men'])
+        df['social_housing_rate'] = safe_divide(df['log_soc'], df['social_housing_base']) * 100
+
+    # 5. Housing Type (Maison vs Coll)
+    if 'men_mais' in df.columns and 'men_coll' in df.columns:
+        # Denom is sum of these two usually ~ men
+        df['housing_type_total'] = df['men_mais'] + df['men_coll']
+        df['houses_pct'] = safe_divide(df['men_mais'], df['housing_type_total']) * 100
+        df['apartments_pct'] = safe_divide(df['men_coll'], df['housing_type_total']) * 100
+
+    # Clean up infinities/NaNs in rates
+    rate_cols = [c for c in df.columns if 'rate' in c or 'pct' in c]
+    df[rate_cols] = df[rate_cols].fillna(0).clip(0, 100)
+
+    return df
+
+def missing_sums(schema_report):
+    """
+    Summed base columns each vintage lacks. Keys such as 'lcog_geo' are left out:
+    make_tables supplies them from the spatial join.
+    Args:
+        schema_report (dict): {year: [missing canonical columns]}
+    Returns:
+        dict: {year: [columns]}, only for years missing something
+    """
+    report = {year: [c for c in SUM_COLS if c in missing] for year, missing in schema_report.items()}
+    return {year: cols for year, cols in report.items() if cols}
+
+def masked_metrics(schema_report):
+    """
+    Derived metrics that cannot be computed in each vintage, given the base columns it lacks.
+    Args:
+        schema_report (dict): {year: [missing canonical columns]}
+    Returns:
+        dict: {year: [metrics]}, only for years missing something
+    """
+    report = {
+        year: [m for m, inputs in METRIC_INPUTS.items() if set(inputs) & set(missing)]
+        for year, missing in missing_sums(schema_report).items()
+    }
+    return {year: metrics for year, metrics in report.items() if metrics}
+
+def mask_missing(df, schema_report):
+    """
+    Set the summed base columns a vintage lacks, and the metrics derived from them,
+    to NaN in that vintage's rows (in place): derive_metrics would otherwise report 0.
+    """
+    missing = missing_sums(schema_report)
+    metrics = masked_metrics(schema_report)
+    for year, base in missing.items():
+        cols = [c for c in base + metrics.get(year, []) if c in df.columns]
+        df.loc[df['year'] == year, cols] = np.nan
     return df
 
 @st.cache_data(show_spinner="Aggregating Granular Data...")
@@ -50,12 +181,14 @@ def make_tables(_tiles_data, _communes_gdf):
     """
     Process all years, aggregate to commune level, and calculate derived metrics.
     Args:
-        _tiles_data (dict): {year: gdf}
+        _tiles_data (dict): {year: df} harmonized by utils.io.load_data
         _communes_gdf (gdf): Communes geometries
     Returns:
-        dict: {'timeseries': df, 'by_region': df, 'geo': gdf}
+        dict: {'timeseries': df, 'by_region': df, 'geo': gdf, 'index': dict, 'panel': dict, ...}
     """
     processed_frames = []
+    tile_blocks = {}
+    _communes_gdf = repair_crs(_communes_gdf)
     
     # Identify commune code column in communes_gdf upfront
     commune_key = next((c for c in ['insee', 'insee_com', 'code_insee', 'com', 'code'] if c in _communes_gdf.columns), None)
@@ -63,17 +196,16 @@ def make_tables(_tiles_data, _communes_gdf):
         st.error("Could not find commune code column.")
         return {}
     
-    # Columns to preserve during aggregation (Must sum these up)
-    sum_cols = [
-        'ind', 'men', 'men_pauv', 'men_prop', 'log_soc', 'pop_income',
-        'ind_0_3', 'ind_4_5', 'ind_6_10', 'ind_11_17', 'ind_18_24', 
-        'ind_25_39', 'ind_40_54', 'ind_55_64', 'ind_65_79', 'ind_80p',
-        'log_av45', 'log_45_70', 'log_70_90', 'log_ap90', 'log_inc',
-        'men_mais', 'men_coll', 'men_1ind', 'men_5ind', 'men_fmp'
-    ]
 
-    for year, gdf in _tiles_data.items():
-        processed = process_tiles(gdf)
+    schema_report = {}
+    stage_totals = {}
+
+    for year, processed in _tiles_data.items():
+        # Frames arrive harmonized and typed from load_data (utils.io.read_vintage)
+        schema_report[year] = processed.attrs.get('missing_columns', [])
+        stage_totals[year] = {
+            'read': column_totals(processed), 'dropped_rows': processed.attrs.get('dropped_rows', 0)
+        }
         processed['year'] = year
         
         # --- Handle missing 'lcog_geo' (2015 case) ---
@@ -85,8 +217,7 @@ def make_tables(_tiles_data, _communes_gdf):
                     processed = processed.to_crs(_communes_gdf.crs)
                 
                 # Warning: Sjoin can be slow. Use centroids.
-                centroids = processed.copy()
-                centroids['geometry'] = centroids.geometry.centroid
+                centroids = gpd.GeoDataFrame(geometry=processed.geometry.centroid, crs=processed.crs)
                 
                 # Sjoin with commune boundaries
                 # Keep only necessary cols from communes to speed up?
@@ -98,16 +229,15 @@ def make_tables(_tiles_data, _communes_gdf):
                 # Drop rows that didn't match a commune
                 processed = processed.dropna(subset=['lcog_geo'])
 
-        # Calculate weighted income for later aggregation
-        if 'avg_income' not in processed.columns and 'ind_snv' in processed.columns:
-             processed['pop_income'] = processed['ind_snv'] 
-        elif 'avg_income' in processed.columns:
-             processed['pop_income'] = processed['avg_income'] * processed['ind']
-        else:
-             processed['pop_income'] = 0
+        stage_totals[year]['joined'] = column_totals(processed)
+
+        # Compact tile-level copy for the longitudinal tile panel (no geometry kept)
+        block = tile_block(processed)
+        if block is not None:
+            tile_blocks[year] = block
 
         # Filter cols that exist
-        current_sum_cols = [c for c in sum_cols if c in processed.columns]
+        current_sum_cols = [c for c in SUM_COLS if c in processed.columns]
         
         # Keep only necessary columns + location + year
         cols = ['year', 'lcog_geo'] + current_sum_cols
@@ -121,104 +251,29 @@ def make_tables(_tiles_data, _communes_gdf):
     # Aggregation Dictionary
     agg_dict = {c: 'sum' for c in full_df.columns if c not in ['year', 'lcog_geo']}
     
-    # Group by Year and Commune
-    grouped = full_df.groupby(['year', 'lcog_geo']).agg(agg_dict).reset_index()
+    # Group by Year and Commune (min_count: a column the vintage lacks stays NaN, not 0)
+    grouped = full_df.groupby(['year', 'lcog_geo'])[list(agg_dict)].sum(min_count=1).reset_index()
     
     # --- Feature Engineering: The Geneva Gravity ---
-    # Geneva Coordinates (approx center)
-    GENEVA_LAT = 46.2044
-    GENEVA_LON = 6.1432
-    
-    # We need the geometry of the commune to calculate distance
-    # Merge geometries back first (using centroids for speed)
-    if 'geometry' not in grouped.columns:
-        # Get centroids from original communes_gdf
-        commune_centroids = _communes_gdf[[commune_key, 'geometry']].copy()
-        # Ensure we are in a metric CRS for distance (Lambert-93 is standard for France: EPSG:2154)
-        if commune_centroids.crs and commune_centroids.crs.to_string() != "EPSG:2154":
-             try:
-                 commune_centroids = commune_centroids.to_crs(epsg=2154)
-             except:
-                 pass # Fallback
-        
-        commune_centroids['centroid'] = commune_centroids.geometry.centroid
-        
-        # Geneva Point in EPSG:2154
-        from shapely.geometry import Point
-        geneva_pt = gpd.GeoSeries([Point(GENEVA_LON, GENEVA_LAT)], crs="EPSG:4326").to_crs(commune_centroids.crs).iloc[0]
-        
-        # Calculate Distance (in km)
-        commune_centroids['dist_geneva_km'] = commune_centroids['centroid'].distance(geneva_pt) / 1000.0
-        
-        # Merge distance into grouped
-        grouped = grouped.merge(commune_centroids[[commune_key, 'dist_geneva_km']], left_on='lcog_geo', right_on=commune_key, how='left')
+    # Distance to every attractor city (Geneva first), nearest pole and gravity accessibility.
+    # Changing the poles means a rebuild; centroids are kept in the output for territories and the API.
+    centroids, centroids_crs = commune_centroids(_communes_gdf, commune_key)
+    grouped['lcog_geo'] = grouped['lcog_geo'].astype(str)
+    grouped = grouped.merge(attractor_features(centroids, centroids_crs), on='lcog_geo', how='left')
+
+    # --- Within-commune inequality (from the tiles, before they are summed away) ---
+    grouped = grouped.merge(commune_inequality(full_df), on=['year', 'lcog_geo'], how='left')
     
     # --- Feature Engineering (Derived Metrics) ---
     
-    # 1. Standard Metrics
-    grouped['total_pop'] = grouped['ind']
-    grouped['total_households'] = grouped['men']
-    grouped['avg_income'] = safe_divide(grouped['pop_income'], grouped['ind'])
-    grouped['poverty_rate'] = safe_divide(grouped['men_pauv'], grouped['men']) * 100
-    grouped['ownership_rate'] = safe_divide(grouped['men_prop'], grouped['men']) * 100
-    
-    # 2. Demographics
-    df = grouped # Alias for brevity
-    
-    # Sum age bands if available
-    youth_cols = ['ind_0_3', 'ind_4_5', 'ind_6_10', 'ind_11_17']
-    senior_cols = ['ind_65_79', 'ind_80p']
-    working_cols = ['ind_18_24', 'ind_25_39', 'ind_40_54', 'ind_55_64']
-    
-    df['pop_youth'] = df[[c for c in youth_cols if c in df.columns]].sum(axis=1)
-    df['pop_senior'] = df[[c for c in senior_cols if c in df.columns]].sum(axis=1)
-    df['pop_working'] = df[[c for c in working_cols if c in df.columns]].sum(axis=1)
-    
-    df['youth_pct'] = safe_divide(df['pop_youth'], df['ind']) * 100
-    df['senior_pct'] = safe_divide(df['pop_senior'], df['ind']) * 100
-    
-    # 3. Family Structure
-    if 'men_fmp' in df.columns:
-        df['single_parent_pct'] = safe_divide(df['men_fmp'], df['men']) * 100
-    if 'men_1ind' in df.columns:
-        df['single_person_pct'] = safe_divide(df['men_1ind'], df['men']) * 100
-        
-    # 4. Housing Stock
-    housing_eras = ['log_av45', 'log_45_70', 'log_70_90', 'log_ap90', 'log_inc']
-    existing_eras = [c for c in housing_eras if c in df.columns]
-    
-    # Total estimated housings (sum of eras) - might defer from 'men' slightly
-    df['total_housing_est'] = df[existing_eras].sum(axis=1)
-    
-    # Use total_housing_est as denominator for housing eras
-    if 'log_av45' in df.columns:
-        df['old_housing_pct'] = safe_divide(df['log_av45'], df['total_housing_est']) * 100
-    if 'log_ap90' in df.columns:
-        df['new_housing_pct'] = safe_divide(df['log_ap90'], df['total_housing_est']) * 100
-        
-    # Social housing density
-    if 'log_soc' in df.columns:
-        # Use total housing estimate if valid, else 'men'
-        denom = np.where(df['total_housing_est'] > 0, df['total_housing_est'], df['men'])
-        df['social_housing_rate'] = safe_divide(df['log_soc'], denom) * 100
-
-    # 5. Housing Type (Maison vs Coll)
-    if 'men_mais' in df.columns and 'men_coll' in df.columns:
-        # Denom is sum of these two usually ~ men
-        denom_type = df['men_mais'] + df['men_coll']
-        df['houses_pct'] = safe_divide(df['men_mais'], denom_type) * 100
-        df['apartments_pct'] = safe_divide(df['men_coll'], denom_type) * 100
-
-    # Clean up infinities/NaNs in rates
-    rate_cols = [c for c in df.columns if 'rate' in c or 'pct' in c]
-    df[rate_cols] = df[rate_cols].fillna(0).clip(0, 100)
+    df = mask_missing(derive_metrics(grouped), schema_report)
 
     # --- Output Tables ---
     
     # Timeseries (National) - Aggregating using sum of sums, then recalc ratios
     # We can just sum the raw columns again for national level then recalc
     national_sum_cols = [c for c in agg_dict.keys() if c in df.columns]
-    timeseries = df.groupby('year')[national_sum_cols].sum().reset_index()
+    timeseries = df.groupby('year')[national_sum_cols].sum(min_count=1).reset_index()
     
     # Re-apply Ratio logic for National Level (Copy-paste logic essentially)
     # 1. Standard
@@ -228,8 +283,8 @@ def make_tables(_tiles_data, _communes_gdf):
     timeseries['ownership_rate'] = safe_divide(timeseries['men_prop'], timeseries['men']) * 100
     
     # 2. Demographics
-    timeseries['pop_youth'] = timeseries[[c for c in youth_cols if c in timeseries.columns]].sum(axis=1)
-    timeseries['pop_senior'] = timeseries[[c for c in senior_cols if c in timeseries.columns]].sum(axis=1)
+    timeseries['pop_youth'] = timeseries[[c for c in YOUTH_COLS if c in timeseries.columns]].sum(axis=1)
+    timeseries['pop_senior'] = timeseries[[c for c in SENIOR_COLS if c in timeseries.columns]].sum(axis=1)
     timeseries['youth_pct'] = safe_divide(timeseries['pop_youth'], timeseries['ind']) * 100
     timeseries['senior_pct'] = safe_divide(timeseries['pop_senior'], timeseries['ind']) * 100
     
@@ -244,7 +299,7 @@ def make_tables(_tiles_data, _communes_gdf):
         
     # 4. Housing Stock (National)
     eras = ['log_av45', 'log_ap90']
-    timeseries['total_housing_est'] = timeseries[[c for c in housing_eras if c in timeseries.columns]].sum(axis=1)
+    timeseries['total_housing_est'] = timeseries[[c for c in HOUSING_ERAS if c in timeseries.columns]].sum(axis=1)
     
     if 'log_av45' in timeseries.columns:
         timeseries['old_housing_pct'] = safe_divide(timeseries['log_av45'], timeseries['total_housing_est']) * 100
@@ -255,6 +310,7 @@ def make_tables(_tiles_data, _communes_gdf):
         denom = timeseries['men_mais'] + timeseries['men_coll']
         timeseries['houses_pct'] = safe_divide(timeseries['men_mais'], denom) * 100
         timeseries['apartments_pct'] = safe_divide(timeseries['men_coll'], denom) * 100
+    mask_missing(timeseries, schema_report)
         
     # By Region (Commune Level)
     name_key = next((c for c in ['nom', 'nom_com', 'nom_comm', 'libelle'] if c in _communes_gdf.columns), None)
@@ -264,6 +320,8 @@ def make_tables(_tiles_data, _communes_gdf):
         
     by_region = df.merge(_communes_gdf[cols_to_keep], left_on='lcog_geo', right_on=commune_key, how='inner')
     by_region['nom'] = by_region[name_key] if name_key else by_region[commune_key]
+    # Contiguous year blocks, so the table index can serve slices instead of masks
+    by_region = by_region.sort_values(['year', 'lcog_geo'], kind='stable').reset_index(drop=True)
         
     # Geo (Latest Year)
     latest_year = max(_tiles_data.keys())
@@ -279,17 +337,35 @@ def make_tables(_tiles_data, _communes_gdf):
         # Fallback if CRS check fails
         geo['geometry'] = geo.geometry.simplify(0.01)
     
+    index = build_table_index(by_region)
+    panel = build_panel(by_region, index)
+    # Communes of the latest vintage for the sidebar search (merged or dissolved ones are not offered)
+    communes = year_view(by_region, index, index['years'][-1])
+    
     return {
+        "version": CACHE_VERSION,
+        "fingerprint": data_fingerprint(by_region),
         "timeseries": timeseries,
         "by_region": by_region,
         "geo": geo,
-        "raw_grouped": df
+        "raw_grouped": df,
+        "centroids": centroids,
+        "centroids_crs": centroids_crs,
+        "adjacency": build_adjacency(_communes_gdf, commune_key),
+        "index": index,
+        "panel": panel,
+        "projections": build_projections(panel, timeseries),
+        "similarity": build_similarity_index(by_region, index),
+        "clusters": build_typology(by_region, index),
+        "tiles": build_tile_panel(tile_blocks),
+        "search": build_search_index(communes['nom'], communes['lcog_geo'], communes['ind']),
+        "schema": schema_report,
+        "validation": validate_build(stage_totals, by_region, index, timeseries),
+        "stats": build_stats_store(by_region, index),
+        "correlations": build_correlations(by_region, index)
     }
 
-def get_commune_comparison(df, commune_names, metrics):
-    """Get comparison data for specific communes."""
-    if not commune_names:
-        return pd.DataFrame()
-    # Ensure metrics exist in df columns
-    valid_metrics = [m for m in metrics if m in df.columns]
-    return df[df['nom'].isin(commune_names)][['nom', 'year'] + valid_metrics]
+def data_fingerprint(by_region):
+    """Content hash of the commune table, used as the data version in cache keys."""
+    hashed = pd.util.hash_pandas_object(by_region.drop(columns='geometry', errors='ignore'), index=False)
+    return hashlib.sha1(CACHE_VERSION.encode() + hashed.to_numpy().tobytes()).hexdigest()[:16]
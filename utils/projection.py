@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+from utils.constants import PROJECTION_YEARS, PROJECTION_LOG_METRICS, PROJECTION_Z
+
+def fit_trends(years, values):
+    """
+    Least-squares line through the available vintages of every series at once.
+    Args:
+        years (array): shape (T,)
+        values (array): shape (n, T, M), NaN where a vintage is missing
+    Returns:
+        dict: arrays of shape (n, M): 'n', 'xbar', 'ybar', 'sxx', 'slope', 'sse'
+    """
+    x = np.asarray(years, dtype=float)[None, :, None]
+    mask = ~np.isnan(values)
+    y = np.where(mask, values, 0.0)
+    n = mask.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xbar = (mask * x).sum(axis=1) / n
+        ybar = y.sum(axis=1) / n
+        dx = np.where(mask, x - xbar[:, None, :], 0.0)
+        sxx = (dx * dx).sum(axis=1)
+        slope = (dx * (y - ybar[:, None, :])).sum(axis=1) / sxx
+        resid = np.where(mask, y - ybar[:, None, :] - slope[:, None, :] * dx, 0.0)
+    return {'n': n, 'xbar': xbar, 'ybar': ybar, 'sxx': sxx, 'slope': slope, 'sse': (resid ** 2).sum(axis=1)}
+
+def pooled_sigma(fit):
+    """
+    Residual standard deviation per metric pooled over all series.
+    Three vintages leave one degree of freedom per commune, so per-series
+    variances are too noisy to build intervals from.
+    """
+    dof = np.clip(fit['n'] - 2, 0, None)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(np.nansum(np.where(dof > 0, fit['sse'], 0), axis=0) / dof.sum(axis=0))
+
+def trend_predict(fit, x0, sigma):
+    """Trend value and standard error of the fitted line at year x0, shape (n, M)."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pred = fit['ybar'] + fit['slope'] * (x0 - fit['xbar'])
+        se = sigma[None, :] * np.sqrt(1.0 / fit['n'] + (x0 - fit['xbar']) ** 2 / fit['sxx'])
+    ok = fit['n'] >= 2
+    return np.where(ok, pred, np.nan), np.where(ok, se, np.nan)
+
+def _interpolate(years, values, x0):
+    """Straight line between the vintages bracketing x0 (NaN if either is missing)."""
+    years = np.asarray(years)
+    hi = np.searchsorted(years, x0)
+    lo = hi - 1
+    t = (x0 - years[lo]) / (years[hi] - years[lo])
+    return values[:, lo] + t * (values[:, hi] - values[:, lo])
+
+def project_values(years, values, metrics, target_years=PROJECTION_YEARS, z=PROJECTION_Z):
+    """
+    Fill and extrapolate every series to `target_years` in one vectorized pass.
+    Years inside the observed range are interpolated between the bracketing vintages;
+    later (or earlier) years follow the linear trend, fitted on logs for the metrics in
+    PROJECTION_LOG_METRICS. Intervals are +/- z standard errors of the trend line, back-
+    transformed for log metrics; rates are kept within [0, 100].
+    Args:
+        years (list): observed vintages, sorted
+        values (array): (n, T, M)
+        metrics (list): metric names of the last axis
+    Returns:
+        dict: {'years', 'kind' ({year: 'interpolated' | 'projected'}), 'values', 'lo', 'hi'} with (n, K, M) arrays
+    """
+    log = np.array([m in PROJECTION_LOG_METRICS for m in metrics])
+    bounded = np.array([('rate' in m or 'pct' in m) for m in metrics])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        work = np.where(log[None, None, :], np.log(np.where(values > 0, values, np.nan)), values)
+
+    fit = fit_trends(years, work)
+    sigma = pooled_sigma(fit)
+
+    n, _, M = values.shape
+    out = {k: np.full((n, len(target_years), M), np.nan, dtype=np.float32) for k in ('values', 'lo', 'hi')}
+    kind = {}
+    for k, year in enumerate(target_years):
+        pred, se = trend_predict(fit, year, sigma)
+        if years[0] < year < years[-1]:
+            inner = _interpolate(years, work, year)
+            pred = np.where(np.isnan(inner), pred, inner)
+            kind[year] = 'interpolated'
+        else:
+            kind[year] = 'projected'
+        lo, hi = pred - z * se, pred + z * se
+        est = np.stack([pred, lo, hi])
+        est = np.where(log[None, None, :], np.exp(est), est)
+        est = np.where(bounded[None, None, :], np.clip(est, 0, 100), est)
+        out['values'][:, k], out['lo'][:, k], out['hi'][:, k] = est
+
+    out['years'] = list(target_years)
+    out['kind'] = kind
+    return out
+
+def build_projections(panel, timeseries, target_years=PROJECTION_YEARS):
+    """
+    Projection partition for the national series, the only one the app draws
+    (Overview trend). Commune-level series are not projected.
+    Returns:
+        dict: {'years', 'kind', 'metrics', 'timeseries'}, the national DataFrame
+        with <metric>_lo / <metric>_hi columns and an 'is_projected' flag
+    """
+    ts = timeseries.set_index('year').reindex(panel['years'])
+    metrics = [m for m in panel['metrics'] if m in ts.columns]
+    national = project_values(panel['years'], ts[metrics].to_numpy(dtype=float)[None], metrics, target_years)
+    frame = pd.DataFrame({'year': national['years']})
+    for j, m in enumerate(metrics):
+        frame[m] = national['values'][0, :, j]
+        frame[f'{m}_lo'] = national['lo'][0, :, j]
+        frame[f'{m}_hi'] = national['hi'][0, :, j]
+    frame['estimate'] = frame['year'].map(national['kind'])
+    frame['is_projected'] = True
+    return {'years': national['years'], 'kind': national['kind'], 'metrics': metrics, 'timeseries': frame}
@@ -0,0 +1,209 @@
+import os
+import json
+import base64
+import numpy as np
+import pandas as pd
+import pyproj
+from PIL import Image
+from scipy import fft as sp_fft
+from utils.constants import (
+    TILE_SIZE_M, TILE_METRICS, RASTER_BANDWIDTHS_KM, RASTER_MIN_POP, RASTER_MIN_SIZE, RASTER_DIR
+)
+from utils.tiles import split_keys
+
+# Same ramp as the 3D commune map (light to dark blue)
+RAMP_LOW = np.array([220, 240, 255], dtype=np.float32)
+RAMP_HIGH = np.array([8, 48, 107], dtype=np.float32)
+
+def grid_extent(panel):
+    """(row_min, row_max, col_min, col_max) of every tile seen in any vintage, in tile units (EPSG:3035)."""
+    rows, cols = split_keys(panel['keys'])
+    return int(rows.min()), int(rows.max()), int(cols.min()), int(cols.max())
+
+def rasterize(panel, year, extent):
+    """
+    The base columns of one vintage on the dense 1 km grid, straight from the
+    panel's grid coordinates (no geometry). Image row 0 is the northern edge.
+    Returns:
+        ndarray: float32 (n_columns, height, width), 0 where there is no tile
+    """
+    r0, r1, c0, c1 = extent
+    rows, cols = split_keys(panel['keys'][panel['pos'][year]])
+    out = np.zeros((len(panel['columns']), r1 - r0 + 1, c1 - c0 + 1), dtype=np.float32)
+    out[:, r1 - rows, cols - c0] = panel['values'][year].T
+    return out
+
+def gaussian_smooth(stack, bandwidths_km):
+    """
+    Gaussian kernel smoothing of every (height, width) plane of `stack` at every
+    bandwidth, by FFT: one forward transform of the whole stack, one product per
+    bandwidth with the Gaussian's transfer function, one inverse transform.
+    Planes are zero padded by 3 sigma of the widest kernel, so nothing wraps around.
+    Returns:
+        ndarray: float32 (n_bandwidths, *stack.shape)
+    """
+    h, w = stack.shape[-2:]
+    sigma = np.asarray(bandwidths_km, dtype=np.float32) * 1000 / TILE_SIZE_M  # in cells
+    pad = int(np.ceil(3 * sigma.max()))
+    shape = (sp_fft.next_fast_len(h + pad, real=True), sp_fft.next_fast_len(w + pad, real=True))
+    spectrum = sp_fft.rfft2(stack, s=shape, workers=-1)
+    freq2 = sp_fft.fftfreq(shape[0])[:, None] ** 2 + sp_fft.rfftfreq(shape[1])[None, :] ** 2
+    transfer = np.exp(-2 * np.pi ** 2 * sigma[:, None, None] ** 2 * freq2).astype(np.float32)
+    transfer = transfer.reshape((len(sigma),) + (1,) * (stack.ndim - 2) + transfer.shape[-2:])
+    smoothed = sp_fft.irfft2(spectrum[None] * transfer, s=shape, workers=-1)[..., :h, :w]
+    return np.maximum(smoothed, 0).astype(np.float32)
+
+def surface_metrics(smoothed, columns, metrics=TILE_METRICS, min_pop=RASTER_MIN_POP):
+    """
+    Ratio metrics of smoothed base columns, i.e. kernel-weighted sums divided by
+    kernel-weighted sums (utils.prep.derive_metrics on every cell at once).
+    Cells where the smoothed population is below `min_pop` are NaN.
+    Args:
+        smoothed (ndarray): (..., n_columns, height, width)
+    Returns:
+        ndarray: float32 (..., n_metrics, height, width)
+    """
+    # Imported here, as in utils.tiles: utils.prep imports the tile modules
+    from utils.prep import derive_metrics
+
+    lead, (n_cols, h, w) = smoothed.shape[:-3], smoothed.shape[-3:]
+    flat = np.moveaxis(smoothed, -3, 0).reshape(n_cols, -1)
+    derived = derive_metrics(pd.DataFrame(dict(zip(columns, flat))))
+    out = np.stack([derived[m].to_numpy(dtype=np.float32) for m in metrics])
+    out[:, flat[columns.index('ind')] < min_pop] = np.nan
+    return np.moveaxis(out.reshape((len(metrics),) + lead + (h, w)), 0, -3)
+
+def mercator_grid(extent):
+    """
+    Web Mercator pixel grid covering the tile extent, one pixel about one tile at
+    the centre latitude, with the source cell of every pixel (nearest neighbour).
+    Returns:
+        dict: 'rows', 'cols' (source indices), 'valid' (bool), 'bounds' [west, south, east, north],
+              'width', 'height', 'px_m' (pixel size in mercator meters)
+    """
+    r0, r1, c0, c1 = extent
+    to_mercator = pyproj.Transformer.from_crs(3035, 3857, always_xy=True)
+    mx0, my0, mx1, my1 = to_mercator.transform_bounds(
+        c0 * TILE_SIZE_M, r0 * TILE_SIZE_M, (c1 + 1) * TILE_SIZE_M, (r1 + 1) * TILE_SIZE_M, densify_pts=21
+    )
+    to_wgs = pyproj.Transformer.from_crs(3857, 4326, always_xy=True)
+    _, lat = to_wgs.transform((mx0 + mx1) / 2, (my0 + my1) / 2)
+    px = TILE_SIZE_M / np.cos(np.radians(lat))
+    width, height = int(np.ceil((mx1 - mx0) / px)), int(np.ceil((my1 - my0) / px))
+
+    mx = mx0 + (np.arange(width) + 0.5) * px
+    my = my1 - (np.arange(height) + 0.5) * px
+    gx, gy = np.meshgrid(mx, my)
+    to_laea = pyproj.Transformer.from_crs(3857, 3035, always_xy=True)
+    x, y = to_laea.transform(gx.ravel(), gy.ravel())
+    rows = (r1 - np.floor(y / TILE_SIZE_M)).astype(np.int64).reshape(height, width)
+    cols = (np.floor(x / TILE_SIZE_M) - c0).astype(np.int64).reshape(height, width)
+    valid = (rows >= 0) & (rows <= r1 - r0) & (cols >= 0) & (cols <= c1 - c0)
+
+    (west, east), (north, south) = to_wgs.transform([mx0, mx0 + width * px], [my1, my1 - height * px])
+    return {
+        'rows': np.where(valid, rows, 0), 'cols': np.where(valid, cols, 0), 'valid': valid,
+        'bounds': [west, south, east, north], 'width': width, 'height': height, 'px_m': px,
+    }
+
+def reproject(values, grid):
+    """Resample (..., height, width) planes of the tile grid onto the mercator grid (NaN outside)."""
+    out = values[..., grid['rows'], grid['cols']]
+    out[..., ~grid['valid']] = np.nan
+    return out
+
+def downsample(values):
+    """Halve the resolution of (..., height, width) planes by averaging the valid cells of 2x2 blocks."""
+    h, w = values.shape[-2:]
+    padded = np.full(values.shape[:-2] + (h + h % 2, w + w % 2), np.nan, dtype=np.float32)
+    padded[..., :h, :w] = values
+    blocks = padded.reshape(values.shape[:-2] + ((h + 1) // 2, 2, (w + 1) // 2, 2))
+    count = np.isfinite(blocks).sum(axis=(-3, -1))
+    with np.errstate(invalid='ignore'):
+        return (np.nansum(blocks, axis=(-3, -1)) / count).astype(np.float32)
+
+def colorize(values, lo, hi, alpha=200):
+    """RGBA image(s) of (..., height, width) values on the map ramp; NaN is transparent."""
+    norm = np.clip((values - lo) / ((hi - lo) or 1), 0, 1)
+    rgb = RAMP_LOW + np.nan_to_num(norm)[..., None] * (RAMP_HIGH - RAMP_LOW)
+    a = np.where(np.isfinite(values), alpha, 0)[..., None]
+    return np.concatenate([rgb, a], axis=-1).round().astype(np.uint8)
+
+def surface_path(out_dir, metric, year, bandwidth, level, ext):
+    return os.path.join(out_dir, metric, str(year), f"bw{bandwidth:g}", f"{level}.{ext}")
+
+def build_surfaces(tables, out_dir=RASTER_DIR, bandwidths=RASTER_BANDWIDTHS_KM, metrics=TILE_METRICS):
+    """
+    Smoothed metric surfaces from the tile panel: every vintage is rasterized,
+    smoothed at every bandwidth in one FFT batch, turned into metrics, reprojected
+    to Web Mercator and written as a pyramid of PNG images (for a map bitmap layer)
+    and float32 arrays, halving the resolution down to RASTER_MIN_SIZE pixels.
+    Colors share one value range per metric (2nd-98th percentile, all years), so
+    years and bandwidths compare.
+    Returns:
+        dict: the manifest, also written to <out_dir>/manifest.json
+    """
+    panel = tables['tiles']
+    extent = grid_extent(panel)
+    grid = mercator_grid(extent)
+    surfaces = {}
+    for year in panel['years']:
+        smoothed = gaussian_smooth(rasterize(panel, year, extent), bandwidths)
+        surfaces[year] = reproject(surface_metrics(smoothed, panel['columns'], metrics), grid)  # (B, M, H, W)
+
+    stacked = np.stack(list(surfaces.values()))
+    ranges = {}
+    for j, m in enumerate(metrics):
+        sample = stacked[:, :, j, ::4, ::4]
+        sample = sample[np.isfinite(sample)]
+        ranges[m] = [float(v) for v in np.percentile(sample, [2, 98])] if sample.size else [0.0, 1.0]
+
+    levels = []
+    for year, values in surfaces.items():
+        level = 0
+        while True:
+            if year == panel['years'][0]:
+                levels.append({'level': level, 'width': values.shape[-1], 'height': values.shape[-2],
+                               'px_m': float(grid['px_m'] * 2 ** level)})
+            for j, m in enumerate(metrics):
+                images = colorize(values[:, j], *ranges[m])
+                for b, bandwidth in enumerate(bandwidths):
+                    path = surface_path(out_dir, m, year, bandwidth, level, "png")
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    Image.fromarray(images[b], "RGBA").save(path)
+                    np.save(surface_path(out_dir, m, year, bandwidth, level, "npy"), values[b, j])
+            if max(values.shape[-2:]) <= RASTER_MIN_SIZE:
+                break
+            values = downsample(values)
+            level += 1
+
+    manifest = {
+        'fingerprint': tables['fingerprint'],
+        'bounds': grid['bounds'],
+        'metrics': list(metrics),
+        'years': [int(y) for y in panel['years']],
+        'bandwidths_km': list(bandwidths),
+        'levels': levels,
+        'ranges': ranges,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+def load_manifest(out_dir=RASTER_DIR):
+    """The surface manifest, or None if the surfaces have not been built."""
+    path = os.path.join(out_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def surface_image(manifest, metric, year, bandwidth, max_width=1024, out_dir=RASTER_DIR):
+    """
+    The finest pyramid level of a surface no wider than `max_width`, as a PNG data
+    URI (the bitmap layer takes the image inline).
+    """
+    fitting = [lv for lv in manifest['levels'] if lv['width'] <= max_width] or manifest['levels'][-1:]
+    path = surface_path(out_dir, metric, year, bandwidth, fitting[0]['level'], "png")
+    with open(path, "rb") as f:
+        return "data:image/png;base64," + base64.b64encode(f.read()).decode("ascii")
@@ -0,0 +1,122 @@
+import html
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from utils.constants import METRICS, METRIC_LABELS, DEFAULT_ATTRACTOR, BAND_DEFAULTS, ATTRACTORS
+from utils.bands import build_band_index, ring_table, uniform_rings
+from utils.viz import (
+    population_pyramid_figure, housing_mix_chart_figure, line_chart_figure, gradient_chart_figure
+)
+
+PAGE = """<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><title>{title}</title>
+<script src="{plotlyjs}"></script>
+<style>
+body {{ font-family: system-ui, sans-serif; color: #1E293B; background: #F8FAFC; margin: 2rem; }}
+.grid {{ display: grid; grid-template-columns: 1fr 1fr; gap: 1rem; }}
+.card {{ background: white; border-radius: 8px; padding: 1rem; }}
+table {{ border-collapse: collapse; width: 100%; }}
+td, th {{ padding: 4px 8px; border-bottom: 1px solid #E2E8F0; text-align: right; }}
+td:first-child, th:first-child {{ text-align: left; }}
+</style></head>
+<body><h1>{title}</h1><p>{subtitle}</p>
+<div class="card">{kpis}</div>
+<div class="grid">{figures}</div>
+</body></html>
+"""
+
+def report_context(tables, year=None, attractor=DEFAULT_ATTRACTOR, metric="avg_income"):
+    """
+    Inputs shared by every profile of one batch: the year, national values and the
+    distance-ring gradient (built once, each profile only adds its own marker).
+    """
+    index = tables['index']
+    year = year or index['years'][-1]
+    start, stop = index['year_slices'][year]
+    latest = tables['by_region'].iloc[start:stop]
+    rings = ring_table(
+        build_band_index(latest, f'dist_{attractor}_km'),
+        uniform_rings(BAND_DEFAULTS['width_km'], BAND_DEFAULTS['max_km'])
+    )
+    national = tables['timeseries'].set_index('year')
+    return {
+        'year': year,
+        'attractor': attractor,
+        'metric': metric,
+        'national': national.loc[year] if year in national.index else None,
+        'gradient': gradient_chart_figure(rings[rings['n_communes'] > 0], metric, attractor, year)
+    }
+
+def _kpi_table(history, year, national):
+    """Latest value, change since the first vintage and national value of every metric."""
+    latest = history[history['year'] == year].iloc[0]
+    first = history.iloc[0]
+    rows = []
+    for m in METRICS:
+        if m not in history.columns:
+            continue
+        nat = national[m] if national is not None and m in national.index else np.nan
+        rows.append(
+            f"<tr><td>{METRIC_LABELS.get(m, m)}</td><td>{latest[m]:,.2f}</td>"
+            f"<td>{latest[m] - first[m]:+,.2f}</td><td>{nat:,.2f}</td></tr>"
+        )
+    head = f"<tr><th>Metric</th><th>{year}</th><th>Change since {int(first['year'])}</th><th>France</th></tr>"
+    return f"<table>{head}{''.join(rows)}</table>"
+
+def profile_html(tables, context, code, plotlyjs="plotly.min.js"):
+    """
+    Static HTML profile of one commune (by INSEE code), or None if it has no row
+    in the report year. Figures come from the utils.viz builders.
+    """
+    index, year = tables['index'], context['year']
+    rows = [index['code_pos'][y][code] for y in index['years'] if code in index['code_pos'][y]]
+    history = tables['by_region'].iloc[rows]
+    if year not in history['year'].to_numpy():
+        return None
+    current = history[history['year'] == year]
+    name = current['nom'].iloc[0]
+
+    # Position on the gradient: the commune as one marker over the ring curve
+    attractor, metric = context['attractor'], context['metric']
+    gradient = go.Figure(context['gradient'])
+    gradient.add_trace(go.Scatter(
+        x=current[f'dist_{attractor}_km'], y=current[metric], mode="markers", name=name,
+        marker=dict(color="red", size=12, line=dict(color="white", width=1))
+    ))
+
+    figures = [
+        population_pyramid_figure(current, year),
+        housing_mix_chart_figure(current, year),
+        line_chart_figure(history, metric, title=f"{METRIC_LABELS.get(metric, metric)} in {name}"),
+        gradient,
+    ]
+    blocks = "".join(
+        f'<div class="card">{fig.to_html(full_html=False, include_plotlyjs=False)}</div>'
+        for fig in figures if fig is not None
+    )
+    distance = current[f'dist_{attractor}_km'].iloc[0]
+    return PAGE.format(
+        title=html.escape(f"{name} ({code})"),
+        subtitle=html.escape(f"{year} profile · {distance:,.1f} km from {ATTRACTORS[attractor]['name']}"),
+        plotlyjs=plotlyjs,
+        kpis=_kpi_table(history, year, context['national']),
+        figures=blocks
+    )
+
+def report_codes(tables, year=None):
+    """INSEE codes with a row in the report year (default: latest)."""
+    index = tables['index']
+    return sorted(index['code_pos'][year or index['years'][-1]])
+
+def index_html(entries):
+    """Listing page linking every generated profile: entries are (code, name, filename)."""
+    items = "".join(
+        f'<li><a href="{html.escape(f)}">{html.escape(str(n))}</a> ({html.escape(c)})</li>' for c, n, f in entries
+    )
+    return f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>Commune profiles</title></head>' \
+           f'<body><h1>Commune profiles</h1><ul>{items}</ul></body></html>'
+
+def report_names(tables, codes, year):
+    """Commune names of `codes` in `year`, as a Series indexed by code."""
+    rows = [tables['index']['code_pos'][year][c] for c in codes]
+    return pd.Series(tables['by_region']['nom'].to_numpy()[rows], index=codes)
@@ -0,0 +1,25 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+def bootstrap_counts(rng, n, size):
+    """Resampling counts for `size` bootstrap replicates of `n` rows, shape (size, n)."""
+    return rng.multinomial(n, np.full(n, 1.0 / n), size=size)
+
+def parallel_batches(fn, n_total, batch_size=25, seed=0, workers=None):
+    """
+    Run `fn(rng, size)` over batches of replicates in a thread pool.
+    Each batch gets its own child seed, so results only depend on `seed`
+    and `batch_size`, not on the number of workers or scheduling order.
+    Returns:
+        list: batch results in submission order
+    """
+    n_batches = max(1, -(-n_total // batch_size))
+    sizes = [batch_size] * (n_batches - 1) + [n_total - batch_size * (n_batches - 1)]
+    seeds = np.random.SeedSequence(seed).spawn(n_batches)
+    workers = workers or min(n_batches, os.cpu_count() or 1)
+
+    # NumPy releases the GIL in the heavy kernels, threads are enough here
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(fn, np.random.default_rng(s), size) for s, size in zip(seeds, sizes)]
+        return [f.result() for f in futures]
@@ -0,0 +1,96 @@
+import difflib
+import unicodedata
+import numpy as np
+from utils.constants import SEARCH_LIMIT, SEARCH_FUZZY_CUTOFF
+
+def normalize(text):
+    """Lower-case, accent-free, punctuation as spaces: 'Saint-Genis-Pouilly' -> 'saint genis pouilly'."""
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    text = ''.join(ch if ch.isalnum() else ' ' for ch in text)
+    words = text.split()
+    # Common abbreviations typed for saint / sainte
+    words = [{'st': 'saint', 'ste': 'sainte'}.get(w, w) for w in words]
+    return ' '.join(words)
+
+def build_search_index(names, codes, population=None):
+    """
+    Prefix index over commune names: a sorted array of normalized keys searched by
+    bisection. Every word start is a key too, so 'pouilly' finds 'Saint-Genis-Pouilly'.
+    Args:
+        names, codes (array): one entry per commune
+        population (array): optional, ranks equally good matches (largest first)
+    Returns:
+        dict: {'keys', 'entry' (commune of each key), 'whole' (key is the full name),
+               'labels' ('Name (dept)'), 'names', 'codes', 'code_pos' ({code: entry}),
+               'full' (normalized full names), 'rank'}
+    """
+    names = np.asarray(names, dtype=object)
+    codes = np.asarray(codes).astype(str)
+    full = [normalize(n) for n in names]
+
+    keys, entry, whole = [], [], []
+    for i, key in enumerate(full):
+        words = key.split(' ')
+        for j in range(len(words)):
+            keys.append(' '.join(words[j:]))
+            entry.append(i)
+            whole.append(j == 0)
+    keys = np.array(keys, dtype=str)
+    order = np.argsort(keys, kind='stable')
+
+    pop = np.zeros(len(names)) if population is None else np.nan_to_num(np.asarray(population, dtype=float))
+    return {
+        'keys': keys[order],
+        'entry': np.array(entry)[order],
+        'whole': np.array(whole)[order],
+        'labels': np.array([f"{n} ({c[:2]})" for n, c in zip(names, codes)], dtype=object),
+        'names': names,
+        'codes': codes,
+        'code_pos': {c: i for i, c in enumerate(codes)},
+        'full': np.array(full, dtype=str),
+        # Larger communes first among equal matches
+        'rank': np.argsort(np.argsort(-pop, kind='stable'))
+    }
+
+def search(index, query, limit=SEARCH_LIMIT):
+    """
+    Communes matching `query`: full-name prefix matches, then word prefix matches,
+    each ordered by population; difflib fuzzy matches when nothing starts with it.
+    Returns:
+        array: entry positions (into index['labels'] / index['names']), at most `limit`
+    """
+    q = normalize(query)
+    if not q:
+        return np.array([], dtype=int)
+    lo = np.searchsorted(index['keys'], q, side='left')
+    hi = np.searchsorted(index['keys'], q + '\uffff', side='left')
+    if hi > lo:
+        entry, whole = index['entry'][lo:hi], index['whole'][lo:hi]
+        order = np.lexsort((index['rank'][entry], ~whole))
+        _, first = np.unique(entry[order], return_index=True)
+        return entry[order][np.sort(first)][:limit]
+
+    # Fuzzy fallback among names sharing the first letter (typos rarely hit it)
+    lo = np.searchsorted(index['keys'], q[0], side='left')
+    hi = np.searchsorted(index['keys'], q[0] + '\uffff', side='left')
+    pool = index['whole'][lo:hi]
+    candidates = index['keys'][lo:hi][pool]
+    owners = index['entry'][lo:hi][pool]
+    close = difflib.get_close_matches(q, candidates.tolist(), n=limit, cutoff=SEARCH_FUZZY_CUTOFF)
+    if not close:
+        return np.array([], dtype=int)
+    # Every commune carrying a close name (homonyms), best match first
+    score = {key: i for i, key in enumerate(close)}
+    hit = np.flatnonzero(np.isin(candidates, close))
+    owners = owners[hit]
+    order = np.lexsort((index['rank'][owners], [score[k] for k in candidates[hit]]))
+    return owners[order][:limit]
+
+def code_labels(index, codes):
+    """'Name (dept)' labels of INSEE codes, for display (unknown codes are skipped)."""
+    return [index['labels'][index['code_pos'][c]] for c in codes if c in index['code_pos']]
+
+def default_selection(index, n):
+    """INSEE codes of the alphabetically first `n` communes (the selector's default)."""
+    return index['codes'][index['entry'][index['whole']][:n]].tolist()
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from utils.constants import METRICS, SIMILARITY_WEIGHT, DEFAULT_ATTRACTOR
+
+def standardize(X, weights=None):
+    """
+    Z-scores of the columns of X (weighted mean / std when `weights` is given).
+    Missing values are set to the mean (z = 0) so they do not drive distances.
+    Returns:
+        tuple: (Z, mean, std)
+    """
+    valid = ~np.isnan(X)
+    w = np.ones(len(X)) if weights is None else np.nan_to_num(np.asarray(weights, dtype=float))
+    W = np.where(valid, w[:, None], 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu = (W * np.nan_to_num(X)).sum(axis=0) / W.sum(axis=0)
+        var = (W * np.where(valid, X - mu, 0.0) ** 2).sum(axis=0) / W.sum(axis=0)
+    sd = np.sqrt(var)
+    sd = np.where(sd > 0, sd, 1.0)
+    Z = np.where(valid, (X - mu) / sd, 0.0)
+    return Z, mu, sd
+
+def build_similarity_index(by_region, index, metrics=METRICS, weight_col=SIMILARITY_WEIGHT,
+                           dist_col=f'dist_{DEFAULT_ATTRACTOR}_km'):
+    """
+    KD-trees over standardized metric vectors, one per year and per weighting.
+    Rows of each tree follow the year slice of `by_region`, so neighbours map
+    straight back to row positions.
+    Returns:
+        dict: {'metrics': list, 'weighted' / 'unweighted': {year: {'start', 'Z', 'mean', 'std', 'tree', 'dist_km'}}}
+    """
+    metrics = [m for m in metrics if m in by_region.columns]
+    out = {'metrics': metrics, 'weighted': {}, 'unweighted': {}}
+    for year in index['years']:
+        start, stop = index['year_slices'][year]
+        block = by_region.iloc[start:stop]
+        X = block[metrics].to_numpy(dtype=float)
+        dist = block[dist_col].to_numpy(dtype=float) if dist_col in block.columns else np.full(len(X), np.nan)
+        variants = {'unweighted': None}
+        if weight_col in block.columns:
+            variants['weighted'] = block[weight_col].to_numpy(dtype=float)
+        for name, w in variants.items():
+            Z, mu, sd = standardize(X, w)
+            out[name][year] = {
+                'start': start, 'Z': Z, 'mean': mu, 'std': sd,
+                'tree': cKDTree(Z), 'dist_km': dist
+            }
+    return out
+
+def similar_rows(year_index, rows, k=10, exclude_within_km=None, exclude_rows=None):
+    """
+    The k communes closest in metric space to each query row.
+    Args:
+        year_index (dict): one entry of build_similarity_index ('weighted' or 'unweighted', one year)
+        rows (array): `by_region` row positions of the query communes (same year)
+        exclude_within_km (float): drop candidates closer than this to the default attractor
+        exclude_rows (array): row positions never returned (e.g. the whole selection)
+    Returns:
+        DataFrame: query_row, row, similarity distance and rank, k per query (fewer if exhausted)
+    """
+    if len(rows) == 0:
+        empty = np.array([], dtype=int)
+        return pd.DataFrame({'query_row': empty, 'row': empty, 'similarity_distance': empty.astype(float), 'rank': empty})
+    start, tree = year_index['start'], year_index['tree']
+    local = np.asarray(rows, dtype=int) - start
+    banned = np.zeros(tree.n, dtype=bool)
+    if exclude_within_km:
+        banned |= year_index['dist_km'] < exclude_within_km
+    if exclude_rows is not None:
+        banned[np.asarray(exclude_rows, dtype=int) - start] = True
+    banned[local] = True
+
+    # Over-fetch, then widen until every query has k admissible neighbours
+    fetch = min(tree.n, k + 1 + int(banned.sum() * k / max(tree.n, 1)) + 8)
+    while True:
+        dist, idx = tree.query(year_index['Z'][local], k=fetch)
+        dist, idx = dist.reshape(len(local), -1), idx.reshape(len(local), -1)
+        ok = (idx < tree.n) & ~banned[np.minimum(idx, tree.n - 1)]
+        if fetch >= tree.n or (ok.sum(axis=1) >= k).all():
+            break
+        fetch = min(tree.n, fetch * 4)
+
+    q, j = np.nonzero(ok)
+    rank = np.cumsum(ok, axis=1)[q, j]
+    keep = rank <= k
+    return pd.DataFrame({
+        'query_row': np.asarray(rows)[q[keep]],
+        'row': idx[q[keep], j[keep]] + start,
+        'similarity_distance': dist[q[keep], j[keep]],
+        'rank': rank[keep]
+    })
+
+def matched_communes(by_region, year_index, rows, k=5, exclude_within_km=None):
+    """
+    Matched comparison set: for each query commune, its k nearest structural twins
+    (outside the query set and, optionally, beyond `exclude_within_km` of the attractor).
+    Returns:
+        DataFrame: 'match_for' (query commune name) plus the matched communes' rows of `by_region`
+    """
+    pairs = similar_rows(year_index, rows, k, exclude_within_km, exclude_rows=rows)
+    matches = by_region.iloc[pairs['row'].to_numpy()].reset_index(drop=True)
+    matches.insert(0, 'match_for', by_region['nom'].to_numpy()[pairs['query_row'].to_numpy()])
+    matches.insert(1, 'rank', pairs['rank'].to_numpy())
+    matches.insert(2, 'similarity_distance', pairs['similarity_distance'].to_numpy())
+    return matches
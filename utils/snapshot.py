@@ -0,0 +1,67 @@
+import hashlib
+from utils.constants import AVAILABLE_YEARS, DEEP_DIVES_DEFAULT_COMMUNES, COMPARISON_METRICS
+from utils.figcache import figure_key
+from utils.index import code_rows
+from utils.search import default_selection
+from utils.viz import line_chart_figure, bar_chart_figure, distribution_chart_figure
+
+def state_figures(tables, metric, year):
+    """
+    Figures of the default dashboard state for one (metric, focus year), with the
+    figure-cache keys the sections compute for them, so a live app seeded from the
+    export hits them directly. Keys mirror the calls in sections/overview.py
+    (trend) and sections/deep_dives.py (comparison tab, with the default
+    selection it opens with and without a selection).
+    Returns:
+        list: (name, key, build) with `build()` returning the figure
+    """
+    version = tables["fingerprint"]
+    out = []
+
+    # Overview trend: observed years up to the focus year (projections off by default)
+    selected = [y for y in AVAILABLE_YEARS if y <= year]
+    ts = tables["timeseries"]
+    ts = ts[ts["year"].isin(selected)]
+    if not ts.empty and metric in ts.columns:
+        title = f"Rising Tide: Evolution of {metric.replace('_', ' ').title()}"
+        key = figure_key("line_chart", (version, tuple(ts["year"])), metric, title)
+        out.append(("trend", key, lambda: line_chart_figure(ts, metric, title)))
+
+    # Deep Dives comparison of the default selection: latest-year bars and history
+    index, by_region = tables["index"], tables["by_region"]
+    years = [y for y in selected if y in index["year_slices"]]
+    regions = default_selection(tables["search"], DEEP_DIVES_DEFAULT_COMMUNES) if "search" in tables else []
+    if years and regions and metric in by_region.columns:
+        latest_year = max(years)
+        comp_cols = ['nom', 'year'] + [m for m in [metric] + [m for m in COMPARISON_METRICS if m != metric]
+                                       if m in by_region.columns]
+        history = by_region.iloc[code_rows(index, regions, years)][comp_cols]
+        latest = by_region.iloc[code_rows(index, regions, [latest_year])][comp_cols]
+        if not latest.empty:
+            selection_key = (version, latest_year, tuple(regions))
+            sec_metric = "poverty_rate" if metric != "poverty_rate" else "avg_income"
+            for name, m in [("selection", metric), ("selection-secondary", sec_metric)]:
+                key = figure_key("bar_chart", selection_key, m, 10, 'h', latest_year)
+                out.append((name, key, lambda m=m: bar_chart_figure(latest, m, 10, 'h', latest_year)))
+        if not history.empty:
+            title = f"History of {metric.replace('_', ' ')}"
+            key = figure_key("line_chart", (version, tuple(years), tuple(regions)), metric, title)
+            out.append(("selection-history", key, lambda: line_chart_figure(history, metric, title)))
+
+    # Deep Dives comparison without a selection: top 20 communes, and the distribution
+    stats = tables["stats"].get(year, {}).get(metric)
+    if stats and "top" in stats:
+        top = tables["by_region"].iloc[stats["top"][:20]]
+        key = figure_key("bar_chart", (version, year), metric, 20, 'h', year)
+        out.append(("top20", key, lambda: bar_chart_figure(top, metric, 20, 'h', year)))
+
+        ref = stats.get("box", {}).get("median", float("nan"))
+        # NaN never equals itself, a NaN key could not be looked up
+        if ref == ref:
+            key = figure_key("distribution_chart", version, metric, year, ref, "Median")
+            out.append(("distribution", key, lambda: distribution_chart_figure(stats, metric, year, ref, "Median")))
+    return out
+
+def content_name(stem, payload, ext):
+    """Content-addressed file name: '<stem>.<sha1[:12]>.<ext>'."""
+    return f"{stem}.{hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]}.{ext}"
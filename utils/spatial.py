@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+import shapely
+import streamlit as st
+from scipy import sparse
+from utils.constants import SPATIAL_PERMUTATIONS, SPATIAL_ALPHA
+
+LISA_LABELS = {1: "High-High", 2: "Low-High", 3: "Low-Low", 4: "High-Low", 0: "Not significant"}
+
+def build_adjacency(communes_gdf, commune_key):
+    """
+    Queen contiguity graph of the communes (polygons sharing a border or corner).
+    One bulk STRtree query over all polygons, stored as a symmetric binary CSR matrix.
+    Returns:
+        dict: {'codes': array of INSEE codes (sorted), 'W': csr_matrix}
+    """
+    gdf = communes_gdf[[commune_key, 'geometry']].copy()
+    gdf[commune_key] = gdf[commune_key].astype(str)
+    gdf = gdf.sort_values(commune_key).drop_duplicates(commune_key)
+    geoms = gdf.geometry.to_numpy()
+    invalid = ~shapely.is_valid(geoms)
+    if invalid.any():
+        geoms[invalid] = shapely.make_valid(geoms[invalid])
+
+    tree = shapely.STRtree(geoms)
+    left, right = tree.query(geoms, predicate='intersects')
+    keep = left != right
+    n = len(geoms)
+    W = sparse.coo_matrix((np.ones(keep.sum()), (left[keep], right[keep])), shape=(n, n)).tocsr()
+    W = ((W + W.T) > 0).astype(float)
+    return {'codes': gdf[commune_key].to_numpy(), 'W': W}
+
+def subgraph(adjacency, codes):
+    """
+    Row-standardized weights restricted to `codes` (in that order).
+    Communes missing from the graph or without neighbours get an empty row.
+    """
+    pos = np.searchsorted(adjacency['codes'], codes)
+    pos = np.clip(pos, 0, len(adjacency['codes']) - 1)
+    found = adjacency['codes'][pos] == codes
+    n = len(codes)
+    sel = sparse.csr_matrix((np.ones(found.sum()), (np.flatnonzero(found), pos[found])),
+                            shape=(n, len(adjacency['codes'])))
+    W = (sel @ adjacency['W'] @ sel.T).tocsr()
+    deg = np.asarray(W.sum(axis=1)).ravel()
+    inv = np.divide(1.0, deg, out=np.zeros_like(deg), where=deg > 0)
+    return sparse.diags(inv) @ W
+
+def _permuted(z, rng, size):
+    """`size` random permutations of z as columns (n x size)."""
+    return rng.permuted(np.repeat(z[:, None], size, axis=1), axis=0)
+
+def morans_i(values, W, permutations=SPATIAL_PERMUTATIONS, seed=0, batch_size=100):
+    """
+    Global Moran's I with permutation inference (pseudo p-value, two-sided).
+    Returns:
+        dict: I, expected I, pseudo p-value, z-score vs the permutation distribution
+    """
+    z = values - values.mean()
+    has_nb = np.asarray(W.sum(axis=1)).ravel() > 0
+    s0 = has_nb.sum()
+    n = len(z)
+    scale = n / s0 if s0 else np.nan
+
+    I = scale * (z @ (W @ z)) / (z @ z)
+
+    rng = np.random.default_rng(seed)
+    sims = []
+    for start in range(0, permutations, batch_size):
+        Z = _permuted(z, rng, min(batch_size, permutations - start))
+        sims.append(scale * np.einsum('ij,ij->j', Z, W @ Z) / np.einsum('ij,ij->j', Z, Z))
+    sims = np.concatenate(sims)
+
+    expected = -1.0 / (n - 1)
+    extreme = np.sum(np.abs(sims - expected) >= abs(I - expected))
+    return {
+        'I': float(I),
+        'expected': expected,
+        'p_value': float((extreme + 1) / (permutations + 1)),
+        'z_score': float((I - sims.mean()) / sims.std())
+    }
+
+def local_morans(values, W, permutations=SPATIAL_PERMUTATIONS, seed=0, batch_size=100, alpha=SPATIAL_ALPHA):
+    """
+    Local Moran's I (LISA) with vectorized permutation inference.
+    Each commune keeps its own value; its spatial lag is recomputed under random
+    relabelings of the whole map (one sparse product per batch of permutations),
+    a total-randomization approximation of the conditional permutation test.
+    Returns:
+        DataFrame: local I, spatial lag, pseudo p-value and cluster label per commune
+    """
+    z = values - values.mean()
+    m2 = (z @ z) / len(z)
+    lag = W @ z
+    Ii = z * lag / m2
+
+    rng = np.random.default_rng(seed)
+    more_extreme = np.zeros(len(z))
+    for start in range(0, permutations, batch_size):
+        Z = _permuted(z, rng, min(batch_size, permutations - start))
+        sims = z[:, None] * (W @ Z) / m2
+        # One-sided in the direction of the observed statistic
+        more_extreme += np.where(Ii[:, None] >= 0, sims >= Ii[:, None], sims <= Ii[:, None]).sum(axis=1)
+    p = (more_extreme + 1) / (permutations + 1)
+
+    quadrant = np.select(
+        [(z > 0) & (lag > 0), (z <= 0) & (lag > 0), (z <= 0) & (lag <= 0), (z > 0) & (lag <= 0)],
+        [1, 2, 3, 4]
+    )
+    has_nb = np.asarray(W.sum(axis=1)).ravel() > 0
+    cluster = np.where((p < alpha) & has_nb, quadrant, 0)
+    return pd.DataFrame({
+        'local_i': Ii,
+        'lag': lag,
+        'p_value': p,
+        'cluster': pd.Series(cluster).map(LISA_LABELS).to_numpy()
+    })
+
+@st.cache_data(show_spinner="Computing spatial autocorrelation...")
+def spatial_autocorrelation(_tables, fingerprint, metric, year, permutations=SPATIAL_PERMUTATIONS):
+    """
+    Global Moran's I and LISA clusters of one metric/year, cached per (fingerprint, metric, year).
+    Returns:
+        dict: {'global': morans_i result, 'local': DataFrame with lcog_geo, nom and LISA columns}
+    """
+    start, stop = _tables['index']['year_slices'][year]
+    data = _tables['by_region'].iloc[start:stop]
+    codes = data['lcog_geo'].astype(str).to_numpy()
+    values = data[metric].to_numpy(dtype=float)
+    values = np.where(np.isnan(values), np.nanmean(values), values)
+
+    W = subgraph(_tables['adjacency'], codes)
+    local = local_morans(values, W, permutations)
+    local.insert(0, 'lcog_geo', codes)
+    local.insert(1, 'nom', data['nom'].to_numpy())
+    return {'global': morans_i(values, W, permutations), 'local': local}
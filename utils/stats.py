@@ -0,0 +1,128 @@
+import numpy as np
+from utils.constants import (
+    METRICS, METRIC_WEIGHTS, STATS_QUANTILES, STATS_HIST_BINS, STATS_TOP_K
+)
+
+def _top_bottom(vals, rows, k):
+    """Top/bottom-k row positions via argpartition (only the k winners get sorted)."""
+    k = min(k, len(vals))
+    if k == 0:
+        empty = np.array([], dtype=int)
+        return empty, empty
+    top = np.argpartition(-vals, k - 1)[:k]
+    top = top[np.argsort(-vals[top], kind='stable')]
+    bottom = np.argpartition(vals, k - 1)[:k]
+    bottom = bottom[np.argsort(vals[bottom], kind='stable')]
+    return rows[top], rows[bottom]
+
+def weighted_mean(values, weights):
+    """Weighted mean ignoring NaN values and non-positive weights."""
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    ok = ~np.isnan(values) & (weights > 0)
+    if not ok.any():
+        return np.nan
+    return float(np.average(values[ok], weights=weights[ok]))
+
+def summarize(values, rows=None, weights=None, bins=STATS_HIST_BINS, k=STATS_TOP_K):
+    """
+    Summary of one metric over a set of communes.
+    Args:
+        values (array): metric values (NaN allowed)
+        rows (array): row positions in `by_region` matching `values`
+        weights (array): population/household weights for the weighted mean
+    Returns:
+        dict: n, quantiles, box stats, histogram, top/bottom rows, means
+    """
+    values = np.asarray(values, dtype=float)
+    rows = np.arange(len(values)) if rows is None else np.asarray(rows)
+    valid = ~np.isnan(values)
+    vals, rows = values[valid], rows[valid]
+
+    summary = {'n': int(len(vals))}
+    if len(vals) == 0:
+        return summary
+
+    qs = np.quantile(vals, STATS_QUANTILES)
+    summary['quantiles'] = dict(zip(STATS_QUANTILES, qs.tolist()))
+
+    # Tukey box stats so charts can draw a box plot without the raw rows
+    q1, med, q3 = np.quantile(vals, [0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    inside = vals[(vals >= q1 - 1.5 * iqr) & (vals <= q3 + 1.5 * iqr)]
+    summary['box'] = {
+        'q1': float(q1), 'median': float(med), 'q3': float(q3),
+        'lowerfence': float(inside.min()), 'upperfence': float(inside.max()),
+        'mean': float(vals.mean())
+    }
+
+    counts, edges = np.histogram(vals, bins=bins)
+    summary['hist'] = {'counts': counts, 'edges': edges}
+
+    summary['top'], summary['bottom'] = _top_bottom(vals, rows, k)
+    summary['mean'] = float(vals.mean())
+    if weights is not None:
+        summary['weighted_mean'] = weighted_mean(values, weights)
+    return summary
+
+def build_stats_store(by_region, index, metrics=METRICS):
+    """
+    Precompute per metric x year summaries over all communes.
+    Returns:
+        dict: {year: {metric: summary}}
+    """
+    store = {}
+    for year in index['years']:
+        start, stop = index['year_slices'][year]
+        rows = np.arange(start, stop)
+        store[year] = {}
+        for m in metrics:
+            if m not in by_region.columns:
+                continue
+            w_col = METRIC_WEIGHTS.get(m)
+            weights = by_region[w_col].to_numpy(dtype=float)[start:stop] if w_col in by_region.columns else None
+            store[year][m] = summarize(by_region[m].to_numpy(dtype=float)[start:stop], rows, weights)
+    return store
+
+def selection_means(data, metrics=METRICS):
+    """Population/household-weighted means of rates for a selection of rows."""
+    out = {}
+    for m in metrics:
+        if m not in data.columns:
+            continue
+        w_col = METRIC_WEIGHTS.get(m)
+        if w_col in data.columns:
+            out[m] = weighted_mean(data[m], data[w_col])
+        else:
+            out[m] = float(data[m].mean())
+    return out
+
+def density_grid(x, y, weights=None, bins=100):
+    """
+    Vectorized 2D binning of a point cloud.
+    Returns:
+        dict: bin centers ('x', 'y') and per-cell 'count' and 'weight' arrays (shape bins x bins, y first)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    w = np.ones(len(x)) if weights is None else np.nan_to_num(np.asarray(weights, dtype=float))
+    ok = ~(np.isnan(x) | np.isnan(y))
+    x, y, w = x[ok], y[ok], w[ok]
+    if len(x) == 0:
+        return None
+
+    def _edges(v):
+        lo, hi = v.min(), v.max()
+        return np.linspace(lo, hi if hi > lo else lo + 1, bins + 1)
+
+    x_edges, y_edges = _edges(x), _edges(y)
+    ix = np.clip(((x - x_edges[0]) / (x_edges[1] - x_edges[0])).astype(int), 0, bins - 1)
+    iy = np.clip(((y - y_edges[0]) / (y_edges[1] - y_edges[0])).astype(int), 0, bins - 1)
+    flat = iy * bins + ix
+
+    return {
+        'x': (x_edges[:-1] + x_edges[1:]) / 2,
+        'y': (y_edges[:-1] + y_edges[1:]) / 2,
+        'count': np.bincount(flat, minlength=bins * bins).reshape(bins, bins),
+        'weight': np.bincount(flat, weights=w, minlength=bins * bins).reshape(bins, bins)
+    }
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import streamlit as st
+from scipy import sparse
+from scipy.spatial import cKDTree
+from shapely.geometry import Polygon
+from utils.constants import ATTRACTORS
+from utils.attractors import project_attractors
+from utils.prep import SUM_COLS, derive_metrics
+
+def centroid_tree(centroids):
+    """KD-tree over the communes with a valid centroid, and those communes' row positions."""
+    xy = centroids[['x', 'y']].to_numpy(dtype=float)
+    valid = np.flatnonzero(np.isfinite(xy).all(axis=1))
+    return cKDTree(xy[valid]), valid
+
+TERRITORY_KINDS = ('codes', 'department', 'radius', 'polygon')
+
+def _number(definition, field, lo=-np.inf, hi=np.inf):
+    """A finite number within [lo, hi] from a definition, or ValueError."""
+    value = definition.get(field)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not lo <= value <= hi:
+        raise ValueError(f"'{field}' must be a number between {lo:g} and {hi:g}, got {value!r}")
+    return float(value)
+
+def validate_territory(definition):
+    """
+    Check a territory definition (see resolve_territory) before resolving it, so
+    user-supplied definitions fail with a readable message.
+    Raises:
+        ValueError: naming the first problem found
+    """
+    if not isinstance(definition, dict):
+        raise ValueError(f"a territory definition must be an object, got {type(definition).__name__}")
+    kind = definition.get('kind')
+    if kind not in TERRITORY_KINDS:
+        raise ValueError(f"unknown territory kind {kind!r}; expected one of {', '.join(TERRITORY_KINDS)}")
+    if kind == 'codes':
+        codes = definition.get('codes')
+        if not isinstance(codes, list) or not all(isinstance(c, str) for c in codes):
+            raise ValueError("'codes' must be a list of INSEE code strings")
+    elif kind == 'department':
+        prefix = definition.get('prefix')
+        if not isinstance(prefix, str) or not prefix:
+            raise ValueError("'prefix' must be a non-empty string (e.g. '74')")
+    elif kind == 'radius':
+        _number(definition, 'radius_km', 0, 1000)
+        if 'attractor' in definition:
+            if definition['attractor'] not in ATTRACTORS:
+                raise ValueError(f"unknown attractor {definition['attractor']!r}; expected one of {', '.join(ATTRACTORS)}")
+        else:
+            _number(definition, 'lat', -90, 90)
+            _number(definition, 'lon', -180, 180)
+    else:
+        ring = definition.get('polygon')
+        if (not isinstance(ring, list) or len(ring) < 3
+                or not all(isinstance(p, (list, tuple)) and len(p) == 2 for p in ring)):
+            raise ValueError("'polygon' must be a list of at least 3 [lon, lat] pairs")
+        for lon, lat in ring:
+            _number({'lon': lon, 'lat': lat}, 'lon', -180, 180)
+            _number({'lon': lon, 'lat': lat}, 'lat', -90, 90)
+
+def resolve_territory(definition, centroids, crs, tree=None):
+    """
+    INSEE codes of the communes in a territory.
+    Args:
+        definition (dict): {'kind': 'codes', 'codes': [...]}
+            | {'kind': 'department', 'prefix': '74'}
+            | {'kind': 'radius', 'radius_km': 25, 'attractor': 'geneva' or 'lat'/'lon'}
+            | {'kind': 'polygon', 'polygon': [(lon, lat), ...]}
+        centroids (DataFrame): 'lcog_geo', 'x', 'y' in `crs` (see commune_centroids)
+        tree (tuple): optional centroid_tree, reused across radius territories
+    Returns:
+        array: sorted unique codes (str)
+    Raises:
+        ValueError: for a malformed definition (see validate_territory)
+    """
+    validate_territory(definition)
+    codes = centroids['lcog_geo'].to_numpy().astype(str)
+    kind = definition['kind']
+    if kind == 'codes':
+        members = np.asarray(definition['codes'], dtype=str)
+    elif kind == 'department':
+        members = codes[np.char.startswith(codes, str(definition['prefix']))]
+    elif kind == 'radius':
+        centre = ATTRACTORS[definition['attractor']] if 'attractor' in definition else definition
+        _, xy, _ = project_attractors({'centre': centre}, crs)
+        kd, valid = tree if tree is not None else centroid_tree(centroids)
+        members = codes[valid[kd.query_ball_point(xy[0], definition['radius_km'] * 1000.0)]]
+    elif kind == 'polygon':
+        shape = gpd.GeoSeries([Polygon(definition['polygon'])], crs="EPSG:4326").to_crs(crs).iloc[0]
+        x, y = centroids['x'].to_numpy(dtype=float), centroids['y'].to_numpy(dtype=float)
+        # Bounding-box prefilter, then an exact vectorized point-in-polygon test
+        minx, miny, maxx, maxy = shape.bounds
+        near = np.flatnonzero((x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy))
+        members = codes[near[shapely.contains_xy(shape, x[near], y[near])]]
+    return np.unique(members)
+
+def membership_matrix(members, codes, index):
+    """
+    Sparse (territories x years, rows of by_region) 0/1 membership matrix.
+    Row `i * T + t` selects territory t's communes in the i-th year of the index.
+    Args:
+        members (list): code arrays, one per territory
+        codes (array): lcog_geo of every by_region row, sorted within each year slice
+        index (dict): table index (year slices)
+    """
+    T, years = len(members), index['years']
+    flat = np.concatenate(members) if T else np.array([], dtype=str)
+    owner = np.repeat(np.arange(T), [len(m) for m in members])
+
+    rows, cols = [], []
+    for i, year in enumerate(years):
+        start, stop = index['year_slices'][year]
+        year_codes = codes[start:stop]
+        if len(year_codes) == 0 or len(flat) == 0:
+            continue
+        pos = np.minimum(np.searchsorted(year_codes, flat), len(year_codes) - 1)
+        hit = year_codes[pos] == flat
+        rows.append(i * T + owner[hit])
+        cols.append(start + pos[hit])
+    rows = np.concatenate(rows) if rows else np.array([], dtype=int)
+    cols = np.concatenate(cols) if cols else np.array([], dtype=int)
+    return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(years) * T, len(codes)))
+
+def territory_table(by_region, index, centroids, crs, territories):
+    """
+    Metrics of many territories over all years: one sparse product over the summed
+    base columns, then the usual ratio metrics.
+    Args:
+        territories (dict): {name: definition} (see resolve_territory)
+    Returns:
+        DataFrame: 'nom' (territory), 'year', 'n_communes', summed base columns and derived metrics
+    """
+    names = list(territories)
+    tree = centroid_tree(centroids)
+    members = [resolve_territory(territories[n], centroids, crs, tree) for n in names]
+
+    codes = by_region['lcog_geo'].astype(str).to_numpy()
+    M = membership_matrix(members, codes, index)
+    cols = [c for c in SUM_COLS if c in by_region.columns]
+    sums = M @ by_region[cols].to_numpy(dtype=float)
+
+    out = pd.DataFrame(sums, columns=cols)
+    out.insert(0, 'nom', np.tile(np.array(names, dtype=object), len(index['years'])))
+    out.insert(1, 'year', np.repeat(index['years'], len(names)))
+    out.insert(2, 'n_communes', np.diff(M.indptr))
+    return derive_metrics(out)
+
+@st.cache_data(show_spinner="Aggregating territories...")
+def cached_territory_table(_tables, fingerprint, territories):
+    """territory_table on the stored tables, cached per (fingerprint, territory definitions)."""
+    return territory_table(
+        _tables['by_region'], _tables['index'], _tables['centroids'], _tables['centroids_crs'], territories
+    )
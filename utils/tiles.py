@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+import pyproj
+import streamlit as st
+from scipy import sparse
+from utils.constants import TILE_PANEL_COLS, TILE_SIZE_M
+
+# Grid keys pack (northing km, easting km) into one int64
+_KEY_FACTOR = 100_000
+
+def parse_tile_ids(ids):
+    """
+    Integer grid coordinates from INSPIRE tile ids ('CRS3035RES1000mN2029000E4252000').
+    Returns:
+        tuple: (row, col) int arrays in tile units (northing, easting // TILE_SIZE_M), -1 if unparsable
+    """
+    parts = pd.Series(ids, dtype="string").str.extract(r'N(\d+)E(\d+)')
+    north = pd.to_numeric(parts[0], errors='coerce').fillna(-TILE_SIZE_M).to_numpy(dtype=np.int64)
+    east = pd.to_numeric(parts[1], errors='coerce').fillna(-TILE_SIZE_M).to_numpy(dtype=np.int64)
+    return north // TILE_SIZE_M, east // TILE_SIZE_M
+
+def tile_keys(row, col):
+    """Canonical int64 key of each tile."""
+    return np.asarray(row, dtype=np.int64) * _KEY_FACTOR + np.asarray(col, dtype=np.int64)
+
+def split_keys(keys):
+    """Inverse of tile_keys: (row, col)."""
+    return keys // _KEY_FACTOR, keys % _KEY_FACTOR
+
+def tile_block(df, columns=TILE_PANEL_COLS):
+    """
+    Compact one vintage to (keys, float32 values): only the panel columns are kept,
+    duplicate tiles are summed and unparsable ids dropped.
+    Returns:
+        tuple: (sorted unique keys, values (n, len(columns))) or None without a tile id column
+    """
+    if 'idcar_1km' not in df.columns:
+        return None
+    row, col = parse_tile_ids(df['idcar_1km'].to_numpy())
+    ok = (row >= 0) & (col >= 0)
+    keys = tile_keys(row[ok], col[ok])
+    values = np.column_stack([
+        df[c].to_numpy(dtype=np.float32)[ok] if c in df.columns else np.zeros(ok.sum(), dtype=np.float32)
+        for c in columns
+    ])
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    if len(uniq) < len(keys):
+        summed = np.zeros((len(uniq), len(columns)), dtype=np.float32)
+        np.add.at(summed, inverse, values)
+        values = summed
+    return uniq, values
+
+def build_tile_panel(blocks, columns=TILE_PANEL_COLS):
+    """
+    Align vintages on the canonical tile keys with a hash join.
+    Args:
+        blocks (dict): {year: (keys, values)} from tile_block
+    Returns:
+        dict: {
+            'keys': sorted keys of every tile seen in any year, 'columns': list, 'years': list,
+            'pos': {year: positions of that year's rows in 'keys'}, 'values': {year: float32 (n_y, n_cols)}
+        }
+    """
+    years = sorted(blocks)
+    keys = np.unique(np.concatenate([blocks[y][0] for y in years])) if years else np.array([], dtype=np.int64)
+    lookup = pd.Index(keys)
+    return {
+        'keys': keys,
+        'columns': list(columns),
+        'years': years,
+        'pos': {y: lookup.get_indexer(blocks[y][0]).astype(np.int32) for y in years},
+        'values': {y: blocks[y][1] for y in years}
+    }
+
+def tile_matrix(panel, column):
+    """One panel column as a sparse (tiles x years) CSC matrix."""
+    j = panel['columns'].index(column)
+    years = panel['years']
+    rows = np.concatenate([panel['pos'][y] for y in years])
+    cols = np.concatenate([np.full(len(panel['pos'][y]), t) for t, y in enumerate(years)])
+    data = np.concatenate([panel['values'][y][:, j] for y in years])
+    return sparse.csc_matrix((data, (rows, cols)), shape=(len(panel['keys']), len(years)))
+
+def _year_frame(panel, year, positions):
+    """Base columns of `year` for the tiles at `positions` (NaN where absent), as a DataFrame."""
+    lookup = np.full(len(panel['keys']), -1, dtype=np.int64)
+    lookup[panel['pos'][year]] = np.arange(len(panel['pos'][year]))
+    rows = lookup[positions]
+    values = panel['values'][year][np.maximum(rows, 0)].astype(float)
+    values[rows < 0] = np.nan
+    return pd.DataFrame(values, columns=panel['columns'])
+
+def tile_change(panel, y0, y1, metric):
+    """
+    Tile-level change of a metric between two vintages, for tiles present in both.
+    Metrics are recomputed per tile from the base columns (utils.prep.derive_metrics).
+    Returns:
+        DataFrame: row, col, x, y (EPSG:3035 tile centre, meters), <metric>_<y0>, <metric>_<y1>, abs, rel, cagr
+    """
+    # Imported here: utils.prep builds the panel, so a module-level import would be circular
+    from utils.prep import derive_metrics
+    from utils.change import deltas
+
+    both = np.intersect1d(panel['pos'][y0], panel['pos'][y1])
+    v0 = derive_metrics(_year_frame(panel, y0, both))[metric].to_numpy()
+    v1 = derive_metrics(_year_frame(panel, y1, both))[metric].to_numpy()
+    row, col = split_keys(panel['keys'][both])
+    out = pd.DataFrame({
+        'row': row, 'col': col,
+        'x': col * TILE_SIZE_M + TILE_SIZE_M / 2,
+        'y': row * TILE_SIZE_M + TILE_SIZE_M / 2,
+        f'{metric}_{y0}': v0, f'{metric}_{y1}': v1,
+    })
+    for kind, arr in deltas(v0, v1, y1 - y0).items():
+        out[kind] = arr
+    return out
+
+@st.cache_data(show_spinner="Computing tile changes...")
+def cached_tile_change(_tables, fingerprint, y0, y1, metric):
+    """
+    tile_change on the stored panel, cached per (fingerprint, y0, y1, metric), with
+    the WGS84 'lon'/'lat' of each tile's south-west corner: the map's GridCellLayer
+    draws a cell from that corner, not from its centre.
+    """
+    change = tile_change(_tables['tiles'], y0, y1, metric)
+    to_wgs = pyproj.Transformer.from_crs(3035, 4326, always_xy=True)
+    corner_x = change['col'].to_numpy() * TILE_SIZE_M
+    corner_y = change['row'].to_numpy() * TILE_SIZE_M
+    change['lon'], change['lat'] = to_wgs.transform(corner_x, corner_y)
+    return change
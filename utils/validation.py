@@ -0,0 +1,139 @@
+import warnings
+import numpy as np
+from utils.constants import METRICS, VALIDATION
+
+# Totals that must survive the tile -> commune pipeline
+CONSERVED_COLS = ['ind', 'men', 'pop_income']
+
+# (rate, numerator, denominator) pairs whose raw ratio must stay within [0, 1] before clipping
+RATE_BOUNDS = [
+    ('poverty_rate', 'men_pauv', 'men'),
+    ('ownership_rate', 'men_prop', 'men'),
+    ('single_parent_pct', 'men_fmp', 'men'),
+    ('social_housing_rate', 'log_soc', 'social_housing_base'),
+]
+
+def column_totals(df, columns=CONSERVED_COLS):
+    """Row count and column sums of one pipeline stage."""
+    totals = {'rows': int(len(df))}
+    for c in columns:
+        if c in df.columns:
+            totals[c] = float(df[c].to_numpy(dtype=float).sum())
+    return totals
+
+def _rel_loss(before, after):
+    """Share of a total lost between two stages (negative when it grew)."""
+    return (before - after) / before if before else 0.0
+
+def psi(reference, current, bins=10):
+    """
+    Population stability index of `current` against `reference`, binned on the
+    reference deciles. Empty bins get a small floor so the log stays finite.
+    """
+    reference = reference[np.isfinite(reference)]
+    current = current[np.isfinite(current)]
+    if len(reference) == 0 or len(current) == 0:
+        return float('nan')
+    edges = np.unique(np.quantile(reference, np.linspace(0, 1, bins + 1)[1:-1]))
+    p = np.bincount(np.searchsorted(edges, reference, side='right'), minlength=len(edges) + 1) / len(reference)
+    q = np.bincount(np.searchsorted(edges, current, side='right'), minlength=len(edges) + 1) / len(current)
+    p, q = np.maximum(p, 1e-4), np.maximum(q, 1e-4)
+    return float(((q - p) * np.log(q / p)).sum())
+
+def validate_build(stage_totals, by_region, index, timeseries=None, metrics=METRICS, limits=VALIDATION):
+    """
+    Data-quality report for one build: conservation of totals from the tiles to
+    the commune table, unmatched tiles, raw rate plausibility and drift against
+    the previous vintage.
+    Args:
+        stage_totals (dict): {year: {'read': totals, 'joined': totals, 'dropped_rows': int}}
+            with totals from column_totals, recorded in make_tables
+        by_region (DataFrame): commune table sorted by (year, lcog_geo)
+        index (dict): table index (year slices)
+        timeseries (DataFrame): national table, whose years must all reach the commune table
+    Returns:
+        dict: {'years': {year: checks}, 'violations': [messages], 'warnings': [messages]}
+    """
+    report = {'years': {}, 'violations': [], 'warnings': []}
+
+    # A vintage that was read but has no commune rows was lost somewhere in the pipeline
+    expected = set(stage_totals) | ({int(y) for y in timeseries['year']} if timeseries is not None else set())
+    for year in sorted(expected - set(index['years'])):
+        report['violations'].append(f"{year}: no communes in the commune table")
+    years = [y for y in index['years'] if y in stage_totals]
+    if not years:
+        return report
+
+    # Final commune totals for every year in one reduction over the year blocks
+    starts = np.array([index['year_slices'][y][0] for y in years])
+    conserved = [c for c in CONSERVED_COLS if c in by_region.columns]
+    final = np.add.reduceat(by_region[conserved].to_numpy(dtype=float), starts, axis=0)
+
+    metrics = [m for m in metrics if m in by_region.columns]
+    values = by_region[metrics].to_numpy(dtype=float)
+    prev = None
+
+    for t, year in enumerate(years):
+        stages = stage_totals[year]
+        start, stop = index['year_slices'][year]
+        checks = {}
+
+        # Conservation: tiles read -> tiles matched to a commune -> commune table
+        checks['conservation'] = {}
+        for j, c in enumerate(conserved):
+            read, joined = stages['read'].get(c, 0.0), stages['joined'].get(c, 0.0)
+            entry = {
+                'tiles': read,
+                'matched': joined,
+                'communes': float(final[t, j]),
+                'join_loss': _rel_loss(read, joined),
+                'commune_loss': _rel_loss(joined, final[t, j])
+            }
+            checks['conservation'][c] = entry
+            if entry['join_loss'] > limits['max_join_loss']:
+                report['violations'].append(f"{year}: {entry['join_loss']:.2%} of {c} lost matching tiles to communes")
+            if abs(entry['commune_loss']) > limits['conservation_tol']:
+                report['violations'].append(
+                    f"{year}: commune table {c} differs from matched tiles by {entry['commune_loss']:+.3%}"
+                )
+
+        # Unmatched tiles: null commune codes at read time plus spatial-join misses
+        total = stages['read']['rows'] + stages['dropped_rows']
+        unmatched = total - stages['joined']['rows']
+        checks['unmatched_tiles'] = {'count': int(unmatched), 'rate': unmatched / total if total else 0.0}
+        if checks['unmatched_tiles']['rate'] > limits['max_unmatched_rate']:
+            report['violations'].append(f"{year}: {checks['unmatched_tiles']['rate']:.2%} of tiles unmatched")
+
+        # Raw rates outside [0, 100] before derive_metrics clips them
+        checks['implausible_rates'] = {}
+        for rate, num, den in RATE_BOUNDS:
+            if num not in by_region.columns or den not in by_region.columns:
+                continue
+            n = by_region[num].to_numpy(dtype=float)[start:stop]
+            d = by_region[den].to_numpy(dtype=float)[start:stop]
+            bad = int(((n < 0) | (n > d * (1 + limits['rate_tol']))).sum())
+            share = bad / max(stop - start, 1)
+            checks['implausible_rates'][rate] = {'count': bad, 'share': share}
+            if share > limits['max_implausible_share']:
+                report['violations'].append(f"{year}: {share:.2%} of communes have {rate} above 100% before clipping")
+
+        # Drift against the previous vintage: quantiles and PSI per metric
+        cur = values[start:stop]
+        with warnings.catch_warnings():
+            # A metric the vintage lacks is all NaN (utils.prep.mask_missing): its quantiles stay NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            quantiles = np.nanquantile(cur, [0.1, 0.5, 0.9], axis=0) if len(cur) else np.full((3, len(metrics)), np.nan)
+        checks['drift'] = {}
+        for j, m in enumerate(metrics):
+            entry = {'p10': float(quantiles[0, j]), 'p50': float(quantiles[1, j]), 'p90': float(quantiles[2, j])}
+            if prev is not None:
+                entry['psi'] = psi(prev[:, j], cur[:, j])
+                if entry['psi'] > limits['psi_fail']:
+                    report['violations'].append(f"{year}: {m} drifted from the previous vintage (PSI {entry['psi']:.2f})")
+                elif entry['psi'] > limits['psi_warn']:
+                    report['warnings'].append(f"{year}: {m} shifted from the previous vintage (PSI {entry['psi']:.2f})")
+            checks['drift'][m] = entry
+        prev = cur
+
+        report['years'][year] = checks
+    return report
@@ -1,10 +1,18 @@
 import plotly.express as px
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 import folium
 from folium.features import GeoJsonTooltip
 from streamlit_folium import st_folium
 import streamlit as st
 import pandas as pd
+import numpy as np
+from utils.constants import (
+    SCATTER_WEBGL_THRESHOLD, SCATTER_DENSITY_THRESHOLD, SCATTER_GRID_BINS, ATTRACTORS, DECAY_MODELS,
+    TILE_SIZE_M
+)
+from utils.stats import density_grid
+from utils.figcache import figure_key, get_or_build
 
 # --- Design System & Constants ---
 THEME_COLORS = {
@@ -27,6 +35,9 @@ COLOR_SCALES = {
     "new_housing_pct": "PuBuGn"   # Teal -> PuBuGn
 }
 
+AGE_COLS = ['ind_0_3', 'ind_4_5', 'ind_6_10', 'ind_11_17', 'ind_18_24',
+            'ind_25_39', 'ind_40_54', 'ind_55_64', 'ind_65_79', 'ind_80p']
+
 def _apply_layout(fig, title, x_title, y_title):
     """Apply consistent styling to Plotly figures."""
     fig.update_layout(
@@ -40,18 +51,34 @@ def _apply_layout(fig, title, x_title, y_title):
 
 def format_metric_label(metric):
     """Helper to format metric names."""
-    if metric == 'dist_geneva_km':
-        return "Distance to Geneva (km)"
+    if metric.startswith('dist_') and metric.endswith('_km'):
+        key = metric[len('dist_'):-len('_km')]
+        if key in ATTRACTORS:
+            return f"Distance to {ATTRACTORS[key]['name']} (km)"
     return metric.replace("_", " ").title()
 
-def line_chart(data, metric, title=None):
-    """Plot trends over time with area fill."""
-    if data.empty:
-        st.warning("No data available for trends.")
-        return
+def _show(build, chart, cache_key, *params):
+    """
+    Render a figure, through the figure cache when the caller passes a `cache_key`
+    (data version, year, selection...) identifying the input data.
+    """
+    if cache_key is None:
+        fig = build()
+    else:
+        fig = get_or_build(figure_key(chart, cache_key, *params), build)
+    if fig is not None:
+        st.plotly_chart(fig, use_container_width=True)
 
+def line_chart_figure(data, metric, title=None):
+    """Trend over time with area fill."""
     label = format_metric_label(metric)
     formatted_title = title or f"Evolution of {label} (2015-2019)"
+
+    # Estimated years (see utils.projection) are drawn separately as a dashed trend
+    estimated = None
+    if 'is_projected' in data.columns:
+        flag = data['is_projected'].fillna(False).astype(bool)
+        estimated, data = data[flag], data[~flag]
     
     # Check if we have multiple groups (e.g. Regions) or just one aggregate
     if 'nom' in data.columns and data['nom'].nunique() > 1:
@@ -72,16 +99,43 @@ def line_chart(data, metric, title=None):
             color_discrete_sequence=[THEME_COLORS["primary"]]
         )
 
+    if estimated is not None and not estimated.empty:
+        _add_projection(fig, data, estimated, metric)
+
     fig = _apply_layout(fig, formatted_title, "Year", label)
     fig.update_layout(xaxis=dict(tickmode='linear', tick0=2015, dtick=2))
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
 
-def bar_chart(data, metric, top_n=10, orientation='v', year=None):
-    """Plot comparison of entities."""
+def _add_projection(fig, observed, estimated, metric):
+    """Dashed line through observed + estimated years, with the interval band when available."""
+    path = pd.concat([observed[['year', metric]], estimated[['year', metric]]]).sort_values('year')
+    lo, hi = f'{metric}_lo', f'{metric}_hi'
+    if lo in estimated.columns and estimated[lo].notna().any():
+        band = estimated.dropna(subset=[lo, hi]).sort_values('year')
+        fig.add_trace(go.Scatter(
+            x=list(band['year']) + list(band['year'])[::-1],
+            y=list(band[hi]) + list(band[lo])[::-1],
+            fill='toself', fillcolor="rgba(139, 92, 246, 0.15)", line=dict(width=0),
+            hoverinfo='skip', name="95% interval"
+        ))
+    fig.add_trace(go.Scatter(
+        x=path['year'], y=path[metric], mode="lines", name="Trend / projection",
+        line=dict(color=THEME_COLORS["accent"], dash="dash")
+    ))
+    fig.add_trace(go.Scatter(
+        x=estimated['year'], y=estimated[metric], mode="markers", name="Estimated",
+        marker=dict(color="white", size=8, line=dict(color=THEME_COLORS["accent"], width=2))
+    ))
+
+def line_chart(data, metric, title=None, cache_key=None):
+    """Plot trends over time with area fill."""
     if data.empty:
-        st.warning("No data available for comparison.")
+        st.warning("No data available for trends.")
         return
+    _show(lambda: line_chart_figure(data, metric, title), "line_chart", cache_key, metric, title)
 
+def bar_chart_figure(data, metric, top_n=10, orientation='v', year=None):
+    """Comparison of entities."""
     label = format_metric_label(metric)
     
     # Sort
@@ -110,23 +164,42 @@ def bar_chart(data, metric, top_n=10, orientation='v', year=None):
     
     fig = _apply_layout(fig, title, x_title, y_title)
     fig.update_coloraxes(showscale=False)
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
+
+def bar_chart(data, metric, top_n=10, orientation='v', year=None, cache_key=None):
+    """Plot comparison of entities."""
+    if data.empty:
+        st.warning("No data available for comparison.")
+        return
+    _show(lambda: bar_chart_figure(data, metric, top_n, orientation, year),
+          "bar_chart", cache_key, metric, top_n, orientation, year)
 
-def distribution_chart(data, metric, year=None, ref_value=None, ref_label="Avg"):
-    """Plot distribution histogram with optional reference line."""
+def distribution_chart_figure(summary, metric, year=None, ref_value=None, ref_label="Avg"):
+    """Histogram + box marginal from a precomputed summary (see utils.stats.summarize)."""
     label = format_metric_label(metric)
     title = f"Distribution of {label}"
     if year:
         title += f" ({year})"
-        
-    fig = px.histogram(
-        data, 
-        x=metric,
-        nbins=30,
-        color_discrete_sequence=[THEME_COLORS["accent"]],
-        marginal="box",
-        title=title
-    )
+
+    counts, edges = summary['hist']['counts'], summary['hist']['edges']
+    box = summary['box']
+
+    # Box marginal on top, histogram below (same layout as px marginal="box")
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.2, 0.8], vertical_spacing=0.02)
+    fig.add_trace(go.Box(
+        q1=[box['q1']], median=[box['median']], q3=[box['q3']],
+        lowerfence=[box['lowerfence']], upperfence=[box['upperfence']], mean=[box['mean']],
+        orientation='h', name=label, marker_color=THEME_COLORS["accent"], showlegend=False
+    ), row=1, col=1)
+    fig.add_trace(go.Bar(
+        x=(edges[:-1] + edges[1:]) / 2,
+        y=counts,
+        width=edges[1:] - edges[:-1],
+        marker_color=THEME_COLORS["accent"],
+        name="Count",
+        showlegend=False
+    ), row=2, col=1)
+    fig.update_yaxes(showticklabels=False, row=1, col=1)
     
     if ref_value is not None:
         fig.add_vline(
@@ -137,16 +210,26 @@ def distribution_chart(data, metric, year=None, ref_value=None, ref_label="Avg")
             annotation_position="top right"
         )
         
-    fig = _apply_layout(fig, title, label, "Count")
-    st.plotly_chart(fig, use_container_width=True)
+    fig = _apply_layout(fig, title, None, None)
+    fig.update_xaxes(title_text=label, row=2, col=1)
+    fig.update_yaxes(title_text="Count", row=2, col=1)
+    return fig
 
-def correlation_matrix(data, metrics, year=None):
-    """Plot correlation heatmap."""
-    if len(metrics) < 2:
-        st.warning("Need at least 2 metrics for correlation.")
+def distribution_chart(summary, metric, year=None, ref_value=None, ref_label="Avg", cache_key=None):
+    """
+    Plot distribution histogram with optional reference line.
+    Built from a precomputed summary (see utils.stats.summarize), so only
+    the bin counts and box statistics are sent to the browser.
+    """
+    if not summary or summary.get('n', 0) == 0:
+        st.warning("No data available for distribution.")
         return
+    _show(lambda: distribution_chart_figure(summary, metric, year, ref_value, ref_label),
+          "distribution_chart", cache_key, metric, year, ref_value, ref_label)
 
-    corr = data[metrics].corr()
+def correlation_matrix_figure(corr, metrics, year=None, ci=None):
+    """Correlation heatmap sliced from the full precomputed matrix."""
+    corr = corr.loc[metrics, metrics]
     
     title = "Correlation Matrix"
     if year:
@@ -157,43 +240,154 @@ def correlation_matrix(data, metrics, year=None):
         text_auto=".2f",
         aspect="auto",
         color_continuous_scale="RdBu_r",
+        zmin=-1,
+        zmax=1,
         title=title
     )
-    fig = _apply_layout(fig, title, "", "")
-    st.plotly_chart(fig, use_container_width=True)
+    if ci is not None:
+        lower, upper = ci[0].loc[metrics, metrics], ci[1].loc[metrics, metrics]
+        fig.update_traces(
+            customdata=np.dstack([lower.to_numpy(), upper.to_numpy()]),
+            hovertemplate="%{y} vs %{x}<br>r = %{z:.2f}<br>95% CI [%{customdata[0]:.2f}, %{customdata[1]:.2f}]<extra></extra>"
+        )
+    return _apply_layout(fig, title, "", "")
+
+def correlation_matrix(corr, metrics, year=None, ci=None, cache_key=None):
+    """
+    Plot correlation heatmap.
+    `corr` is the precomputed full matrix (see utils.correlation); the selected
+    metrics are served by slicing it. `ci` is an optional (lower, upper) pair.
+    """
+    if len(metrics) < 2:
+        st.warning("Need at least 2 metrics for correlation.")
+        return
+    _show(lambda: correlation_matrix_figure(corr, metrics, year, ci),
+          "correlation_matrix", cache_key, metrics, year, ci is not None)
+
+@st.cache_data(show_spinner=False)
+def _density_grid(_data, x, y, weight, cache_key, bins=SCATTER_GRID_BINS):
+    """Binned point cloud, cached per (x, y, weight, data version/year) key."""
+    weights = _data[weight] if weight and weight in _data.columns else None
+    return density_grid(_data[x], _data[y], weights, bins=bins)
+
+def _add_highlight(fig, data, x, y, hover_name, highlight):
+    """Highlighted communes (INSEE codes) as red markers on top of a scatter or density view."""
+    if not highlight or 'lcog_geo' not in data.columns:
+        return fig
+    picked = data[data['lcog_geo'].isin(highlight)]
+    fig.add_trace(go.Scatter(
+        x=picked[x],
+        y=picked[y],
+        mode="markers",
+        text=picked[hover_name],
+        marker=dict(color="red", size=10, line=dict(color="white", width=1)),
+        name="Selected",
+        hovertemplate="%{text}<br>%{x:,.1f}, %{y:,.1f}<extra></extra>"
+    ))
+    return fig
+
+def _density_figure(data, x, y, size, hover_name, highlight, cache_key):
+    """
+    Heatmap of the binned cloud with point-level detail only for highlighted communes.
+    The grid is cached only when `cache_key` identifies the data.
+    """
+    if cache_key is None:
+        weights = data[size] if size and size in data.columns else None
+        grid = density_grid(data[x], data[y], weights, bins=SCATTER_GRID_BINS)
+    else:
+        grid = _density_grid(data, x, y, size, cache_key)
+    if grid is None:
+        return None
+
+    count = grid['count'].astype(float)
+    count[count == 0] = np.nan
+    weight_label = format_metric_label(size) if size else "Weight"
+    fig = go.Figure(go.Heatmap(
+        x=grid['x'],
+        y=grid['y'],
+        z=count,
+        customdata=grid['weight'],
+        colorscale="Viridis",
+        colorbar=dict(title="Communes"),
+        hovertemplate=(
+            f"{format_metric_label(x)}: %{{x:,.1f}}<br>{format_metric_label(y)}: %{{y:,.1f}}"
+            f"<br>Communes: %{{z:,.0f}}<br>{weight_label}: %{{customdata:,.0f}}<extra></extra>"
+        )
+    ))
+    return _add_highlight(fig, data, x, y, hover_name, highlight)
+
+def _add_fit_overlays(fig, fits):
+    """Fitted decay curves (see utils.models) and their breakpoints on top of a scatter."""
+    palette = px.colors.qualitative.Dark2
+    for i, fit in enumerate(fits):
+        name = f"{DECAY_MODELS.get(fit['model'], fit['model'])} fit (R² {fit['r2']:.2f})"
+        fig.add_trace(go.Scatter(
+            x=fit['curve']['x'], y=fit['curve']['y'], mode="lines", name=name,
+            line=dict(color=palette[i % len(palette)], width=3)
+        ))
+        for k, v in fit['params'].items():
+            if k.startswith('break_'):
+                fig.add_vline(x=v, line_dash="dot", line_color=palette[i % len(palette)],
+                              annotation_text=f" {v:.0f} km", annotation_position="top")
+    return fig
 
-def scatter_plot(data, x, y, size=None, hover_name="nom", color=None, year=None):
-    """Plot interaction between two metrics."""
+def scatter_plot_figure(data, x, y, size=None, hover_name="nom", color=None, year=None, highlight=None,
+                        cache_key=None, fits=None):
+    """Scatter of two metrics, WebGL or binned density depending on the number of points."""
     title = f"{format_metric_label(x)} vs {format_metric_label(y)}"
     if year:
         title += f" ({year})"
-        
-    fig = px.scatter(
-        data,
-        x=x,
-        y=y,
-        size=size,
-        hover_name=hover_name,
-        color=color if color else y,
-        color_continuous_scale="Viridis",
-        title=title
-    )
-    fig = _apply_layout(fig, title, format_metric_label(x), format_metric_label(y))
-    st.plotly_chart(fig, use_container_width=True)
 
-def population_pyramid(data, year=None):
-    """Plot age structure."""
-    if data.empty: return
-    
+    n_points = len(data)
+    if n_points > SCATTER_DENSITY_THRESHOLD:
+        fig = _density_figure(data, x, y, size, hover_name, highlight,
+                              None if cache_key is None else (cache_key, year))
+        if fig is None:
+            return None
+        title += " • density view"
+    else:
+        color = color if color else y
+        # Categorical colors (e.g. typology clusters) in sorted order, matching qualitative_palette
+        categories = None
+        if not pd.api.types.is_numeric_dtype(data[color]):
+            categories = {color: sorted(data[color].dropna().unique())}
+        fig = px.scatter(
+            data,
+            x=x,
+            y=y,
+            size=size,
+            hover_name=hover_name,
+            color=color,
+            color_continuous_scale="Viridis",
+            category_orders=categories,
+            render_mode="webgl" if n_points > SCATTER_WEBGL_THRESHOLD else "svg",
+            title=title
+        )
+        fig = _add_highlight(fig, data, x, y, hover_name, highlight)
+    if fits:
+        fig = _add_fit_overlays(fig, fits)
+    return _apply_layout(fig, title, format_metric_label(x), format_metric_label(y))
+
+def scatter_plot(data, x, y, size=None, hover_name="nom", color=None, year=None, highlight=None,
+                 cache_key=None, fits=None):
+    """
+    Plot interaction between two metrics.
+    Switches to WebGL above SCATTER_WEBGL_THRESHOLD points and to a binned
+    density grid above SCATTER_DENSITY_THRESHOLD; `highlight` INSEE codes are drawn as
+    red points on top in every mode.
+    `cache_key` identifies the data (e.g. version + year) for the cached grid and figure.
+    `fits` are optional decay fits (utils.models) overlaid as curves + breakpoints.
+    """
+    fit_keys = tuple(f['key'] for f in fits) if fits else None
+    _show(lambda: scatter_plot_figure(data, x, y, size, hover_name, color, year, highlight, cache_key, fits),
+          "scatter_plot", cache_key, x, y, size, color, year, highlight, fit_keys)
+
+def population_pyramid_figure(data, year=None):
+    """Age structure bars, or None when the age bands are missing."""
     # We expect aggregated sums of these columns
-    age_cols = ['ind_0_3', 'ind_4_5', 'ind_6_10', 'ind_11_17', 'ind_18_24',
-                'ind_25_39', 'ind_40_54', 'ind_55_64', 'ind_65_79', 'ind_80p']
-    
-    # Check existence
-    existing = [c for c in age_cols if c in data.columns]
+    existing = [c for c in AGE_COLS if c in data.columns]
     if not existing: 
-        st.warning("Demographic data missing.")
-        return
+        return None
         
     # Sum up for the selection (usually single commune or national sum)
     # If data has multiple rows, we sum them
@@ -214,15 +408,23 @@ def population_pyramid(data, year=None):
         color='Population',
         color_continuous_scale='Burg'
     )
-    fig = _apply_layout(fig, title, "Age Group", "Population")
-    st.plotly_chart(fig, use_container_width=True)
+    return _apply_layout(fig, title, "Age Group", "Population")
 
-def housing_mix_chart(data, year=None):
-    """Plot housing construction eras."""
+def population_pyramid(data, year=None, cache_key=None):
+    """Plot age structure."""
+    if data.empty: return
+    
+    if not any(c in data.columns for c in AGE_COLS):
+        st.warning("Demographic data missing.")
+        return
+    _show(lambda: population_pyramid_figure(data, year), "population_pyramid", cache_key, year)
+
+def housing_mix_chart_figure(data, year=None):
+    """Housing construction eras pie, or None when the era columns are missing."""
     eras = ['log_av45', 'log_45_70', 'log_70_90', 'log_ap90', 'log_inc']
     existing = [c for c in eras if c in data.columns]
     
-    if not existing: return
+    if not existing: return None
     
     totals = data[existing].sum().reset_index()
     totals.columns = ['Construction Era', 'Count']
@@ -249,40 +451,103 @@ def housing_mix_chart(data, year=None):
         color_discrete_sequence=px.colors.sequential.Teal
     )
     fig.update_layout(title=title)
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
+
+def housing_mix_chart(data, year=None, cache_key=None):
+    """Plot housing construction eras."""
+    _show(lambda: housing_mix_chart_figure(data, year), "housing_mix_chart", cache_key, year)
+
+def gradient_chart_figure(rings, metric, attractor=None, year=None):
+    """Ring-aggregated metric vs distance (line) with the population per ring (bars)."""
+    label = format_metric_label(metric)
+    place = ATTRACTORS[attractor]['name'] if attractor in ATTRACTORS else "the attractor"
+    title = f"{label} by Distance Ring around {place}"
+    if year:
+        title += f" ({year})"
+
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    width = rings['ring_end_km'] - rings['ring_start_km']
+    fig.add_trace(go.Bar(
+        x=rings['ring_mid_km'], y=rings['total_pop'], width=width * 0.9,
+        name="Population", marker_color=THEME_COLORS["grid"], opacity=0.8,
+        customdata=np.column_stack([rings['ring_start_km'], rings['ring_end_km'], rings['n_communes']]),
+        hovertemplate="%{customdata[0]:.0f}-%{customdata[1]:.0f} km<br>Population: %{y:,.0f}<br>Communes: %{customdata[2]}<extra></extra>"
+    ), secondary_y=True)
+    fig.add_trace(go.Scatter(
+        x=rings['ring_mid_km'], y=rings[metric], mode="lines+markers",
+        name=label, line=dict(color=THEME_COLORS["primary"], width=3),
+        hovertemplate=f"{label}: %{{y:,.2f}}<extra></extra>"
+    ), secondary_y=False)
+
+    fig = _apply_layout(fig, title, "Distance (km, ring midpoint)", label)
+    fig.update_yaxes(title_text="Population", secondary_y=True, showgrid=False)
+    return fig
+
+def gradient_chart(rings, metric, attractor=None, year=None, cache_key=None):
+    """Plot the distance gradient of a metric from ring aggregates."""
+    if rings.empty:
+        st.warning("No communes within the selected rings.")
+        return
+    _show(lambda: gradient_chart_figure(rings, metric, attractor, year), "gradient_chart", cache_key, metric, attractor, year)
+
+def movers_chart_figure(risers, fallers, metric, change_label, period=None):
+    """Horizontal bars of the biggest risers (blue) and fallers (red) of a metric."""
+    label = format_metric_label(metric)
+    title = f"Biggest Movers: {label}"
+    if period:
+        title += f" ({period})"
+
+    data = pd.concat([fallers.iloc[::-1], risers.iloc[::-1]], ignore_index=True).drop_duplicates('lcog_geo')
+    colors = np.where(data[metric] >= 0, THEME_COLORS["primary"], "#EF4444")
+    fig = go.Figure(go.Bar(
+        x=data[metric], y=data['nom'] + " (" + data['lcog_geo'] + ")", orientation='h',
+        marker_color=colors,
+        customdata=data['total_pop'],
+        hovertemplate="%{y}<br>" + change_label + ": %{x:+,.2f}<br>Population: %{customdata:,.0f}<extra></extra>"
+    ))
+    fig = _apply_layout(fig, title, change_label, None)
+    fig.update_layout(hovermode="closest", height=max(400, 22 * len(data)))
+    return fig
+
+def movers_chart(risers, fallers, metric, change_label, period=None, cache_key=None):
+    """Plot the biggest risers and fallers of a metric between two vintages."""
+    if risers.empty and fallers.empty:
+        st.warning("No communes to rank for this period.")
+        return
+    _show(lambda: movers_chart_figure(risers, fallers, metric, change_label, period),
+          "movers_chart", cache_key, metric, change_label, period)
 
 import pydeck as pdk
 
 # ... (previous functions)
 
+def _to_wgs84(geo):
+    """
+    `geo` in EPSG:4326 and the centre of its bounds, for the PyDeck maps (the CRS
+    itself is repaired once in make_tables, see utils.prep.repair_crs).
+    Returns:
+        tuple: (GeoDataFrame, center_lat, center_lon)
+    """
+    if geo.crs and geo.crs.to_epsg() != 4326:
+        geo = geo.to_crs(epsg=4326)
+    else:
+        geo = geo.copy()
+    west, south, east, north = geo.total_bounds
+    return geo, (south + north) / 2, (west + east) / 2
+
 @st.cache_data(show_spinner=True)
 def _prepare_3d_data(_geo_data, metric):
     """
     Preprocess geo_data for 3D mapping. 
     Handles expensive CRS reprojection, color calculation, and serialization once per metric.
     """
-    # 1. Coordinate Magnitude Check
-    bounds = _geo_data.total_bounds
-    is_projected_coords = (bounds[0] > 360 or bounds[1] > 360) 
-
+    # 1. Reprojection and map centre
     try:
-        if is_projected_coords:
-            geo_data_fixed = _geo_data.copy()
-            geo_data_fixed.set_crs(epsg=2154, allow_override=True, inplace=True)
-            geo_data_proj = geo_data_fixed.to_crs(epsg=4326)
-        elif _geo_data.crs and _geo_data.crs.to_string() != "EPSG:4326":
-            geo_data_proj = _geo_data.to_crs(epsg=4326)
-        else:
-            geo_data_proj = _geo_data.copy()
+        geo_data_proj, center_lat, center_lon = _to_wgs84(_geo_data)
     except Exception as e:
         st.error(f"CRS Visualization Error: {e}")
         return None, None, None, None
 
-    # Calculate Center
-    bounds_proj = geo_data_proj.total_bounds
-    center_lat = (bounds_proj[1] + bounds_proj[3]) / 2
-    center_lon = (bounds_proj[0] + bounds_proj[2]) / 2
-
     # Normalize metric for coloring
     min_val = geo_data_proj[metric].min()
     max_val = geo_data_proj[metric].max()
@@ -314,13 +579,19 @@ def map_chart_3d(geo_data, metric="avg_income", opacity=0.8, height=500, highlig
         st.warning("No geographic data available.")
         return
 
+    r = map_3d_deck(geo_data, metric, opacity, highlight_regions)
+    if r is not None:
+        st.pydeck_chart(r, use_container_width=True, height=height)
+
+def map_3d_deck(geo_data, metric="avg_income", opacity=0.8, highlight_regions=None):
+    """The 3D tilted map as a pydeck Deck (None if the geometry could not be prepared)."""
     # Use cached data preparation
     # Note: Streamlit uses the un-underscored name for the call, but looking at the definition
     # it sees _geo_data and knows to skip hashing it.
     geo_data_dict, center_lat, center_lon, max_val = _prepare_3d_data(geo_data, metric)
     
     if geo_data_dict is None:
-        return
+        return None
 
     label = format_metric_label(metric)
     
@@ -356,14 +627,13 @@ def map_chart_3d(geo_data, metric="avg_income", opacity=0.8, height=500, highlig
         
         all_features = geo_data_dict.get('features', [])
         
-        # Filter where 'nom' matches
-        # Note: geo_data merged 'nom' into properties in make_tables usually, but lets verify property access
-        # _prepare_3d_data just does __geo_interface__, which dumps df columns to properties.
-        # So 'nom' should be in feature['properties']['nom'].
-        
+        # Filter where the INSEE code matches (names are not unique)
+        # _prepare_3d_data just does __geo_interface__, which dumps df columns to properties,
+        # so 'lcog_geo' is in feature['properties'].
+        highlight_codes = set(highlight_regions)
         highlight_features = [
             f for f in all_features 
-            if f.get('properties', {}).get('nom') in highlight_regions
+            if f.get('properties', {}).get('lcog_geo') in highlight_codes
         ]
         
         if highlight_features:
@@ -398,13 +668,209 @@ def map_chart_3d(geo_data, metric="avg_income", opacity=0.8, height=500, highlig
         bearing=0
     )
 
-    # Render
-    r = pdk.Deck(
+    return pdk.Deck(
         layers=layers,
         initial_view_state=view_state,
         tooltip={"text": "{nom}\n" + label + ": {formatted_val}"},
         map_style="light",
     )
-    
+
+def map_vector_tiles_deck(meta, metric, url, opacity=0.8):
+    """
+    The 3D map streamed as vector tiles (MVTLayer) from `url`, a '{z}/{x}/{y}'
+    template, so only the visible tiles are loaded. `meta` is the layer's MBTiles
+    metadata (utils.vtiles.mbtiles_metadata); colors use the same ramp as the
+    GeoJSON map, normalized with the stored value range.
+    """
+    lo, hi = meta['ranges'].get(metric, [0.0, 1.0])
+    norm = f"((properties.{metric} - {lo}) / {(hi - lo) or 1})"
+    lon, lat, _ = (float(v) for v in meta['center'].split(','))
+    layer = pdk.Layer(
+        "MVTLayer",
+        data=url,
+        min_zoom=int(meta['minzoom']),
+        max_zoom=int(meta['maxzoom']),
+        opacity=opacity,
+        stroked=True,
+        filled=True,
+        extruded=True,
+        wireframe=True,
+        get_elevation=f"properties.{metric}",
+        elevation_scale=10 if hi < 1000 else 0.1,
+        get_fill_color=f"[220 - {norm} * 212, 240 - {norm} * 192, 255 - {norm} * 148, 160]",
+        get_line_color=[255, 255, 255],
+        pickable=True,
+        auto_highlight=True,
+    )
+    return pdk.Deck(
+        layers=[layer],
+        initial_view_state=pdk.ViewState(latitude=lat, longitude=lon, zoom=9, pitch=45, bearing=0),
+        tooltip={"text": "{nom}\n" + format_metric_label(metric) + ": {" + metric + "}"},
+        map_style="light",
+    )
+
+def map_chart_vector_tiles(meta, metric, url, height=500):
+    """Render the vector-tile 3D map (see map_vector_tiles_deck)."""
+    st.pydeck_chart(map_vector_tiles_deck(meta, metric, url), use_container_width=True, height=height)
+
+def map_surface_deck(image, bounds, opacity=0.8):
+    """
+    A precomputed surface image (utils.raster) as a BitmapLayer over the basemap.
+    `bounds` is [west, south, east, north]; the image is on a Web Mercator grid.
+    """
+    west, south, east, north = bounds
+    layer = pdk.Layer("BitmapLayer", image=image, bounds=bounds, opacity=opacity)
+    view_state = pdk.ViewState(
+        latitude=(south + north) / 2, longitude=(west + east) / 2, zoom=6, pitch=0, bearing=0
+    )
+    return pdk.Deck(layers=[layer], initial_view_state=view_state, map_style="light")
+
+def map_chart_surface(image, bounds, height=500):
+    """Render a smoothed surface image (see map_surface_deck)."""
+    st.pydeck_chart(map_surface_deck(image, bounds), use_container_width=True, height=height)
+
+def qualitative_palette(categories, alpha=200):
+    """RGBA colors (pydeck format) for categories, in the same order as Plotly's discrete colors."""
+    colors = px.colors.qualitative.Plotly
+    palette = {}
+    for i, cat in enumerate(categories):
+        hex_color = colors[i % len(colors)].lstrip('#')
+        palette[cat] = tuple(int(hex_color[j:j + 2], 16) for j in (0, 2, 4)) + (alpha,)
+    return palette
+
+@st.cache_data(show_spinner=False)
+def _prepare_category_data(_geo_data, _labels, cache_key, palette):
+    """
+    GeoJSON of communes colored by a categorical label (e.g. LISA or typology cluster).
+    `_labels` is a Series indexed by INSEE code; cached per `cache_key`.
+    """
+    geo, center_lat, center_lon = _to_wgs84(_geo_data[['lcog_geo', 'nom', 'geometry']])
+
+    palette = dict(palette)
+    geo['category'] = geo['lcog_geo'].astype(str).map(_labels).fillna("No data").astype(str)
+    geo['fill_color'] = geo['category'].map(lambda c: list(palette.get(c, (200, 200, 200, 80))))
+    return geo.__geo_interface__, center_lat, center_lon
+
+def map_chart_categorical(geo_data, labels, palette, label="Category", cache_key=None, height=500):
+    """Render communes colored by a categorical label (flat PyDeck layer)."""
+    if geo_data is None or geo_data.empty:
+        st.warning("No geographic data available.")
+        return
+
+    palette_items = tuple((k, tuple(v)) for k, v in palette.items())
+    geo_dict, center_lat, center_lon = _prepare_category_data(geo_data, labels, cache_key, palette_items)
+
+    layer = pdk.Layer(
+        "GeoJsonLayer",
+        data=geo_dict,
+        opacity=0.8,
+        stroked=True,
+        filled=True,
+        get_fill_color="properties.fill_color",
+        get_line_color=[255, 255, 255],
+        get_line_width=10,
+        pickable=True,
+        auto_highlight=True,
+    )
+    view_state = pdk.ViewState(latitude=center_lat, longitude=center_lon, zoom=7, pitch=0, bearing=0)
+    r = pdk.Deck(
+        layers=[layer],
+        initial_view_state=view_state,
+        tooltip={"text": "{nom}\n" + label + ": {category}"},
+        map_style="light",
+    )
+    st.pydeck_chart(r, use_container_width=True, height=height)
+
+def diverging_colors(vals, alpha=180):
+    """
+    RGBA colors on a diverging scale centred on zero (red < 0 < blue), shape (n, 4).
+    The scale saturates at the 95th percentile of |value| so a few outliers do not
+    wash out the map; missing values are drawn faint.
+    """
+    vals = np.asarray(vals, dtype=float)
+    valid = ~np.isnan(vals)
+    scale = np.nanpercentile(np.abs(vals), 95) if valid.any() else 1.0
+    t = np.clip(np.nan_to_num(vals) / (scale or 1.0), -1, 1)[:, None]
+    white = np.array([247, 247, 247])
+    pos, neg = np.array([33, 102, 172]), np.array([178, 24, 43])
+    rgb = np.where(t >= 0, white + t * (pos - white), white - t * (neg - white)).astype(int)
+    return np.hstack([rgb, np.where(valid, alpha, 40)[:, None]])
+
+@st.cache_data(show_spinner=False)
+def _prepare_diverging_data(_geo_data, _values, cache_key, label):
+    """
+    GeoJSON of communes colored on a diverging scale (see diverging_colors).
+    `_values` is a Series indexed by INSEE code.
+    """
+    geo, center_lat, center_lon = _to_wgs84(_geo_data[['lcog_geo', 'nom', 'geometry']])
+
+    vals = geo['lcog_geo'].astype(str).map(_values).to_numpy(dtype=float)
+    valid = ~np.isnan(vals)
+    geo['fill_color'] = diverging_colors(vals).tolist()
+    geo['formatted_val'] = [f"{v:+,.2f}" if ok else "No data" for v, ok in zip(vals, valid)]
+    return geo.__geo_interface__, center_lat, center_lon
+
+def map_chart_diverging(geo_data, values, label="Change", cache_key=None, height=500):
+    """Render communes colored by a signed value such as a change between vintages."""
+    if geo_data is None or geo_data.empty:
+        st.warning("No geographic data available.")
+        return
+
+    geo_dict, center_lat, center_lon = _prepare_diverging_data(geo_data, values, cache_key, label)
+
+    layer = pdk.Layer(
+        "GeoJsonLayer",
+        data=geo_dict,
+        opacity=0.8,
+        stroked=True,
+        filled=True,
+        get_fill_color="properties.fill_color",
+        get_line_color=[255, 255, 255],
+        get_line_width=10,
+        pickable=True,
+        auto_highlight=True,
+    )
+    view_state = pdk.ViewState(latitude=center_lat, longitude=center_lon, zoom=7, pitch=0, bearing=0)
+    r = pdk.Deck(
+        layers=[layer],
+        initial_view_state=view_state,
+        tooltip={"text": "{nom}\n" + label + ": {formatted_val}"},
+        map_style="light",
+    )
     st.pydeck_chart(r, use_container_width=True, height=height)
 
+@st.cache_data(show_spinner=False)
+def _prepare_tile_data(_tiles, value_col, cache_key):
+    """Records for the 1 km tile map: south-west corner, diverging color and formatted value."""
+    data = _tiles[['lon', 'lat']].copy()
+    vals = _tiles[value_col].to_numpy(dtype=float)
+    data['fill_color'] = diverging_colors(vals, alpha=200).tolist()
+    data['formatted_val'] = [f"{v:+,.2f}" if np.isfinite(v) else "No data" for v in vals]
+    return data
+
+def map_chart_tiles(tiles, value_col, label="Change", cache_key=None, height=500):
+    """Render 1 km grid tiles (lon/lat of their south-west corners) colored by a signed value."""
+    if tiles is None or tiles.empty:
+        st.warning("No tile data available.")
+        return
+
+    data = _prepare_tile_data(tiles, value_col, cache_key)
+    layer = pdk.Layer(
+        "GridCellLayer",
+        data=data,
+        get_position=["lon", "lat"],
+        cell_size=TILE_SIZE_M,
+        extruded=False,
+        get_fill_color="fill_color",
+        pickable=True,
+    )
+    view_state = pdk.ViewState(
+        latitude=float(data['lat'].mean()), longitude=float(data['lon'].mean()), zoom=7, pitch=0, bearing=0
+    )
+    r = pdk.Deck(
+        layers=[layer],
+        initial_view_state=view_state,
+        tooltip={"text": label + ": {formatted_val}"},
+        map_style="light",
+    )
+    st.pydeck_chart(r, use_container_width=True, height=height)
@@ -0,0 +1,317 @@
+import os
+import gzip
+import json
+import sqlite3
+import struct
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
+from utils.constants import (
+    VTILE_EXTENT, VTILE_BUFFER, VTILE_SIMPLIFY, VTILE_ZOOMS, METRICS, TILE_METRICS, TILE_SIZE_M
+)
+
+# Half the width of the Web Mercator square (EPSG:3857), in meters
+MERCATOR_HALF = 20037508.342789244
+
+# --- Protobuf encoding (vector tile spec 2.1, only what is written here) ---
+
+def _varint(value):
+    """Protobuf varint of one non-negative int."""
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def _varints(values):
+    """Concatenated protobuf varints of non-negative ints (< 2**35), vectorized for long runs."""
+    if len(values) < 64:
+        return b"".join(_varint(int(v)) for v in values)
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = np.maximum(1, (np.floor(np.log2(np.maximum(values, 1).astype(float))) // 7 + 1).astype(np.int64))
+    out = np.zeros((len(values), 5), dtype=np.uint8)
+    rest = values.copy()
+    for i in range(5):
+        more = n_bytes > i + 1
+        out[:, i] = (rest & np.uint64(0x7F)) | (more.astype(np.uint64) << np.uint64(7))
+        rest >>= np.uint64(7)
+    return out[np.arange(5) < n_bytes[:, None]].tobytes()
+
+def _tag(field, wire):
+    return _varint((field << 3) | wire)
+
+def _bytes_field(field, payload):
+    """Length-delimited field (strings, sub-messages, packed repeated ints)."""
+    return _tag(field, 2) + _varint(len(payload)) + payload
+
+def _uint_field(field, value):
+    return _tag(field, 0) + _varint(value)
+
+def _value(v):
+    """Tile Value message: strings, integers (sint64) or doubles."""
+    if isinstance(v, str):
+        return _bytes_field(1, v.encode("utf-8"))
+    if float(v).is_integer() and abs(v) < 2 ** 34:
+        return _uint_field(6, (int(v) << 1) ^ (int(v) >> 63))
+    return _tag(3, 1) + struct.pack("<d", float(v))
+
+def _zigzag(d):
+    return ((d << 1) ^ (d >> 63)).astype(np.uint64)
+
+def encode_polygons(geoms):
+    """
+    Command streams of (multi)polygons already in integer tile coordinates, with
+    exterior rings wound as the spec expects. One pass over the whole tile: rings
+    become MoveTo / LineTo / ClosePath runs, coordinates zigzag-encoded deltas
+    from a cursor reset at each feature.
+    Returns:
+        tuple: (uint64 stream, per-feature offsets into it)
+    """
+    _, coords, (ring_off, poly_off, multi_off) = shapely.to_ragged_array(
+        shapely.force_2d(shapely.multipolygons(shapely.get_parts(geoms), indices=_part_index(geoms)))
+    )
+    coords = np.rint(coords).astype(np.int64)
+    n_pts = np.diff(ring_off) - 1  # closing point dropped
+    ring_feature = np.repeat(np.repeat(np.arange(len(multi_off) - 1), np.diff(multi_off)), np.diff(poly_off))
+
+    keep = np.ones(len(coords), dtype=bool)
+    keep[ring_off[1:] - 1] = False
+    pts = coords[keep]
+    pt_ring = np.repeat(np.arange(len(n_pts)), n_pts)
+    pt_local = np.arange(len(pts)) - np.repeat(np.cumsum(n_pts) - n_pts, n_pts)
+
+    # Cursor: previous emitted point of the same feature, the origin at a feature start
+    prev = np.vstack([[0, 0], pts[:-1]])
+    first_of_feature = np.r_[True, ring_feature[pt_ring[1:]] != ring_feature[pt_ring[:-1]]]
+    prev[first_of_feature] = 0
+    delta = _zigzag(pts - prev)
+
+    ring_len = 2 * n_pts + 3
+    ring_start = np.cumsum(ring_len) - ring_len
+    stream = np.zeros(ring_len.sum(), dtype=np.uint64)
+    stream[ring_start] = 9                                              # MoveTo, 1 point
+    stream[ring_start + 3] = (2 | ((n_pts - 1) << 3)).astype(np.uint64)  # LineTo, n - 1 points
+    stream[ring_start + ring_len - 1] = 15                              # ClosePath
+    pos = ring_start[pt_ring] + np.where(pt_local == 0, 1, 2 * pt_local + 2)
+    stream[pos] = delta[:, 0]
+    stream[pos + 1] = delta[:, 1]
+
+    feature_len = np.bincount(ring_feature, weights=ring_len, minlength=len(multi_off) - 1).astype(np.int64)
+    return stream, np.r_[0, np.cumsum(feature_len)]
+
+def _part_index(geoms):
+    """Index of the source geometry of each part returned by shapely.get_parts."""
+    return np.repeat(np.arange(len(geoms)), shapely.get_num_geometries(geoms))
+
+def encode_layer(name, geoms, props, ids, extent=VTILE_EXTENT):
+    """
+    One vector tile layer of polygon features in tile coordinates, encoded as a
+    Tile `layers` field (a tile is the concatenation of its layers).
+    `props` is a DataFrame aligned with `geoms`; missing values are left out.
+    """
+    keys = list(props.columns)
+    values, lookup = [], {}
+    stream, offsets = encode_polygons(geoms)
+    columns = [props[k].to_numpy(dtype=object) for k in keys]
+    features = []
+    for i in range(len(geoms)):
+        tags = []
+        for k, col in enumerate(columns):
+            v = col[i]
+            if v is None or (isinstance(v, float) and v != v):
+                continue
+            j = lookup.get(v)
+            if j is None:
+                j = lookup[v] = len(values)
+                values.append(v)
+            tags += [k, j]
+        features.append(_bytes_field(2,
+            _uint_field(1, int(ids[i]))
+            + _bytes_field(2, _varints(tags))
+            + _uint_field(3, 3)  # POLYGON
+            + _bytes_field(4, _varints(stream[offsets[i]:offsets[i + 1]]))
+        ))
+    return _bytes_field(3,
+        _uint_field(15, 2)
+        + _bytes_field(1, name.encode("utf-8"))
+        + b"".join(features)
+        + b"".join(_bytes_field(3, k.encode("utf-8")) for k in keys)
+        + b"".join(_bytes_field(4, _value(v)) for v in values)
+        + _uint_field(5, extent)
+    )
+
+# --- Tiling ---
+
+def tile_bounds(z, x, y):
+    """Web Mercator bounds (minx, miny, maxx, maxy) of tile z/x/y (y from the top, XYZ scheme)."""
+    size = 2 * MERCATOR_HALF / 2 ** z
+    return (-MERCATOR_HALF + x * size, MERCATOR_HALF - (y + 1) * size,
+            -MERCATOR_HALF + (x + 1) * size, MERCATOR_HALF - y * size)
+
+def _tile_pairs(geoms, z):
+    """(geometry index, x, y) of every tile each geometry's bounding box touches, sorted by tile."""
+    size = 2 * MERCATOR_HALF / 2 ** z
+    b = shapely.bounds(geoms)
+    last = 2 ** z - 1
+    x0 = np.clip(((b[:, 0] + MERCATOR_HALF) // size).astype(np.int64), 0, last)
+    x1 = np.clip(((b[:, 2] + MERCATOR_HALF) // size).astype(np.int64), 0, last)
+    y0 = np.clip(((MERCATOR_HALF - b[:, 3]) // size).astype(np.int64), 0, last)
+    y1 = np.clip(((MERCATOR_HALF - b[:, 1]) // size).astype(np.int64), 0, last)
+    nx, ny = x1 - x0 + 1, y1 - y0 + 1
+    geom = np.repeat(np.arange(len(geoms)), nx * ny)
+    local = np.arange(len(geom)) - np.repeat(np.cumsum(nx * ny) - nx * ny, nx * ny)
+    x = x0[geom] + local % nx[geom]
+    y = y0[geom] + local // nx[geom]
+    order = np.lexsort((geom, y, x))
+    return geom[order], x[order], y[order]
+
+def cut_tiles(name, geoms, props, zooms, simplify=VTILE_SIMPLIFY, extent=VTILE_EXTENT, buffer=VTILE_BUFFER):
+    """
+    Cut polygons (EPSG:3857) into a z/x/y pyramid of single-layer vector tiles.
+    Geometries are simplified once per zoom (by `simplify` tile units), clipped to
+    each tile plus a `buffer`, snapped to the integer tile grid and re-oriented.
+    Yields:
+        tuple: (z, x, y, uncompressed tile bytes)
+    """
+    ids = np.arange(1, len(geoms) + 1)
+    for z in range(zooms[0], zooms[1] + 1):
+        unit = 2 * MERCATOR_HALF / 2 ** z / extent
+        simplified = shapely.simplify(geoms, unit * simplify, preserve_topology=True) if simplify else geoms
+        geom, xs, ys = _tile_pairs(simplified, z)
+        starts = np.flatnonzero(np.r_[True, (xs[1:] != xs[:-1]) | (ys[1:] != ys[:-1])])
+        for start, stop in zip(starts, np.r_[starts[1:], len(geom)]):
+            x, y = int(xs[start]), int(ys[start])
+            members = geom[start:stop]
+            minx, miny, maxx, maxy = tile_bounds(z, x, y)
+            pad = buffer * unit
+            clipped = shapely.clip_by_rect(simplified[members], minx - pad, miny - pad, maxx + pad, maxy + pad)
+            # To tile units (y down), snapped to the integer grid; collapsed parts disappear
+            clipped = shapely.transform(clipped, lambda c: np.column_stack([(c[:, 0] - minx) / unit,
+                                                                            (maxy - c[:, 1]) / unit]))
+            clipped = shapely.set_precision(clipped, 1.0)
+            ok = np.isin(shapely.get_type_id(clipped), (3, 6)) & ~shapely.is_empty(clipped)
+            if not ok.any():
+                continue
+            # The spec wants exteriors with a positive signed area in tile coordinates (y down)
+            oriented = shapely.orient_polygons(clipped[ok])
+            yield z, x, y, encode_layer(name, oriented, props.iloc[members[ok]], ids[members[ok]], extent)
+
+def commune_layer(tables, attributes=METRICS):
+    """
+    Communes of the latest vintage (the map geometry) in EPSG:3857 with their
+    code, name and metric values only.
+    Returns:
+        tuple: (geometries, attribute DataFrame)
+    """
+    geo = tables['geo']
+    # The CRS is repaired once in make_tables (utils.prep.repair_crs)
+    geoms = geo.to_crs(3857).geometry.to_numpy()
+    cols = ['lcog_geo', 'nom'] + [m for m in attributes if m in geo.columns]
+    props = geo[cols].reset_index(drop=True)
+    for m in cols[2:]:
+        props[m] = props[m].round(2)
+    ok = ~shapely.is_empty(geoms) & ~shapely.is_missing(geoms)
+    return geoms[ok], props[ok].reset_index(drop=True)
+
+def grid_layer(tables, year=None, attributes=TILE_METRICS):
+    """
+    1 km grid cells of one vintage (default: latest) in EPSG:3857, built from the
+    tile panel coordinates, with population and the tile-level metrics.
+    Returns:
+        tuple: (geometries, attribute DataFrame)
+    """
+    # Imported here, as in utils.tiles: utils.prep imports the tile modules
+    from utils.prep import derive_metrics
+    from utils.tiles import split_keys, _year_frame
+
+    panel = tables['tiles']
+    year = year or panel['years'][-1]
+    positions = panel['pos'][year]
+    row, col = split_keys(panel['keys'][positions])
+    cells = shapely.box(col * TILE_SIZE_M, row * TILE_SIZE_M, (col + 1) * TILE_SIZE_M, (row + 1) * TILE_SIZE_M)
+    to_mercator = pyproj.Transformer.from_crs(3035, 3857, always_xy=True)
+    cells = shapely.transform(cells, lambda c: np.column_stack(to_mercator.transform(c[:, 0], c[:, 1])))
+    frame = derive_metrics(_year_frame(panel, year, positions))
+    props = pd.DataFrame({'ind': frame['ind'].round()})
+    for m in attributes:
+        props[m] = frame[m].round(2)
+    return cells, props
+
+def metric_ranges(props):
+    """(min, max) of every numeric attribute, for client-side coloring."""
+    numeric = props.select_dtypes('number')
+    return {c: [float(numeric[c].min()), float(numeric[c].max())] for c in numeric.columns}
+
+# --- MBTiles storage ---
+
+def write_mbtiles(path, tiles, metadata):
+    """
+    Store tiles (z, x, y, bytes) in an MBTiles file: gzipped protobuf, TMS rows.
+    Written to a temporary file and renamed, so readers never see a partial pyramid.
+    Returns:
+        int: number of tiles written
+    """
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    conn.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+    conn.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+    n = 0
+    for z, x, y, data in tiles:
+        conn.execute("INSERT INTO tiles VALUES (?, ?, ?, ?)", (z, x, 2 ** z - 1 - y, gzip.compress(data, 6)))
+        n += 1
+    conn.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+    conn.executemany("INSERT INTO metadata VALUES (?, ?)", [(k, str(v)) for k, v in metadata.items()])
+    conn.commit()
+    conn.close()
+    os.replace(tmp, path)
+    return n
+
+def layer_metadata(name, props, zooms, geoms, fingerprint):
+    """MBTiles metadata for one layer: zoom range, WGS84 bounds, fields and value ranges."""
+    to_wgs = pyproj.Transformer.from_crs(3857, 4326, always_xy=True)
+    minx, miny, maxx, maxy = shapely.total_bounds(geoms)
+    (w, e), (s, n) = to_wgs.transform([minx, maxx], [miny, maxy])
+    fields = {c: "Number" if pd.api.types.is_numeric_dtype(props[c]) else "String" for c in props.columns}
+    return {
+        "name": name, "format": "pbf", "type": "overlay", "version": "2",
+        "minzoom": zooms[0], "maxzoom": zooms[1],
+        "bounds": f"{w:.5f},{s:.5f},{e:.5f},{n:.5f}",
+        "center": f"{(w + e) / 2:.5f},{(s + n) / 2:.5f},{zooms[0]}",
+        "json": json.dumps({"vector_layers": [
+            {"id": name, "fields": fields, "minzoom": zooms[0], "maxzoom": zooms[1]}
+        ]}),
+        "ranges": json.dumps(metric_ranges(props)),
+        "fingerprint": fingerprint,
+    }
+
+def build_layer(path, name, geoms, props, fingerprint, zooms=None, simplify=VTILE_SIMPLIFY):
+    """Cut one layer and store it at `path`. Returns the number of tiles."""
+    zooms = zooms or VTILE_ZOOMS[name]
+    tiles = cut_tiles(name, geoms, props, zooms, simplify)
+    return write_mbtiles(path, tiles, layer_metadata(name, props, zooms, geoms, fingerprint))
+
+def open_mbtiles(path):
+    """Read-only connection shared by the API server threads."""
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+def read_tile(conn, z, x, y):
+    """Gzipped tile z/x/y (XYZ scheme), or None when there is no feature in it."""
+    row = conn.execute(
+        "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+        (z, x, 2 ** z - 1 - y)
+    ).fetchone()
+    return row[0] if row else None
+
+def mbtiles_metadata(path):
+    """Metadata of an MBTiles file as a dict ('ranges' decoded), or None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    conn = open_mbtiles(path)
+    meta = dict(conn.execute("SELECT name, value FROM metadata").fetchall())
+    conn.close()
+    meta['ranges'] = json.loads(meta.get('ranges', '{}'))
+    return meta